@@ -0,0 +1,334 @@
+"""
+Admission control: per-view concurrency limits and per-user rate limits.
+
+``AdmissionMiddleware`` runs before the view is resolved by the handler:
+
+* Rate limit. With ``API_RATE_LIMIT_PER_SECOND`` set, each user (identified
+  by a valid access token, else by client address) has a token bucket of
+  ``API_RATE_LIMIT_BURST`` tokens refilled at that rate. Buckets live in the
+  SQLite file ``API_RATE_LIMIT_DB``, so every worker process on the host
+  shares them. A request finding its bucket empty gets 429 with
+  ``Retry-After``.
+* Concurrency. Each view (URL name) admits ``API_ADMISSION_LIMITS[view]``
+  requests at a time per process (``API_ADMISSION_DEFAULT_LIMIT`` for views
+  not listed). Up to ``API_ADMISSION_QUEUE_SIZE`` more wait in line, each
+  for at most ``API_ADMISSION_QUEUE_TIMEOUT`` seconds. A request that finds
+  the line full, or runs out of time in it, gets 503 with ``Retry-After``
+  instead of waiting until the proxy gives up on it.
+
+Waiting requests hold a server thread, so a view's requests (admitted and
+waiting) may take at most ``API_WORKER_THREADS`` minus
+``API_ADMISSION_RESERVED_THREADS`` of them, leaving the reserved threads to
+other views. Without an ``API_ADMISSION_QUEUE_SIZE``, the line of each view
+is as long as that allows.
+
+Cheap views get their own limits, so an overloaded product list can't make
+logout wait. Views in ``API_ADMISSION_EXEMPT`` (the metrics scrape and the
+event stream, which stays open) bypass both checks. Shed requests are
+counted in ``api_requests_shed_total`` (see ``api.metrics``).
+"""
+
+import logging
+import math
+import sqlite3
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.http import JsonResponse
+from django.urls import Resolver404, resolve
+from rest_framework import status
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+QUEUE_FULL = "queue_full"
+TIMEOUT = "timeout"
+RATE_LIMITED = "rate_limited"
+
+# Buckets are purged once full (as good as absent) every this many takes
+PURGE_EVERY = 1000
+
+
+class Gate:
+    """A concurrency limit with a bounded first-come first-served wait line."""
+
+    def __init__(self, limit, queue_size):
+        self.limit = limit
+        self.queue_size = queue_size
+        self.active = 0
+        self.waiting = 0
+        self._condition = threading.Condition()
+
+    def try_acquire(self):
+        with self._condition:
+            # Not ahead of requests already waiting
+            if self.active < self.limit and not self.waiting:
+                self.active += 1
+                return True
+            return False
+
+    def acquire(self, timeout):
+        """Wait for a slot; return None once admitted, else why the request is shed."""
+        with self._condition:
+            if self.active < self.limit and not self.waiting:
+                self.active += 1
+                return None
+            if self.waiting >= self.queue_size:
+                return QUEUE_FULL
+            self.waiting += 1
+            try:
+                if not self._condition.wait_for(
+                    lambda: self.active < self.limit, timeout
+                ):
+                    return TIMEOUT
+                self.active += 1
+                return None
+            finally:
+                self.waiting -= 1
+
+    def release(self):
+        with self._condition:
+            self.active -= 1
+            self._condition.notify()
+
+
+class Gates:
+    def __init__(self):
+        self._gates = {}
+        self._lock = threading.Lock()
+
+    def get(self, view):
+        limits = getattr(settings, "API_ADMISSION_LIMITS", {})
+        limit = limits.get(view, getattr(settings, "API_ADMISSION_DEFAULT_LIMIT", 8))
+        threads = max(
+            1,
+            getattr(settings, "API_WORKER_THREADS", 8)
+            - getattr(settings, "API_ADMISSION_RESERVED_THREADS", 2),
+        )
+        limit = min(limit, threads)
+        queue_size = getattr(settings, "API_ADMISSION_QUEUE_SIZE", None)
+        if queue_size is None:
+            queue_size = threads - limit
+        # Keyed by the settings too, so changing them takes effect
+        key = (view, limit, queue_size)
+        gate = self._gates.get(key)
+        if gate is None:
+            with self._lock:
+                gate = self._gates.setdefault(key, Gate(limit, queue_size))
+        return gate
+
+
+gates = Gates()
+
+TAKE_SQL = """
+INSERT INTO buckets (key, tokens, updated) VALUES (:key, :burst - 1, :now)
+ON CONFLICT (key) DO UPDATE SET
+    tokens = min(:burst, tokens + max(0, :now - updated) * :rate) - 1,
+    updated = :now
+WHERE min(:burst, tokens + max(0, :now - updated) * :rate) >= 1
+RETURNING tokens
+"""
+
+
+class TokenBuckets:
+    """
+    Token buckets in a SQLite file, shared by every process that opens it.
+
+    A take is one UPSERT, which refills the bucket for the time since its
+    last take and removes a token only if a whole one is left. SQLite
+    serializes the writes across processes.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def connection(self, path):
+        local = self._local
+        if getattr(local, "path", None) != path:
+            connection = sqlite3.connect(
+                path, timeout=1, isolation_level=None, check_same_thread=False
+            )
+            # Losing the last refills to a crash is harmless
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=OFF")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, "
+                "tokens REAL NOT NULL, updated REAL NOT NULL) WITHOUT ROWID"
+            )
+            local.connection, local.path, local.takes = connection, path, 0
+        return local.connection
+
+    def take(self, key, rate, burst, path, now=None):
+        """Take a token; return 0, or the seconds until one is available."""
+        now = time.time() if now is None else now
+        params = {"key": key, "rate": rate, "burst": burst, "now": now}
+        connection = self.connection(path)
+        self._local.takes += 1
+        if self._local.takes % PURGE_EVERY == 0:
+            connection.execute(
+                "DELETE FROM buckets WHERE updated < :now - :burst / :rate", params
+            )
+        if connection.execute(TAKE_SQL, params).fetchone() is not None:
+            return 0
+        (tokens,) = connection.execute(
+            "SELECT min(:burst, tokens + max(0, :now - updated) * :rate) "
+            "FROM buckets WHERE key = :key",
+            params,
+        ).fetchone()
+        return (1 - tokens) / rate
+
+
+buckets = TokenBuckets()
+
+
+def rate_limit_key(request):
+    auth_header = request.headers.get("Authorization", "")
+    if auth_header.startswith("Bearer "):
+        try:
+            token = AccessToken(auth_header.split(" ", 1)[1])
+            return f"user:{token[jwt_settings.USER_ID_CLAIM]}"
+        except (TokenError, KeyError):
+            pass
+    address = request.META.get("REMOTE_ADDR", "")
+    if address in ("127.0.0.1", "::1"):
+        # Behind the local nginx, which passes the client's address
+        address = request.headers.get("X-Real-IP", address)
+    return f"ip:{address}"
+
+
+def rate_limited():
+    return bool(getattr(settings, "API_RATE_LIMIT_PER_SECOND", 0))
+
+
+def check_rate_limit(request):
+    """Seconds the client has to wait before this request is allowed, or 0."""
+    if not rate_limited():
+        return 0
+    rate = settings.API_RATE_LIMIT_PER_SECOND
+    burst = getattr(settings, "API_RATE_LIMIT_BURST", 2 * rate)
+    try:
+        return buckets.take(
+            rate_limit_key(request), rate, burst, settings.API_RATE_LIMIT_DB
+        )
+    except sqlite3.Error:
+        # Fail open: the limiter must not take the API down with it
+        logger.exception("Rate limit check failed")
+        return 0
+
+
+def shed(request, view, reason, retry_after):
+    registry.shard.inc("api_requests_shed_total", (view, reason))
+    if reason == RATE_LIMITED:
+        status_code, error = status.HTTP_429_TOO_MANY_REQUESTS, "Too many requests"
+    else:
+        status_code, error = status.HTTP_503_SERVICE_UNAVAILABLE, "Server overloaded"
+    response = JsonResponse({"error": error}, status=status_code)
+    response["Retry-After"] = str(max(1, math.ceil(retry_after)))
+    return response
+
+
+def release_after(response, gate):
+    if response.streaming:
+        # The view's work isn't done until the body has been streamed
+        response._resource_closers.append(gate.release)
+    else:
+        gate.release()
+    return response
+
+
+class AdmissionMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        view = self.admit(request)
+        if view is None:
+            return self.get_response(request)
+        response = self.check_rate_limit(request, view)
+        if response is not None:
+            return response
+
+        gate = gates.get(view)
+        if not gate.try_acquire():
+            reason = self.wait(gate, view)
+            if reason is not None:
+                return shed(request, view, reason, self.retry_after())
+        try:
+            response = self.get_response(request)
+        except BaseException:
+            gate.release()
+            raise
+        return release_after(response, gate)
+
+    async def __acall__(self, request):
+        view = self.admit(request)
+        if view is None:
+            return await self.get_response(request)
+        if rate_limited():
+            # The buckets are a blocking SQLite write; keep it off the loop
+            response = await sync_to_async(
+                self.check_rate_limit, thread_sensitive=False
+            )(request, view)
+            if response is not None:
+                return response
+
+        gate = gates.get(view)
+        if not gate.try_acquire():
+            # Waits in a thread of its own; the line bounds how many
+            reason = await sync_to_async(self.wait, thread_sensitive=False)(gate, view)
+            if reason is not None:
+                return shed(request, view, reason, self.retry_after())
+        try:
+            response = await self.get_response(request)
+        except BaseException:
+            gate.release()
+            raise
+        return release_after(response, gate)
+
+    def admit(self, request):
+        """The view to rate limit and gate, or None to pass the request on."""
+        try:
+            match = resolve(request.path_info)
+        except Resolver404:
+            return None
+        if match.view_name in getattr(settings, "API_ADMISSION_EXEMPT", ()):
+            return None
+        # Labels the metrics of requests shed before the handler resolves them
+        request.resolver_match = match
+        return match.view_name
+
+    def check_rate_limit(self, request, view):
+        """The 429 response for a request over its rate limit, or None."""
+        retry_after = check_rate_limit(request)
+        if retry_after:
+            return shed(request, view, RATE_LIMITED, retry_after)
+        return None
+
+    def wait(self, gate, view):
+        shard = registry.shard
+        shard.inc("api_admission_waiting")
+        started = time.perf_counter()
+        try:
+            return gate.acquire(getattr(settings, "API_ADMISSION_QUEUE_TIMEOUT", 5))
+        finally:
+            shard.observe(
+                "api_admission_wait_seconds", (view,), time.perf_counter() - started
+            )
+            shard.inc("api_admission_waiting", amount=-1)
+
+    def retry_after(self):
+        return getattr(settings, "API_ADMISSION_RETRY_AFTER", 1)
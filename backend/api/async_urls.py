@@ -0,0 +1,23 @@
+"""
+The API with the endpoints of ``api.async_views`` in place of their DRF
+views, served when ``API_ASYNC_VIEWS`` is set (see ``core.async_urls``).
+"""
+
+from django.urls import path
+
+from . import async_views
+from .urls import urlpatterns as drf_urlpatterns
+
+urlpatterns = [
+    path("login/", async_views.login_user, name="login"),
+    path("logout/", async_views.logout_user, name="logout"),
+    path("products/", async_views.product_list, name="product-list"),
+    path("products/<int:pk>/", async_views.product_detail, name="product-detail"),
+    path(
+        "products/<int:pk>/select/",
+        async_views.product_select,
+        name="product-select",
+    ),
+    # Everything else, e.g. export and bulk select, stays on the DRF views
+    *drf_urlpatterns,
+]
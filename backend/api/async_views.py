@@ -0,0 +1,246 @@
+"""
+Async product and session endpoints for the ASGI application.
+
+With ``API_ASYNC_VIEWS`` set, the product list, retrieve and select
+endpoints and login/logout are served by these views instead of the DRF
+ones (see ``api.async_urls``). They answer with the same data, ETags,
+response cache and errors, using the same serializer and pagination.
+
+Product reads use the async ORM, so a request waiting for the database
+doesn't hold a worker thread. Authentication, which can refresh the token
+revocation list, and the writes, which need transactions the async ORM
+doesn't have, run through ``sync_to_async``. Django runs the queries of a
+process on one thread either way, so each uvicorn worker is bounded by its
+database round trips; add workers to use more connections.
+"""
+
+import functools
+import logging
+
+from asgiref.sync import sync_to_async
+from django.http import Http404, HttpResponse
+from django.utils.cache import patch_vary_headers
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import status
+from rest_framework.exceptions import (
+    AuthenticationFailed,
+    MethodNotAllowed,
+    NotAuthenticated,
+    NotFound,
+)
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+from rest_framework.views import exception_handler
+
+from .authentication import ClaimsJWTAuthentication
+from .caching import (
+    aget_catalog_version,
+    cache_response,
+    cached_response,
+    make_etag,
+    matching_etag,
+    read_headers,
+    response_key,
+)
+from .models import Product
+from .pagination import KeysetPagination
+from .routers import read_from_replicas
+from .selection import toggle_selection
+from .serializers import ProductSerializer
+from .views import end_session, product_queryset, requested_fields, start_session
+
+logger = logging.getLogger(__name__)
+
+
+def render(request, data, status_code=status.HTTP_200_OK, headers=None):
+    renderer = request.accepted_renderer
+    content_type = renderer.media_type
+    if renderer.charset:
+        content_type += f"; charset={renderer.charset}"
+    response = HttpResponse(
+        renderer.render(data, request.accepted_media_type, {"request": request}),
+        status=status_code,
+        content_type=content_type,
+        headers=headers,
+    )
+    # Kept like Response.data, which the API test client exposes
+    response.data = data
+    return response
+
+
+def handle_exception(request, exc):
+    # As APIView.handle_exception: 401 only with a challenge to send
+    if isinstance(exc, (NotAuthenticated, AuthenticationFailed)):
+        authenticators = request.authenticators
+        header = (
+            authenticators[0].authenticate_header(request) if authenticators else None
+        )
+        if header:
+            exc.auth_header = header
+        else:
+            exc.status_code = status.HTTP_403_FORBIDDEN
+    response = exception_handler(exc, {"request": request})
+    if response is None:
+        raise exc
+    headers = {
+        name: value
+        for name, value in response.items()
+        if name.lower() != "content-type"
+    }
+    return render(request, response.data, response.status_code, headers)
+
+
+def authenticate(request, public, replica_reads):
+    user = request.user
+    if not public and not (user and user.is_authenticated):
+        raise NotAuthenticated()
+    if replica_reads:
+        read_from_replicas(user.pk)
+
+
+def endpoint(methods, authentication_classes, public=False, replica_reads=False):
+    """
+    Wrap an async view taking a DRF ``Request`` the way ``api_view`` would:
+    method check, authentication (and ``IsAuthenticated`` unless ``public``),
+    rendering with the default renderer and DRF's error responses.
+    """
+
+    def decorator(view):
+        @csrf_exempt
+        @functools.wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            request = Request(
+                request,
+                parsers=[parser() for parser in api_settings.DEFAULT_PARSER_CLASSES],
+                authenticators=[auth() for auth in authentication_classes],
+            )
+            renderer = api_settings.DEFAULT_RENDERER_CLASSES[0]()
+            request.accepted_renderer = renderer
+            request.accepted_media_type = renderer.media_type
+            try:
+                if request.method not in methods:
+                    raise MethodNotAllowed(request.method)
+                await sync_to_async(authenticate)(request, public, replica_reads)
+                response = await view(request, *args, **kwargs)
+            except Exception as exc:
+                response = handle_exception(request, exc)
+            patch_vary_headers(response, ["Accept"])
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+async def conditional_read(request, produce):
+    """Async counterpart of ``ConditionalReadMixin.conditional_read``."""
+    etag = make_etag(await aget_catalog_version(), request)
+    headers = read_headers(etag)
+
+    tag = matching_etag(request, etag)
+    if tag is not None:
+        return HttpResponse(
+            status=status.HTTP_304_NOT_MODIFIED, headers={**headers, "ETag": tag}
+        )
+
+    key = response_key(request)
+    cached = cached_response(request, key, etag, headers)
+    if cached is not None:
+        return cached
+
+    response = render(request, await produce(), headers=headers)
+    cache_response(request, key, etag, response)
+    return response
+
+
+def serializer_context(request, fields=None):
+    return {"request": request, "fields": fields}
+
+
+@endpoint(["GET", "HEAD"], [ClaimsJWTAuthentication], replica_reads=True)
+async def product_list(request):
+    fields = requested_fields(request.query_params)
+
+    async def produce():
+        paginator = KeysetPagination()
+        queryset = product_queryset(request.user, request.query_params, fields)
+        page = await paginator.apaginate_queryset(queryset, request)
+        serializer = ProductSerializer(
+            page, many=True, context=serializer_context(request, fields)
+        )
+        return {"next": paginator.get_next_link(), "results": serializer.data}
+
+    return await conditional_read(request, produce)
+
+
+async def get_product(request, pk, fields=None):
+    queryset = product_queryset(request.user, request.query_params, fields)
+    try:
+        return await queryset.aget(pk=pk)
+    except Product.DoesNotExist:
+        # The message get_object_or_404 gives the DRF views
+        raise Http404("No Product matches the given query.")
+
+
+@endpoint(["GET", "HEAD"], [ClaimsJWTAuthentication], replica_reads=True)
+async def product_detail(request, pk):
+    fields = requested_fields(request.query_params)
+
+    async def produce():
+        product = await get_product(request, pk, fields)
+        return ProductSerializer(
+            product, context=serializer_context(request, fields)
+        ).data
+
+    return await conditional_read(request, produce)
+
+
+@endpoint(["POST"], [ClaimsJWTAuthentication])
+async def product_select(request, pk):
+    try:
+        await sync_to_async(toggle_selection)(request.user, pk)
+    except Product.DoesNotExist:
+        raise NotFound()
+
+    # Loaded after the toggle so is_selected reflects it
+    product = await get_product(request, pk)
+    return render(
+        request, ProductSerializer(product, context=serializer_context(request)).data
+    )
+
+
+@endpoint(["POST"], api_settings.DEFAULT_AUTHENTICATION_CLASSES, public=True)
+async def login_user(request):
+    logger.info("Received login request for %r", request.data.get("username"))
+
+    username = request.data.get("username")
+    if not username:
+        return render(
+            request,
+            {"error": "Username is required"},
+            status.HTTP_400_BAD_REQUEST,
+        )
+
+    data = await sync_to_async(start_session)(username, request.data.get("email", ""))
+    return render(request, data)
+
+
+@endpoint(["POST"], api_settings.DEFAULT_AUTHENTICATION_CLASSES)
+async def logout_user(request):
+    try:
+        auth_header = request.headers.get("Authorization")
+        if not auth_header or not auth_header.startswith("Bearer "):
+            return render(
+                request,
+                {"error": "No valid token found"},
+                status.HTTP_400_BAD_REQUEST,
+            )
+
+        token = auth_header.split(" ")[1]
+        await sync_to_async(end_session)(request.user, token)
+        return render(request, {"message": "Successfully logged out"})
+    except Exception as e:
+        logger.error("Error during logout: %s", e)
+        return render(
+            request, {"error": "Failed to logout"}, status.HTTP_400_BAD_REQUEST
+        )
@@ -1,6 +1,5 @@
 from django.contrib.auth.backends import BaseBackend
 from django.contrib.auth import get_user_model
-from django.db import transaction
 
 
 class AnyCredentialsBackend(BaseBackend):
@@ -9,13 +8,8 @@ class AnyCredentialsBackend(BaseBackend):
         if not username:
             return None
 
-        with transaction.atomic():
-            # Get or create user with the given username
-            user, created = User.objects.get_or_create(
-                username=username,
-                defaults={"email": username},  # Use username as email for simplicity
-            )
-            return user
+        # Use username as email for simplicity
+        return User.objects.get_or_create_for_login(username, email=username)
 
     def get_user(self, user_id):
         User = get_user_model()
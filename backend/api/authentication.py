@@ -0,0 +1,129 @@
+"""
+JWT authentication without a user query per request.
+
+simplejwt's ``JWTAuthentication`` loads the ``CustomUser`` row for every
+authenticated request. ``ClaimsJWTAuthentication`` instead returns a
+``ClaimsUser`` built from the verified token: the id and username come from
+the claims (``login_user`` adds ``username``), which is all the product
+endpoints use. Any other attribute hydrates the full row on first access,
+through a bounded per-process cache with a TTL, so views that do need it pay
+at most one query per user and TTL.
+
+Tokens revoked on logout are rejected (see ``api.blacklist``). So are the
+tokens of users who are deactivated or deleted: the claims can't say whether
+a user is still active, so ``is_active`` is always true for a valid token
+and ``api.signals`` revokes the tokens issued to the user until then
+instead.
+Hydrated users are dropped from the cache on logout (``forget_user``) and
+whenever the row is saved or deleted.
+"""
+
+import copy
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from .blacklist import revoked_tokens
+from .caching import LRUCache
+
+USERNAME_CLAIM = "username"
+
+user_cache = LRUCache(
+    maxsize=getattr(settings, "AUTH_USER_CACHE_SIZE", 1024),
+    ttl=getattr(settings, "AUTH_USER_CACHE_TTL", 300),
+)
+
+
+def get_cached_user(user_id):
+    """Return a private copy of the user row, loading it on a cache miss."""
+    user = user_cache.get(user_id)
+    if user is None:
+        user = get_user_model().objects.get(pk=user_id)
+        user_cache.set(user_id, user)
+    # Cached instances are shared between threads; hand out copies
+    return copy.copy(user)
+
+
+def forget_user(user_id):
+    user_cache.delete(user_id)
+
+
+class ClaimsUser:
+    """
+    Authenticated user backed by verified token claims.
+
+    Attributes that the claims don't carry are read from the full user,
+    which is loaded the first time one of them is accessed.
+    """
+
+    is_active = True
+    is_authenticated = True
+    is_anonymous = False
+
+    def __init__(self, token):
+        self.token = token
+        # simplejwt serializes the id claim as a string
+        user_id = token[api_settings.USER_ID_CLAIM]
+        self.id = self.pk = get_user_model()._meta.pk.to_python(user_id)
+
+    @property
+    def username(self):
+        username = self.token.get(USERNAME_CLAIM)
+        if username is None:
+            # Issued before the claim was added
+            return self.user.username
+        return username
+
+    @property
+    def user(self):
+        if "_user" not in self.__dict__:
+            self._user = get_cached_user(self.pk)
+        return self._user
+
+    def get_username(self):
+        return self.username
+
+    def __getattr__(self, name):
+        # Only called for attributes missing above; private names are not
+        # forwarded so copying or pickling can't recurse into a query
+        if name.startswith("_") or "token" not in self.__dict__:
+            raise AttributeError(name)
+        return getattr(self.user, name)
+
+    def __eq__(self, other):
+        if isinstance(other, (ClaimsUser, get_user_model())):
+            return self.pk == other.pk
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(self.pk)
+
+    def __str__(self):
+        return self.username
+
+
+class ClaimsJWTAuthentication(JWTAuthentication):
+    """
+    ``JWTAuthentication`` returning a ``ClaimsUser`` instead of the DB row and
+    rejecting blacklisted access tokens.
+    """
+
+    def get_validated_token(self, raw_token):
+        token = super().get_validated_token(raw_token)
+        if revoked_tokens.is_revoked(token[api_settings.JTI_CLAIM]):
+            raise InvalidToken("Token is blacklisted")
+        user_id = token.get(api_settings.USER_ID_CLAIM)
+        # Tokens without iat predate any revocation
+        if user_id is not None and revoked_tokens.is_user_revoked(
+            user_id, token.get("iat", 0)
+        ):
+            raise InvalidToken("Token is blacklisted")
+        return token
+
+    def get_user(self, validated_token):
+        if api_settings.USER_ID_CLAIM not in validated_token:
+            raise InvalidToken("Token contained no recognizable user identification")
+        return ClaimsUser(validated_token)
@@ -0,0 +1,8 @@
+"""
+In-process API benchmarks, run with ``python manage.py benchmark``.
+
+A run seeds a throwaway test database (``database``, ``workload``), replays
+each scenario with concurrent simulated clients through the WSGI and/or
+ASGI handlers without a network (``runner``) and can store the results as a
+JSON baseline or compare them with an earlier one (``baseline``).
+"""
@@ -0,0 +1,80 @@
+"""
+JSON baselines of benchmark results and regression checks against them.
+
+A baseline looks like::
+
+    {
+        "meta": {"created": "...", "products": 1000, ...},
+        "results": {"wsgi products": {"rps": 812.4, "p95_ms": 14.2, ...}}
+    }
+"""
+
+import json
+import platform
+from datetime import datetime, timezone
+
+import django
+from django.db import connection
+
+# A run regresses when its rps or latency is worse than the baseline by more
+# than the threshold (a fraction), or its average query count grew by more than
+# the tolerance (time-based cache expiry makes it vary a little between runs).
+DEFAULT_THRESHOLD = 0.2
+QUERY_TOLERANCE = 0.5
+LATENCY_METRICS = ("p50_ms", "p95_ms", "p99_ms")
+
+
+def make_baseline(results, **meta):
+    return {
+        "meta": {
+            "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "django": django.get_version(),
+            "database": connection.vendor,
+            **meta,
+        },
+        "results": results,
+    }
+
+
+def save_baseline(path, baseline):
+    with open(path, "w") as f:
+        json.dump(baseline, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def load_baseline(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """
+    Return ``(name, metric, before, after)`` for every metric of ``results``
+    that regressed against the ``baseline`` results. Benchmarks missing from
+    either side are skipped.
+    """
+    regressions = []
+    for name, after in results.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        checks = [
+            ("rps", after["rps"] < before["rps"] * (1 - threshold)),
+            *(
+                (metric, after[metric] > before[metric] * (1 + threshold))
+                for metric in LATENCY_METRICS
+            ),
+            (
+                "queries_per_request",
+                after["queries_per_request"]
+                > before["queries_per_request"] + QUERY_TOLERANCE,
+            ),
+            ("errors", after["errors"] > before["errors"]),
+        ]
+        regressions.extend(
+            (name, metric, before[metric], after[metric])
+            for metric, regressed in checks
+            if regressed
+        )
+    return regressions
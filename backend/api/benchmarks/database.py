@@ -0,0 +1,31 @@
+"""
+Throwaway databases for the benchmark commands.
+
+Benchmarks create and delete users and products, so they never run against
+the configured database: ``throwaway_database()`` creates a test database,
+as the test runner does, and destroys it afterwards.
+"""
+
+import os
+import tempfile
+from contextlib import contextmanager
+
+from django.db import connection
+
+
+@contextmanager
+def throwaway_database():
+    """Point the default connection at a fresh, migrated test database."""
+    with tempfile.TemporaryDirectory() as tmp:
+        if connection.vendor == "sqlite":
+            # Concurrent clients need a real file, not a shared-cache memory DB
+            connection.settings_dict["TEST"]["NAME"] = os.path.join(
+                tmp, "benchmark.sqlite3"
+            )
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False
+        )
+        try:
+            yield
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
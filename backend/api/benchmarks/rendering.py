@@ -0,0 +1,52 @@
+"""
+Serialize-and-render micro-benchmark for the product list renderers.
+
+Products are built in memory, shaped like ``with_selection()`` results (the
+``is_selected`` annotation and a prefetched ``selected_by``), so the numbers
+only cover ``ProductSerializer`` and the renderer.
+"""
+
+import random
+import time
+from decimal import Decimal
+
+from api.models import CustomUser, Product
+from api.seeding import generate_rows
+from api.serializers import ProductSerializer
+
+
+def build_products(count, seed=0):
+    rng = random.Random(seed)
+    users = [CustomUser(pk=i, username=f"user{i}") for i in range(1, 21)]
+    products = []
+    for i, (name, description, price, stock) in enumerate(
+        generate_rows((0, count, seed)), start=1
+    ):
+        product = Product(
+            pk=i,
+            name=name,
+            description=description,
+            price=Decimal(f"{price:.2f}"),
+            stock=stock,
+            selection_count=rng.randint(0, 3),
+        )
+        product.is_selected = rng.random() < 0.1
+        product._prefetched_objects_cache = {
+            "selected_by": rng.sample(users, product.selection_count)
+        }
+        products.append(product)
+    return products
+
+
+def measure(renderer, products, repeat=5):
+    """Best-of-``repeat`` ``(serialize seconds, render seconds, body)``."""
+    best_serialize = best_render = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        data = {"next": None, "results": ProductSerializer(products, many=True).data}
+        serialized = time.perf_counter()
+        body = renderer.render(data, "application/json")
+        rendered = time.perf_counter()
+        best_serialize = min(best_serialize, serialized - started)
+        best_render = min(best_render, rendered - serialized)
+    return best_serialize, best_render, body
@@ -0,0 +1,167 @@
+"""
+Drive scenarios through the WSGI or ASGI handler in-process.
+
+Requests go through the full middleware stack via Django's test clients
+(``Client`` for WSGI, ``AsyncClient`` for ASGI) but no socket. WSGI clients
+run on a thread pool, ASGI clients as tasks on one event loop, which is how
+the two servers schedule them.
+
+Requests are built before their timer starts. Queries are counted per
+request with an execute wrapper installed on every database connection; the
+count lives in a context variable, so it follows a request into the thread
+``sync_to_async`` runs its view in. Response sizes are the body bytes sent,
+after any compression; CPU time is the process's, so it includes the
+clients' share.
+"""
+
+import asyncio
+import contextvars
+import statistics
+import time
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.test import AsyncClient, Client
+
+INTERFACES = ("wsgi", "asgi")
+
+_query_count = contextvars.ContextVar("benchmark_query_count", default=None)
+
+
+def _count_queries(execute, sql, params, many, context):
+    counter = _query_count.get()
+    if counter is not None:
+        counter[0] += 1
+    return execute(sql, params, many, context)
+
+
+def _install_counter(sender, connection, **kwargs):
+    if _count_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_count_queries)
+
+
+def install_query_counter():
+    """Count queries on every connection opened from now on."""
+    connection_created.connect(_install_counter)
+
+
+def _request_kwargs(call, headers):
+    kwargs = {"headers": dict(headers)}
+    if call.token:
+        kwargs["headers"]["Authorization"] = f"Bearer {call.token}"
+    if call.method != "get":
+        kwargs["data"] = call.data
+        kwargs["content_type"] = "application/json"
+    return kwargs
+
+
+def _sample(response, started, counter):
+    # Streamed bodies aren't read
+    size = 0 if response.streaming else len(response.content)
+    return response.status_code, time.perf_counter() - started, counter[0], size
+
+
+def _sync_request(client, call, headers):
+    counter = [0]
+    _query_count.set(counter)
+    started = time.perf_counter()
+    kwargs = _request_kwargs(call, headers)
+    response = getattr(client, call.method)(call.path, **kwargs)
+    return _sample(response, started, counter)
+
+
+async def _async_request(client, call, headers):
+    counter = [0]
+    _query_count.set(counter)
+    started = time.perf_counter()
+    kwargs = _request_kwargs(call, headers)
+    response = await getattr(client, call.method)(call.path, **kwargs)
+    return _sample(response, started, counter)
+
+
+def run_wsgi(scenario, workload, indexes, concurrency, headers):
+    def client_loop(indexes):
+        client = Client()
+        try:
+            return [
+                _sync_request(client, scenario(workload, i), headers) for i in indexes
+            ]
+        finally:
+            connections.close_all()
+
+    chunks = [indexes[c::concurrency] for c in range(concurrency)]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        samples = [
+            sample for chunk in pool.map(client_loop, chunks) for sample in chunk
+        ]
+    return samples, time.perf_counter() - started
+
+
+def run_asgi(scenario, workload, indexes, concurrency, headers):
+    async def client_loop(indexes):
+        client = AsyncClient()
+        samples = []
+        for i in indexes:
+            samples.append(await _async_request(client, scenario(workload, i), headers))
+        return samples
+
+    async def main():
+        chunks = [indexes[c::concurrency] for c in range(concurrency)]
+        try:
+            return await asyncio.gather(*map(client_loop, chunks))
+        finally:
+            # Sync views ran in sync_to_async's thread, which owns connections
+            await sync_to_async(connections.close_all)()
+
+    started = time.perf_counter()
+    chunks = asyncio.run(main())
+    samples = [sample for chunk in chunks for sample in chunk]
+    return samples, time.perf_counter() - started
+
+
+RUNNERS = {"wsgi": run_wsgi, "asgi": run_asgi}
+
+
+def summarize(samples, elapsed, cpu_time):
+    latencies = sorted(latency * 1000 for _, latency, _, _ in samples)
+    if len(latencies) > 1:
+        percentiles = statistics.quantiles(latencies, n=100, method="inclusive")
+    else:
+        percentiles = latencies * 99
+    return {
+        "requests": len(samples),
+        "errors": sum(not 200 <= status < 300 for status, _, _, _ in samples),
+        "rps": round(len(samples) / elapsed, 1),
+        "p50_ms": round(percentiles[49], 2),
+        "p95_ms": round(percentiles[94], 2),
+        "p99_ms": round(percentiles[98], 2),
+        "queries_per_request": round(
+            sum(queries for _, _, queries, _ in samples) / len(samples), 2
+        ),
+        "bytes_per_request": round(
+            sum(size for _, _, _, size in samples) / len(samples)
+        ),
+        "cpu_ms_per_request": round(cpu_time * 1000 / len(samples), 2),
+    }
+
+
+def run(interface, scenario, workload, requests, concurrency, warmup=0, headers=()):
+    """
+    Send ``warmup`` unmeasured requests, then ``requests`` measured ones from
+    ``concurrency`` clients, and return their summary. ``headers`` are added
+    to every request.
+
+    The two phases use distinct request indexes, so scenarios that spread
+    requests over the workload by index don't just replay the warmup.
+    """
+    runner = partial(RUNNERS[interface], scenario, workload, headers=dict(headers))
+    if warmup:
+        runner(range(warmup), min(concurrency, warmup))
+    indexes = range(warmup, warmup + requests)
+    cpu_started = time.process_time()
+    samples, elapsed = runner(indexes, concurrency)
+    return summarize(samples, elapsed, time.process_time() - cpu_started)
@@ -0,0 +1,94 @@
+"""
+Benchmark data and the requests each scenario sends.
+
+A scenario is a function ``(workload, i) -> Call`` describing the ``i``-th
+request of a run. Scenarios only read from the workload, so any number of
+simulated clients can build their requests concurrently.
+"""
+
+from collections import namedtuple
+from io import StringIO
+
+from django.core.management import call_command
+from rest_framework_simplejwt.tokens import AccessToken
+
+from api.authentication import USERNAME_CLAIM
+from api.management.commands.seed_products import SEED_USERNAME_PREFIX
+from api.models import CustomUser, Product
+from api.pagination import KeysetPagination
+from api.seeding import PRODUCT_CATEGORIES
+
+Call = namedtuple("Call", ["method", "path", "data", "token"])
+
+
+def access_token(user):
+    token = AccessToken.for_user(user)
+    token[USERNAME_CLAIM] = user.username
+    return str(token)
+
+
+class Workload:
+    """Seeded catalog and users, plus an access token per user."""
+
+    def __init__(self, products, users, seed=0):
+        call_command(
+            "seed_products",
+            count=products,
+            users=users,
+            seed=seed,
+            stdout=StringIO(),
+        )
+        self.users = list(
+            CustomUser.objects.filter(
+                username__startswith=SEED_USERNAME_PREFIX
+            ).order_by("pk")
+        )
+        self.tokens = [access_token(user) for user in self.users]
+        self.product_ids = list(
+            Product.objects.order_by("pk").values_list("pk", flat=True)
+        )
+        middle = self.product_ids[len(self.product_ids) // 2]
+        self.cursor = KeysetPagination().encode_cursor("id", middle, middle)
+
+    def token(self, i):
+        return self.tokens[i % len(self.tokens)]
+
+
+def login(workload, i):
+    user = workload.users[i % len(workload.users)]
+    return Call("post", "/api/login/", {"username": user.username}, None)
+
+
+def products(workload, i):
+    return Call("get", "/api/products/", None, workload.token(i))
+
+
+def products_page(workload, i):
+    path = f"/api/products/?cursor={workload.cursor}"
+    return Call("get", path, None, workload.token(i))
+
+
+def products_search(workload, i):
+    term = PRODUCT_CATEGORIES[i % len(PRODUCT_CATEGORIES)].split()[0].lower()
+    return Call("get", f"/api/products/?search={term}", None, workload.token(i))
+
+
+def select(workload, i):
+    product_id = workload.product_ids[i * 7919 % len(workload.product_ids)]
+    return Call("post", f"/api/products/{product_id}/select/", {}, workload.token(i))
+
+
+def logout(workload, i):
+    # Logging out revokes the token, so every logout needs a fresh one
+    user = workload.users[i % len(workload.users)]
+    return Call("post", "/api/logout/", {}, access_token(user))
+
+
+SCENARIOS = {
+    "login": login,
+    "products": products,
+    "products_page": products_page,
+    "products_search": products_search,
+    "select": select,
+    "logout": logout,
+}
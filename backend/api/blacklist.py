@@ -0,0 +1,273 @@
+"""
+Revoked access tokens.
+
+``logout_user`` blacklists the access token it was called with through
+``revoke()``, and ``ClaimsJWTAuthentication`` rejects blacklisted tokens with
+``is_revoked()``. Deactivating or deleting a user (``revoke_user()``, see
+``api.signals``) blacklists a marker row instead of the user's tokens, which
+logins don't record: its jti is ``user:<id>:<random>`` and its
+``created_at`` the time of the revocation, and ``is_user_revoked()`` rejects
+the user's tokens issued before it.
+
+Checking the ``BlacklistedToken`` table on every request would cost a join
+per request, so each process keeps:
+
+* a Bloom filter of the revoked JTIs. Most tokens were never revoked, and
+  the filter answers "no" for them without touching the database.
+* an exact LRU of JTIs the filter matched, remembering the database answer
+  for the filter's rare false positives as well as for real revocations.
+
+The filter is refreshed incrementally: every ``TOKEN_BLACKLIST_REFRESH_SECONDS``
+a process reads the blacklist rows added since the last id it saw, so tokens
+revoked by another worker are rejected after at most that delay (revocations
+by the same process apply immediately). Ids are assigned when rows are
+inserted, not when they commit, so a row may become visible after rows with
+higher ids. Each refresh therefore reads again every row above the last id
+seen ``TOKEN_BLACKLIST_LAG_SECONDS`` ago, skipping the ones it already added;
+a revocation is only missed if its transaction stays open longer than that.
+
+When the filter fills up it is rebuilt at twice the size from the unexpired
+rows; ``prune_tokens`` removes the expired ones.
+"""
+
+import hashlib
+import math
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+from rest_framework_simplejwt.token_blacklist.models import (
+    BlacklistedToken,
+    OutstandingToken,
+)
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.utils import aware_utcnow
+
+from .caching import LRUCache
+
+
+class BloomFilter:
+    """Set membership with false positives but no false negatives."""
+
+    def __init__(self, capacity, error_rate=0.001):
+        self.capacity = capacity
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        # Kirsch-Mitzenmacher: derive every position from two 64-bit hashes
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        return all(
+            self.bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(key)
+        )
+
+
+def user_key(user_id):
+    return f"user:{user_id}"
+
+
+def _filter_key(jti):
+    # The filter holds user:<id> for the user markers
+    if jti.startswith("user:"):
+        return jti.rpartition(":")[0]
+    return jti
+
+
+class RevokedTokens:
+    def __init__(self, capacity=None, refresh_seconds=None):
+        self.capacity = capacity or getattr(
+            settings, "TOKEN_BLACKLIST_CAPACITY", 100_000
+        )
+        self.refresh_seconds = (
+            refresh_seconds
+            if refresh_seconds is not None
+            else getattr(settings, "TOKEN_BLACKLIST_REFRESH_SECONDS", 1.0)
+        )
+        self.lag_seconds = getattr(settings, "TOKEN_BLACKLIST_LAG_SECONDS", 30)
+        self.exact = LRUCache(
+            maxsize=getattr(settings, "TOKEN_BLACKLIST_LRU_SIZE", 4096)
+        )
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.filter = BloomFilter(self.capacity)
+            self.last_id = 0
+            # (time, last_id) after each refresh, back to lag_seconds ago
+            self.marks = deque([(-math.inf, 0)])
+            # Ids added to the filter that later refreshes read again
+            self.seen = set()
+            self.refreshed_at = None
+        self.exact.clear()
+
+    def refresh(self, force=False):
+        """Add blacklist rows created since the last refresh to the filter."""
+        now = time.monotonic()
+        if (
+            not force
+            and self.refreshed_at is not None
+            and now - self.refreshed_at < self.refresh_seconds
+        ):
+            return
+        with self._lock:
+            self.refreshed_at = now
+            marks = self.marks
+            while len(marks) > 1 and marks[1][0] <= now - self.lag_seconds:
+                marks.popleft()
+            start = marks[0][1]
+            rows = [
+                (pk, jti)
+                for pk, jti in BlacklistedToken.objects.filter(
+                    pk__gt=start, token__expires_at__gt=aware_utcnow()
+                )
+                .order_by("pk")
+                .values_list("pk", "token__jti")
+                if pk not in self.seen
+            ]
+            if self.filter.count + len(rows) > self.filter.capacity:
+                self._rebuild(start)
+            else:
+                for pk, jti in rows:
+                    key = _filter_key(jti)
+                    self.filter.add(key)
+                    # Drop a cached "not revoked" from an earlier false
+                    # positive, or the previous cutoff of a user
+                    self.exact.delete(key)
+                    self.seen.add(pk)
+                    self.last_id = max(self.last_id, pk)
+                self.seen = {pk for pk in self.seen if pk > start}
+            marks.append((now, self.last_id))
+
+    def _rebuild(self, start):
+        rows = (
+            BlacklistedToken.objects.filter(token__expires_at__gt=aware_utcnow())
+            .order_by("pk")
+            .values_list("pk", "token__jti")
+        )
+        jtis = []
+        self.seen = set()
+        for pk, jti in rows.iterator():
+            jtis.append(_filter_key(jti))
+            if pk > start:
+                self.seen.add(pk)
+            self.last_id = max(self.last_id, pk)
+        capacity = self.capacity
+        while capacity < 2 * len(jtis):
+            capacity *= 2
+        self.filter = BloomFilter(capacity)
+        for jti in jtis:
+            self.filter.add(jti)
+        self.exact.clear()
+
+    def is_revoked(self, jti):
+        self.refresh()
+        if jti not in self.filter:
+            return False
+        revoked = self.exact.get(jti)
+        if revoked is None:
+            revoked = BlacklistedToken.objects.filter(token__jti=jti).exists()
+            self.exact.set(jti, revoked)
+        return revoked
+
+    def revoke(self, token, user_id):
+        """Blacklist a validated access ``token``."""
+        jti = token["jti"]
+        with transaction.atomic():
+            outstanding, _ = OutstandingToken.objects.get_or_create(
+                jti=jti, defaults=_outstanding(token, user_id)
+            )
+            blacklisted, _ = BlacklistedToken.objects.get_or_create(token=outstanding)
+        with self._lock:
+            # Marked as seen so that the next refresh doesn't add it again
+            if blacklisted.pk not in self.seen:
+                self.filter.add(jti)
+                self.seen.add(blacklisted.pk)
+        self.exact.set(jti, True)
+
+    def revoke_user(self, user_id):
+        """Reject the tokens issued to ``user_id`` until now."""
+        key = user_key(user_id)
+        now = aware_utcnow()
+        with transaction.atomic():
+            # Not linked to the user, whose row may be about to be deleted
+            outstanding = OutstandingToken.objects.create(
+                jti=f"{key}:{uuid.uuid4().hex}",
+                token="",
+                created_at=now,
+                expires_at=now + jwt_settings.ACCESS_TOKEN_LIFETIME,
+            )
+            blacklisted = BlacklistedToken.objects.create(token=outstanding)
+        with self._lock:
+            self.filter.add(key)
+            self.seen.add(blacklisted.pk)
+        self.exact.delete(key)
+
+    def is_user_revoked(self, user_id, issued_at):
+        """Whether ``user_id`` was revoked after ``issued_at`` (a timestamp)."""
+        key = user_key(user_id)
+        self.refresh()
+        if key not in self.filter:
+            return False
+        cutoff = self.exact.get(key)
+        if cutoff is None:
+            revoked_at = OutstandingToken.objects.filter(
+                jti__startswith=f"{key}:", blacklistedtoken__isnull=False
+            ).aggregate(revoked_at=Max("created_at"))["revoked_at"]
+            cutoff = revoked_at.timestamp() if revoked_at is not None else 0
+            self.exact.set(key, cutoff)
+        # iat is in whole seconds: a token issued in the second of the
+        # revocation is rejected too
+        return issued_at <= cutoff
+
+
+def _outstanding(token, user_id):
+    return {
+        "token": str(token),
+        "user_id": user_id,
+        "expires_at": datetime.fromtimestamp(token["exp"], tz=timezone.utc),
+    }
+
+
+revoked_tokens = RevokedTokens()
+
+
+def prune_expired_tokens(batch_size=1000, pause=0.0):
+    """
+    Delete expired outstanding tokens (and their blacklist rows) in batches of
+    ``batch_size``, one short transaction each. Returns the number deleted.
+    """
+    now = aware_utcnow()
+    deleted = 0
+    while True:
+        with transaction.atomic():
+            ids = list(
+                OutstandingToken.objects.filter(expires_at__lte=now)
+                .order_by("pk")
+                .values_list("pk", flat=True)[:batch_size]
+            )
+            if not ids:
+                return deleted
+            BlacklistedToken.objects.filter(token_id__in=ids).delete()
+            OutstandingToken.objects.filter(pk__in=ids).delete()
+        deleted += len(ids)
+        if pause:
+            time.sleep(pause)
@@ -0,0 +1,237 @@
+"""
+Conditional GETs and rendered-response caching for product reads.
+
+Product responses are versioned by ``CatalogVersion``: every write that can
+change what a product read returns bumps the counter, and the ETag of a read
+is derived from the counter, the user and the request. Revalidations with a
+matching ``If-None-Match`` are answered with 304 before any product query
+runs, and rendered bodies are kept in a bounded per-process LRU keyed by user
+and URL, so a repeated read only costs the version lookup. Each entry also
+keeps the compressed bodies it has been served with (see ``api.compression``).
+
+Writes go through ``api.selection`` and model signals (see ``api.signals``),
+which bump the version. Bulk writes that bypass signals (``bulk_create``,
+``QuerySet.update``) must call ``bump_catalog_version()`` themselves, and
+``bump_catalog_version(CatalogVersion.PRODUCT_NAMES)`` too if they change
+product names.
+
+The version is bumped once the write's transaction commits, in a statement
+of its own, so concurrent writers only wait for each other on the version
+row for that statement instead of for their whole transactions. Until the
+bump, a read may see the new data under the old version's ETag; such a body
+is only cached under a key nobody reads once the version moves.
+"""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.http import HttpResponse
+from django.utils.http import parse_etags
+from rest_framework import status
+from rest_framework.response import Response
+
+from .compression import choose_encoding, compress, encode_response, strip_encoding
+from .models import CatalogVersion
+
+# encoded maps an encoding to the compressed content
+CachedResponse = namedtuple(
+    "CachedResponse", ["etag", "content", "content_type", "encoded"]
+)
+
+
+class LRUCache:
+    """Thread-safe LRU mapping with a size bound and an optional entry TTL."""
+
+    def __init__(self, maxsize=256, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value, expires = self._data[key]
+            except KeyError:
+                return default
+            if expires is not None and expires < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        expires = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def delete_where(self, predicate):
+        with self._lock:
+            for key in [key for key in self._data if predicate(key)]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+response_cache = LRUCache(
+    maxsize=getattr(settings, "PRODUCT_RESPONSE_CACHE_SIZE", 256),
+)
+# Bodies larger than this are served normally but not kept in memory
+MAX_CACHED_RESPONSE_BYTES = getattr(
+    settings, "PRODUCT_RESPONSE_CACHE_MAX_BYTES", 1024 * 1024
+)
+
+
+def get_catalog_version(name=CatalogVersion.PRODUCTS):
+    version = (
+        CatalogVersion.objects.filter(name=name)
+        .values_list("version", flat=True)
+        .first()
+    )
+    return version or 0
+
+
+async def aget_catalog_version():
+    version = (
+        await CatalogVersion.objects.filter(name=CatalogVersion.PRODUCTS)
+        .values_list("version", flat=True)
+        .afirst()
+    )
+    return version or 0
+
+
+def bump_catalog_version(name=CatalogVersion.PRODUCTS):
+    """Bump the version when the current transaction commits (or now)."""
+    transaction.on_commit(lambda: _bump_catalog_version(name))
+
+
+def _bump_catalog_version(name):
+    updated = CatalogVersion.objects.filter(name=name).update(version=F("version") + 1)
+    if not updated:
+        CatalogVersion.objects.get_or_create(name=name, defaults={"version": 1})
+
+
+def purge_user_responses(user_id):
+    response_cache.delete_where(lambda key: key[0] == user_id)
+
+
+def make_etag(version, request):
+    key = ":".join(
+        [
+            str(version),
+            str(request.user.pk),
+            request.get_full_path(),
+            request.accepted_media_type,
+        ]
+    )
+    return '"%s"' % hashlib.sha256(key.encode()).hexdigest()[:32]
+
+
+def read_headers(etag):
+    return {
+        "ETag": etag,
+        "Cache-Control": "private, no-cache",
+        "Vary": "Accept, Accept-Encoding, Authorization",
+    }
+
+
+def matching_etag(request, etag):
+    """The ``If-None-Match`` tag naming any encoding of ``etag``, if any."""
+    for tag in parse_etags(request.headers.get("If-None-Match", "")):
+        if strip_encoding(tag) == etag:
+            return tag
+    return None
+
+
+def response_key(request):
+    return (request.user.pk, request.get_full_path(), request.accepted_media_type)
+
+
+def encode_cached(request, response, cached):
+    # Compressed here rather than by CompressionMiddleware so that the entry
+    # keeps the result
+    encoding = choose_encoding(request, cached.content)
+    if encoding is None:
+        return
+    content = cached.encoded.get(encoding)
+    if content is None:
+        content = cached.encoded[encoding] = compress(cached.content, encoding)
+    encode_response(response, encoding, content)
+
+
+def cached_response(request, key, etag, headers):
+    """The cached body for ``key`` if it is still current, as a response."""
+    cached = response_cache.get(key)
+    if cached is None or cached.etag != etag:
+        return None
+    response = HttpResponse(
+        cached.content, content_type=cached.content_type, headers=headers
+    )
+    encode_cached(request, response, cached)
+    return response
+
+
+def cache_response(request, key, etag, response):
+    if len(response.content) > MAX_CACHED_RESPONSE_BYTES:
+        return
+    cached = CachedResponse(etag, response.content, response["Content-Type"], {})
+    response_cache.set(key, cached)
+    encode_cached(request, response, cached)
+
+
+class ConditionalReadMixin:
+    """
+    Adds ETag revalidation and the rendered-response cache to ``list`` and
+    ``retrieve`` of a viewset whose data is versioned by ``CatalogVersion``.
+    """
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_read(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_read(super().retrieve, request, *args, **kwargs)
+
+    def conditional_read(self, handler, request, *args, **kwargs):
+        etag = make_etag(get_catalog_version(), request)
+        headers = read_headers(etag)
+
+        tag = matching_etag(request, etag)
+        if tag is not None:
+            return Response(
+                status=status.HTTP_304_NOT_MODIFIED, headers={**headers, "ETag": tag}
+            )
+
+        cacheable = request.accepted_renderer.format == "json"
+        key = response_key(request)
+        cached = cached_response(request, key, etag, headers) if cacheable else None
+        if cached is not None:
+            return cached
+
+        response = handler(request, *args, **kwargs)
+        if response.status_code != status.HTTP_200_OK:
+            return response
+        for header, value in headers.items():
+            response[header] = value
+
+        if cacheable:
+            response.add_post_render_callback(
+                lambda rendered: cache_response(request, key, etag, rendered)
+            )
+        return response
@@ -0,0 +1,198 @@
+"""
+Response compression negotiated with ``Accept-Encoding``.
+
+``CompressionMiddleware`` compresses text responses of at least
+``API_COMPRESSION_MIN_BYTES`` with brotli, when the ``brotli`` package is
+installed and the client accepts it, or else gzip. Streamed responses, such
+as the product export, are compressed as they are streamed. Event streams
+are left alone: a compressor holds back each event until enough follow.
+Responses that already set ``Content-Encoding`` are never compressed.
+
+Product reads arrive at the middleware already compressed: ``api.caching``
+keeps each encoding of a cached body next to the uncompressed one, so a
+repeated read is neither serialized nor compressed again.
+
+Each encoding of a response is a different representation, so its ETag gets
+the encoding as a suffix (``"<tag>-gzip"``). ``strip_encoding`` removes it to
+compare ``If-None-Match`` with the ETag of the uncompressed response.
+"""
+
+import functools
+import gzip
+import zlib
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+GZIP_LEVEL = 6
+# About as fast as gzip level 6, with smaller output
+BROTLI_QUALITY = 5
+
+# Supported encodings, preferred first when the client accepts several
+ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+
+COMPRESSIBLE_TYPES = (
+    "text/",
+    "application/json",
+    "application/x-ndjson",
+    "application/javascript",
+    "application/xml",
+)
+# Matched by COMPRESSIBLE_TYPES but delivered event by event
+UNCOMPRESSED_TYPES = ("text/event-stream",)
+
+
+def min_size():
+    return getattr(settings, "API_COMPRESSION_MIN_BYTES", 1024)
+
+
+@functools.lru_cache(maxsize=64)
+def negotiate(accept_encoding):
+    """The encoding to use for an ``Accept-Encoding`` header, or None."""
+    qualities = {}
+    for item in accept_encoding.split(","):
+        coding, _, params = item.partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params.split(";"):
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[coding] = quality
+
+    best, best_quality = None, 0.0
+    for encoding in ENCODINGS:
+        quality = qualities.get(encoding, qualities.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def choose_encoding(request, content):
+    """The encoding to compress ``content`` with for ``request``, or None."""
+    if len(content) < min_size():
+        return None
+    return negotiate(request.headers.get("Accept-Encoding", ""))
+
+
+def compress(content, encoding):
+    if encoding == "br":
+        return brotli.compress(content, quality=BROTLI_QUALITY)
+    return gzip.compress(content, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def _compressor(encoding):
+    """``(compress, finish)`` functions of an incremental compressor."""
+    if encoding == "br":
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        return compressor.process, compressor.finish
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress, compressor.flush
+
+
+def compress_stream(chunks, encoding):
+    compress, finish = _compressor(encoding)
+    for chunk in chunks:
+        if data := compress(chunk):
+            yield data
+    yield finish()
+
+
+async def acompress_stream(chunks, encoding):
+    compress, finish = _compressor(encoding)
+    async for chunk in chunks:
+        if data := compress(chunk):
+            yield data
+    yield finish()
+
+
+def encoded_etag(etag, encoding):
+    """The ETag of the ``encoding`` representation of a response."""
+    if not etag.endswith('"'):
+        return etag
+    return f'{etag[:-1]}-{encoding}"'
+
+
+def strip_encoding(etag):
+    """Undo ``encoded_etag``."""
+    for encoding in ("br", "gzip"):
+        suffix = f'-{encoding}"'
+        if etag.endswith(suffix):
+            return f'{etag[: -len(suffix)]}"'
+    return etag
+
+
+def mark_encoded(response, encoding):
+    patch_vary_headers(response, ["Accept-Encoding"])
+    response["Content-Encoding"] = encoding
+    if response.has_header("ETag"):
+        response["ETag"] = encoded_etag(response["ETag"], encoding)
+
+
+def encode_response(response, encoding, content):
+    """Replace the body of ``response`` by ``content``, its ``encoding``."""
+    response.content = content
+    # CommonMiddleware set it for the uncompressed body
+    response["Content-Length"] = str(len(content))
+    mark_encoded(response, encoding)
+
+
+def compressible(response):
+    if response.has_header("Content-Encoding"):
+        return False
+    content_type = response.get("Content-Type", "")
+    return content_type.startswith(COMPRESSIBLE_TYPES) and not content_type.startswith(
+        UNCOMPRESSED_TYPES
+    )
+
+
+class CompressionMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        return self.compress(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.compress(request, await self.get_response(request))
+
+    def compress(self, request, response):
+        if not compressible(response):
+            return response
+
+        if response.streaming:
+            patch_vary_headers(response, ["Accept-Encoding"])
+            encoding = negotiate(request.headers.get("Accept-Encoding", ""))
+            if encoding is None:
+                return response
+            stream = acompress_stream if response.is_async else compress_stream
+            response.streaming_content = stream(response.streaming_content, encoding)
+            del response["Content-Length"]
+            mark_encoded(response, encoding)
+            return response
+
+        if len(response.content) >= min_size():
+            patch_vary_headers(response, ["Accept-Encoding"])
+        encoding = choose_encoding(request, response.content)
+        if encoding is not None:
+            encode_response(response, encoding, compress(response.content, encoding))
+        return response
@@ -0,0 +1,384 @@
+"""
+Selection change events pushed to clients over Server-Sent Events.
+
+``api.selection`` announces committed changes with the ``selection_changed``
+signal. They are published to the ``broker`` as compact deltas of the form::
+
+    {"username": "alice", "added": [3], "removed": [7, 9]}
+
+The broker hands them to a backend for fan-out and delivers whatever the
+backend receives to the local subscribers (the open event streams). The
+backend is chosen with ``API_EVENTS_BACKEND``. By default it is
+``PostgresNotifyBackend`` on PostgreSQL, which fans events out to every
+worker process through LISTEN/NOTIFY, and ``SQLiteLogBackend`` on SQLite,
+which fans them out to the processes on the host through the SQLite file
+``API_EVENTS_DB``. Anywhere else it is ``InProcessBackend``, which only
+reaches streams served by the publishing process.
+
+The stream endpoint needs an ASGI server: under WSGI every open stream would
+pin a worker thread.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import queue
+import select
+import sqlite3
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db import connections, DEFAULT_DB_ALIAS
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils.module_loading import import_string
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .blacklist import revoked_tokens
+
+logger = logging.getLogger(__name__)
+
+# Keeps NOTIFY payloads well below PostgreSQL's 8000 byte limit
+MAX_IDS_PER_EVENT = 500
+KEEPALIVE_SECONDS = 15
+SUBSCRIBER_QUEUE_SIZE = 1000
+# How often SQLiteLogBackend checks for other processes' events
+POLL_SECONDS = 0.25
+# SQLiteLogBackend keeps events this long, and purges older ones every this
+# many publishes
+EVENT_RETENTION_SECONDS = 60
+PURGE_EVERY = 1000
+
+
+def selection_events(username, added, removed):
+    """Split a selection delta into events of bounded size."""
+    for start in range(0, max(len(added), len(removed), 1), MAX_IDS_PER_EVENT):
+        end = start + MAX_IDS_PER_EVENT
+        yield {
+            "username": username,
+            "added": added[start:end],
+            "removed": removed[start:end],
+        }
+
+
+class InProcessBackend:
+    def __init__(self, deliver):
+        self.deliver = deliver
+
+    def publish(self, event):
+        self.deliver(event)
+
+
+class PostgresNotifyBackend:
+    """
+    Fans events out to all processes with PostgreSQL LISTEN/NOTIFY.
+
+    Publishing is a ``pg_notify()`` on the regular connection. Each process
+    runs one listener thread with its own connection, started by the first
+    subscriber, and delivers every notification (including its own) locally.
+    """
+
+    channel = "api_selection_events"
+
+    def __init__(self, deliver, using=DEFAULT_DB_ALIAS):
+        self.deliver = deliver
+        self.using = using
+        self._listener = None
+        self._lock = threading.Lock()
+
+    def publish(self, event):
+        with connections[self.using].cursor() as cursor:
+            cursor.execute(
+                "SELECT pg_notify(%s, %s)", [self.channel, json.dumps(event)]
+            )
+
+    def start(self):
+        with self._lock:
+            if self._listener is None or not self._listener.is_alive():
+                self._listener = threading.Thread(
+                    target=self._listen, name="api-events-listener", daemon=True
+                )
+                self._listener.start()
+
+    def _listen(self):
+        import psycopg2
+
+        params = connections[self.using].get_connection_params()
+        while True:
+            try:
+                conn = psycopg2.connect(**params)
+                conn.autocommit = True
+                with conn.cursor() as cursor:
+                    cursor.execute(f"LISTEN {self.channel}")
+                while True:
+                    if select.select([conn], [], [], KEEPALIVE_SECONDS) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        notify = conn.notifies.pop(0)
+                        self.deliver(json.loads(notify.payload))
+            except Exception:
+                logger.exception("Selection event listener failed, reconnecting")
+                threading.Event().wait(1)
+
+
+class SQLiteLogBackend:
+    """
+    Fans events out to the processes on the host through a SQLite file.
+
+    Publishing delivers the event locally right away and queues it for a
+    writer thread, started by the first publish, which appends the queued
+    events to a table in ``API_EVENTS_DB`` in one transaction, so requests
+    never wait for the file's write lock. Each process also runs one thread,
+    started by the first subscriber, that polls the table every
+    ``POLL_SECONDS`` and delivers the events other processes appended since.
+    SQLite serializes the appends, so ids grow in commit order and the last
+    id read is a safe watermark.
+    """
+
+    def __init__(self, deliver, path=None):
+        self.deliver = deliver
+        self.path = path or settings.API_EVENTS_DB
+        self._local = threading.local()
+        self._poller = None
+        self._writer = None
+        self._outbox = queue.Queue()
+        self._published = 0
+        self._lock = threading.Lock()
+
+    def connection(self):
+        local = self._local
+        if getattr(local, "connection", None) is None:
+            connection = sqlite3.connect(
+                self.path, timeout=1, isolation_level=None, check_same_thread=False
+            )
+            # Events are only kept for a minute; a crash may lose the last ones
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=OFF")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS events (id INTEGER PRIMARY KEY "
+                "AUTOINCREMENT, origin INTEGER NOT NULL, created REAL NOT NULL, "
+                "payload TEXT NOT NULL)"
+            )
+            local.connection = connection
+        return local.connection
+
+    def publish(self, event):
+        self._outbox.put((os.getpid(), time.time(), json.dumps(event)))
+        if self._writer is None:
+            with self._lock:
+                if self._writer is None:
+                    self._writer = threading.Thread(
+                        target=self._write, name="api-events-writer", daemon=True
+                    )
+                    self._writer.start()
+        self.deliver(event)
+
+    def flush(self):
+        """Wait until the events published so far are in the table."""
+        self._outbox.join()
+
+    def _write(self):
+        while True:
+            rows = [self._outbox.get()]
+            while True:
+                try:
+                    rows.append(self._outbox.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._append(rows)
+            except Exception:
+                logger.exception("Failed to append %d selection events", len(rows))
+            finally:
+                for _ in rows:
+                    self._outbox.task_done()
+
+    def _append(self, rows):
+        connection = self.connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.executemany(
+                "INSERT INTO events (origin, created, payload) VALUES (?, ?, ?)",
+                rows,
+            )
+            purges = self._published // PURGE_EVERY
+            self._published += len(rows)
+            if self._published // PURGE_EVERY != purges:
+                connection.execute(
+                    "DELETE FROM events WHERE created < ?",
+                    [time.time() - EVENT_RETENTION_SECONDS],
+                )
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+    def start(self):
+        with self._lock:
+            if self._poller is None or not self._poller.is_alive():
+                self._poller = threading.Thread(
+                    target=self._poll, name="api-events-poller", daemon=True
+                )
+                self._poller.start()
+
+    def receive(self, last_id=None):
+        """
+        Deliver other processes' events after ``last_id`` and return the id
+        to continue from. None starts from the events published from now on.
+        """
+        connection = self.connection()
+        if last_id is None:
+            (last_id,) = connection.execute(
+                "SELECT coalesce(max(id), 0) FROM events"
+            ).fetchone()
+        rows = connection.execute(
+            "SELECT id, origin, payload FROM events WHERE id > ? ORDER BY id",
+            [last_id],
+        ).fetchall()
+        for event_id, origin, payload in rows:
+            # This process delivered its own events when publishing
+            if origin != os.getpid():
+                self.deliver(json.loads(payload))
+            last_id = event_id
+        return last_id
+
+    def _poll(self):
+        last_id = None
+        while True:
+            try:
+                last_id = self.receive(last_id)
+            except Exception:
+                logger.exception("Selection event poller failed")
+            time.sleep(POLL_SECONDS)
+
+
+class EventBroker:
+    def __init__(self):
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._backend = None
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            path = getattr(settings, "API_EVENTS_BACKEND", None)
+            if path:
+                backend_class = import_string(path)
+            elif connections[DEFAULT_DB_ALIAS].vendor == "postgresql":
+                backend_class = PostgresNotifyBackend
+            elif connections[DEFAULT_DB_ALIAS].vendor == "sqlite":
+                backend_class = SQLiteLogBackend
+            else:
+                backend_class = InProcessBackend
+            self._backend = backend_class(self.deliver)
+        return self._backend
+
+    def publish(self, event):
+        try:
+            self.backend.publish(event)
+        except Exception:
+            # Pushing is best effort; clients still see changes on refetch
+            logger.exception("Failed to publish selection event")
+
+    def subscribe(self, callback):
+        """Register ``callback(event)``; returns a function that unsubscribes."""
+        if hasattr(self.backend, "start"):
+            self.backend.start()
+        with self._lock:
+            self._subscribers.add(callback)
+        return lambda: self.unsubscribe(callback)
+
+    def unsubscribe(self, callback):
+        with self._lock:
+            self._subscribers.discard(callback)
+
+    def deliver(self, event):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for callback in subscribers:
+            try:
+                callback(event)
+            except Exception:
+                logger.exception("Selection event subscriber failed")
+
+
+broker = EventBroker()
+
+
+def publish_selection_change(sender, user, added, removed, **kwargs):
+    """``selection_changed`` receiver forwarding deltas to the broker."""
+    for event in selection_events(user.username, added, removed):
+        broker.publish(event)
+
+
+def authenticate_stream(request):
+    # EventSource can't set headers, so the token may come as a query parameter
+    token = request.GET.get("token")
+    auth_header = request.headers.get("Authorization", "")
+    if not token and auth_header.startswith("Bearer "):
+        token = auth_header.split(" ", 1)[1]
+    if not token:
+        return None
+    try:
+        token = AccessToken(token)
+    except TokenError:
+        return None
+    return None if revoked_tokens.is_revoked(token["jti"]) else token
+
+
+def format_event(name, data):
+    return f"event: {name}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+async def stream_events(queue, unsubscribe):
+    try:
+        yield "retry: 3000\n\n"
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            if event is None:
+                # The client fell too far behind; it has to refetch
+                yield format_event("resync", {})
+                return
+            yield format_event("selection", event)
+    finally:
+        unsubscribe()
+
+
+async def product_events(request):
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse(
+            {"error": "Event streams are only served by the ASGI application"},
+            status=501,
+        )
+    if await sync_to_async(authenticate_stream)(request) is None:
+        return JsonResponse({"error": "Invalid or missing token"}, status=401)
+
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+
+    def put(event):
+        if queue.full():
+            queue.get_nowait()
+            event = None
+        queue.put_nowait(event)
+
+    def on_event(event):
+        # Called from publishing threads; hand over to the stream's loop
+        loop.call_soon_threadsafe(put, event)
+
+    unsubscribe = broker.subscribe(on_event)
+    response = StreamingHttpResponse(
+        stream_events(queue, unsubscribe), content_type="text/event-stream"
+    )
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
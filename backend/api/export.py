@@ -0,0 +1,89 @@
+"""
+Streaming catalog export in NDJSON and CSV.
+
+The export renderers double as the formats ``?format=`` can select, so DRF's
+content negotiation picks the output format and answers unknown formats with
+404 as usual. Rows are read as tuples with ``values_list().iterator()`` (a
+server-side cursor on PostgreSQL) and rendered a chunk at a time, so memory
+use doesn't depend on the size of the catalog.
+"""
+
+import csv
+import io
+import json
+from decimal import Decimal
+from itertools import islice
+
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils import encoders
+
+
+def _plain(value):
+    # Decimals are exported as strings, as ProductSerializer renders them
+    return str(value) if isinstance(value, Decimal) else value
+
+
+class StreamingRenderer(BaseRenderer):
+    """
+    Renders rows of ``fields`` in chunks for a ``StreamingHttpResponse``.
+
+    ``render()`` is only used for non-streamed responses such as errors.
+    """
+
+    def stream(self, fields, rows, chunk_size):
+        header = self.render_header(fields)
+        if header:
+            yield header
+        rows = iter(rows)
+        while chunk := list(islice(rows, chunk_size)):
+            yield self.render_rows(fields, chunk)
+
+    def render_header(self, fields):
+        return b""
+
+    def render_rows(self, fields, rows):
+        raise NotImplementedError
+
+
+class NDJSONRenderer(StreamingRenderer):
+    media_type = "application/x-ndjson"
+    format = "ndjson"
+    charset = None
+
+    def dumps(self, data):
+        return json.dumps(
+            data, cls=encoders.JSONEncoder, ensure_ascii=False, separators=(",", ":")
+        )
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        return (self.dumps(data) + "\n").encode()
+
+    def render_rows(self, fields, rows):
+        lines = [self.dumps(dict(zip(fields, map(_plain, row)))) + "\n" for row in rows]
+        return "".join(lines).encode()
+
+
+class CSVRenderer(StreamingRenderer):
+    media_type = "text/csv"
+    format = "csv"
+    charset = "utf-8"
+
+    def write(self, rows):
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        return buffer.getvalue().encode()
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        if not isinstance(data, dict):
+            data = {"detail": data}
+        return self.write([data.keys(), data.values()])
+
+    def render_header(self, fields):
+        return self.write([fields])
+
+    def render_rows(self, fields, rows):
+        return self.write(rows)
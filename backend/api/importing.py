@@ -0,0 +1,111 @@
+"""
+Feed parsing and validation for ``import_products``.
+
+Like ``api.seeding``, this module doesn't import Django models, so the
+validation worker processes can import it without setting up Django.
+"""
+
+import csv
+import json
+from decimal import Decimal, InvalidOperation
+
+FORMATS = ("csv", "jsonl")
+FIELDS = ("sku", "name", "description", "price", "stock")
+
+SKU_MAX_LENGTH = 64
+NAME_MAX_LENGTH = 200
+PRICE_MAX_DIGITS = 10
+PRICE_DECIMAL_PLACES = 2
+
+
+def read_records(file, format):
+    """
+    Yield the records of a feed without parsing more than one at a time.
+
+    CSV rows are yielded as dicts. JSON lines are yielded as undecoded
+    strings, leaving the decoding to the validation workers.
+    """
+    if format == "csv":
+        yield from csv.DictReader(file)
+    else:
+        for line in file:
+            if line.strip():
+                yield line
+
+
+def _text(record, field, max_length=None, required=True):
+    value = record.get(field)
+    value = "" if value is None else str(value).strip()
+    if required and not value:
+        raise ValueError(f"{field} is required")
+    if max_length is not None and len(value) > max_length:
+        raise ValueError(f"{field} is longer than {max_length} characters")
+    return value
+
+
+def _price(value):
+    try:
+        price = Decimal(str(value).strip())
+    except InvalidOperation:
+        raise ValueError(f"price {value!r} is not a number")
+    if not price.is_finite() or price < 0:
+        raise ValueError(f"price {value!r} is not a non-negative number")
+    sign, digits, exponent = price.as_tuple()
+    if -exponent > PRICE_DECIMAL_PLACES:
+        raise ValueError(f"price {value!r} has more than 2 decimal places")
+    price = price.quantize(Decimal(1).scaleb(-PRICE_DECIMAL_PLACES))
+    if len(price.as_tuple().digits) > PRICE_MAX_DIGITS:
+        raise ValueError(f"price {value!r} has more than {PRICE_MAX_DIGITS} digits")
+    return str(price)
+
+
+def _stock(value):
+    if value is None or value == "":
+        return 0
+    if isinstance(value, bool) or isinstance(value, float) and not value.is_integer():
+        raise ValueError(f"stock {value!r} is not an integer")
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"stock {value!r} is not an integer")
+
+
+def validate_record(record):
+    """Return a ``(sku, name, description, price, stock)`` row or raise ValueError."""
+    if isinstance(record, str):
+        try:
+            record = json.loads(record)
+        except ValueError as exc:
+            raise ValueError(f"invalid JSON: {exc}")
+    if not isinstance(record, dict):
+        raise ValueError("record is not an object")
+    if record.get("price") in (None, ""):
+        raise ValueError("price is required")
+    return (
+        _text(record, "sku", SKU_MAX_LENGTH),
+        _text(record, "name", NAME_MAX_LENGTH),
+        _text(record, "description", required=False),
+        _price(record["price"]),
+        _stock(record.get("stock")),
+    )
+
+
+def validate_batch(task):
+    """
+    Validate one batch of records numbered from ``start``.
+
+    Returns the valid rows, with only the last row of a SKU that occurs
+    more than once (an upsert can't touch the same row twice), and a list
+    of ``(record number, message)`` errors.
+    """
+    start, records = task
+    rows, errors = {}, []
+    for number, record in enumerate(records, start):
+        try:
+            row = validate_record(record)
+        except ValueError as exc:
+            errors.append((number, str(exc)))
+            continue
+        rows.pop(row[0], None)
+        rows[row[0]] = row
+    return list(rows.values()), errors
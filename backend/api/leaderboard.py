@@ -0,0 +1,154 @@
+"""
+In-memory ranking of the most selected products.
+
+Each process keeps the selected products ordered by ``selection_count`` in a
+sorted list, so ``leaderboard.top(k)`` is a slice and never queries the
+database. The ranking is loaded from ``Product.selection_count`` when the
+server starts (see ``core.wsgi`` and ``core.asgi``), or by the first read,
+and then follows the selection events published to ``api.events.broker``.
+
+Events reach every process with a fan-out backend (LISTEN/NOTIFY on
+PostgreSQL, a shared file on SQLite); with the in-process backend a process
+only sees its own writes. Either way the ranking is rebuilt in the
+background once it is older than ``API_LEADERBOARD_RECONCILE_SECONDS``,
+which also repairs changes made outside ``api.selection``. Events that
+arrive while a rebuild reads the counts are replayed on top of them.
+"""
+
+import logging
+import threading
+import time
+from bisect import bisect_left, insort
+
+from django.conf import settings
+from django.db import connections
+
+from .events import broker
+from .models import Product
+
+logger = logging.getLogger(__name__)
+
+
+def reconcile_seconds():
+    return getattr(settings, "API_LEADERBOARD_RECONCILE_SECONDS", 60)
+
+
+class Leaderboard:
+    def __init__(self):
+        self._counts = {}
+        # (-count, product id) of every product with a positive count
+        self._ranking = []
+        self._lock = threading.Lock()
+        self._loaded_at = None
+        self._unsubscribe = None
+        self._reconciling = False
+        # Changes that arrive while a rebuild reads the database, replayed after it
+        self._pending = None
+
+    def start(self):
+        """Follow selection events and load the ranking."""
+        with self._lock:
+            if self._unsubscribe is None:
+                self._unsubscribe = broker.subscribe(self.apply)
+        self.rebuild()
+
+    def warm(self):
+        """``start()`` at server startup; if it fails, the first read retries."""
+        try:
+            self.start()
+        except Exception:
+            logger.exception("Failed to load the product leaderboard")
+
+    def stop(self):
+        with self._lock:
+            if self._unsubscribe is not None:
+                self._unsubscribe()
+                self._unsubscribe = None
+            self._loaded_at = None
+
+    def rebuild(self):
+        with self._lock:
+            self._pending = []
+        try:
+            counts = dict(
+                Product.objects.filter(selection_count__gt=0).values_list(
+                    "pk", "selection_count"
+                )
+            )
+            ranking = sorted((-count, pk) for pk, count in counts.items())
+        except BaseException:
+            with self._lock:
+                self._pending = None
+            raise
+        with self._lock:
+            self._counts = counts
+            self._ranking = ranking
+            self._loaded_at = time.monotonic()
+            pending, self._pending = self._pending, None
+            for change, arg in pending:
+                change(arg)
+
+    def _set(self, product_id, count):
+        # Called with the lock held
+        old = self._counts.get(product_id)
+        if old is not None:
+            del self._ranking[bisect_left(self._ranking, (-old, product_id))]
+        if count > 0:
+            self._counts[product_id] = count
+            insort(self._ranking, (-count, product_id))
+        else:
+            self._counts.pop(product_id, None)
+
+    def _apply(self, event):
+        # Called with the lock held
+        for product_id in event["added"]:
+            self._set(product_id, self._counts.get(product_id, 0) + 1)
+        for product_id in event["removed"]:
+            self._set(product_id, self._counts.get(product_id, 0) - 1)
+
+    def _discard(self, product_id):
+        # Called with the lock held
+        self._set(product_id, 0)
+
+    def apply(self, event):
+        """Apply a selection event (see ``api.events``)."""
+        self._change(self._apply, event)
+
+    def discard(self, product_id):
+        self._change(self._discard, product_id)
+
+    def _change(self, change, arg):
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append((change, arg))
+            change(arg)
+
+    def top(self, limit):
+        """The ``limit`` most selected ``(product id, count)`` pairs."""
+        if self._loaded_at is None:
+            self.start()
+        elif time.monotonic() - self._loaded_at > reconcile_seconds():
+            self.reconcile_in_background()
+        with self._lock:
+            return [(pk, -count) for count, pk in self._ranking[:limit]]
+
+    def reconcile_in_background(self):
+        with self._lock:
+            if self._reconciling:
+                return
+            self._reconciling = True
+        threading.Thread(
+            target=self._reconcile, name="api-leaderboard-reconcile", daemon=True
+        ).start()
+
+    def _reconcile(self):
+        try:
+            self.rebuild()
+        except Exception:
+            logger.exception("Failed to reconcile the product leaderboard")
+        finally:
+            connections.close_all()
+            self._reconciling = False
+
+
+leaderboard = Leaderboard()
@@ -0,0 +1,54 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from api.authentication import ClaimsJWTAuthentication
+from api.benchmarks.database import throwaway_database
+from api.benchmarks.workload import access_token
+from api.models import CustomUser
+
+BENCH_USERNAME = "bench-auth-user"
+
+
+class Command(BaseCommand):
+    help = "Compare the per-request cost of the JWT authentication classes"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--requests",
+            type=int,
+            default=2000,
+            help="Number of requests authenticated per class",
+        )
+
+    def handle(self, *args, **options):
+        with throwaway_database():
+            self.compare(options)
+
+    def compare(self, options):
+        user = CustomUser.objects.create(username=BENCH_USERNAME)
+        request = APIRequestFactory().get(
+            "/api/products/", HTTP_AUTHORIZATION=f"Bearer {access_token(user)}"
+        )
+
+        for backend in (JWTAuthentication(), ClaimsJWTAuthentication()):
+            queries, elapsed = self.run(backend, request, options["requests"])
+            self.stdout.write(
+                f"{type(backend).__name__:<24} "
+                f"{elapsed / options['requests'] * 1e6:8.1f} us/request "
+                f"{queries / options['requests']:6.2f} queries/request"
+            )
+
+    def run(self, backend, request, count):
+        # Force query capture so both classes pay the same logging overhead
+        with CaptureQueriesContext(connection) as ctx:
+            started = time.perf_counter()
+            for _ in range(count):
+                user, _ = backend.authenticate(Request(request))
+                user.username
+            elapsed = time.perf_counter() - started
+        return len(ctx.captured_queries), elapsed
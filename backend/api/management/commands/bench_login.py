@@ -0,0 +1,85 @@
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.models import Count
+from django.test import Client
+from api.benchmarks.database import throwaway_database
+from api.models import CustomUser
+
+BENCH_USERNAME_PREFIX = "bench-login-"
+
+
+class Command(BaseCommand):
+    help = "Measure login throughput with many clients logging in concurrently"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--logins",
+            type=int,
+            default=1000,
+            help="Total number of logins (at least 2, for the percentiles)",
+        )
+        parser.add_argument(
+            "--threads", type=int, default=8, help="Number of concurrent clients"
+        )
+        parser.add_argument(
+            "--usernames",
+            type=int,
+            default=50,
+            help="Number of distinct usernames; fewer means more collisions",
+        )
+
+    def handle(self, *args, **options):
+        if min(options["threads"], options["usernames"]) < 1:
+            raise CommandError("--threads and --usernames must be positive")
+        if options["logins"] < 2:
+            raise CommandError("--logins must be at least 2")
+        # In a fresh database, so the first logins race to create the users
+        with throwaway_database():
+            self.run_logins(options)
+
+    def run_logins(self, options):
+        local = threading.local()
+
+        def login(i):
+            if not hasattr(local, "client"):
+                local.client = Client()
+            username = f"{BENCH_USERNAME_PREFIX}{i % options['usernames']}"
+            started = time.perf_counter()
+            response = local.client.post(
+                "/api/login/", {"username": username}, content_type="application/json"
+            )
+            return response.status_code, time.perf_counter() - started
+
+        def run(indexes):
+            try:
+                return [login(i) for i in indexes]
+            finally:
+                connections.close_all()
+
+        threads = options["threads"]
+        chunks = [range(t, options["logins"], threads) for t in range(threads)]
+        started = time.perf_counter()
+        with ThreadPoolExecutor(threads) as pool:
+            results = [result for chunk in pool.map(run, chunks) for result in chunk]
+        elapsed = time.perf_counter() - started
+
+        latencies = sorted(latency * 1000 for status, latency in results)
+        failed = sum(status != 200 for status, _ in results)
+        duplicates = (
+            CustomUser.objects.filter(username__startswith=BENCH_USERNAME_PREFIX)
+            .values("username")
+            .annotate(n=Count("pk"))
+            .filter(n__gt=1)
+            .count()
+        )
+        p50, p99 = statistics.quantiles(latencies, n=100)[49::49]
+        self.stdout.write(
+            f"{len(results)} logins with {threads} threads in {elapsed:.2f}s "
+            f"({len(results) / elapsed:,.0f}/s), p50 {p50:.1f}ms, p99 {p99:.1f}ms"
+        )
+        self.stdout.write(f"{failed} failed logins, {duplicates} duplicated usernames")
@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.renderers import JSONRenderer
+from api.benchmarks.rendering import build_products, measure
+from api.renderers import ORJSONRenderer
+
+
+class Command(BaseCommand):
+    help = "Compare serialize+render time of the JSON renderers for a product list"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--products", type=int, default=10000, help="Number of products rendered"
+        )
+        parser.add_argument(
+            "--repeat", type=int, default=5, help="Runs per renderer; the best counts"
+        )
+
+    def handle(self, *args, **options):
+        products = build_products(options["products"])
+        bodies = {}
+        renders = {}
+        totals = {}
+        for renderer in (JSONRenderer(), ORJSONRenderer()):
+            name = type(renderer).__name__
+            serialize, render, bodies[name] = measure(
+                renderer, products, options["repeat"]
+            )
+            renders[name] = render
+            totals[name] = serialize + render
+            self.stdout.write(
+                f"{name:<16} serialize {serialize * 1000:8.1f}ms  "
+                f"render {render * 1000:8.1f}ms  total {totals[name] * 1000:8.1f}ms  "
+                f"{len(bodies[name]):,} bytes"
+            )
+
+        if bodies["JSONRenderer"] != bodies["ORJSONRenderer"]:
+            raise CommandError("The renderers produced different output")
+        self.stdout.write(
+            self.style.SUCCESS(
+                "Identical output; ORJSONRenderer renders "
+                f"{renders['JSONRenderer'] / renders['ORJSONRenderer']:.1f}x and "
+                f"serializes+renders "
+                f"{totals['JSONRenderer'] / totals['ORJSONRenderer']:.2f}x faster"
+            )
+        )
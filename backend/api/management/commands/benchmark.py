@@ -0,0 +1,212 @@
+from django.core.management.base import BaseCommand, CommandError
+from core.database import PROFILES, PROFILE_OPTIONS, apply_profile
+from django.db import connection
+from django.test.utils import override_settings
+from api.benchmarks import baseline, runner
+from api.benchmarks.database import throwaway_database
+from api.benchmarks.workload import SCENARIOS, Workload
+
+# Root URLconfs of the DRF views and of the async ones (API_ASYNC_VIEWS)
+URLCONFS = {"drf": "core.urls", "async": "core.async_urls"}
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the API in-process against a seeded throwaway database "
+        "and optionally save or compare a JSON baseline"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--products", type=int, default=1000, help="Number of seeded products"
+        )
+        parser.add_argument(
+            "--users", type=int, default=50, help="Number of seeded users"
+        )
+        parser.add_argument(
+            "--requests",
+            type=int,
+            default=500,
+            help="Number of measured requests per scenario and interface",
+        )
+        parser.add_argument(
+            "--warmup",
+            type=int,
+            default=20,
+            help="Number of unmeasured requests sent before each benchmark",
+        )
+        parser.add_argument(
+            "--concurrency", type=int, default=8, help="Number of simulated clients"
+        )
+        parser.add_argument(
+            "--interface",
+            choices=[*runner.INTERFACES, "both"],
+            default="both",
+            help="Handler to drive the requests through",
+        )
+        parser.add_argument(
+            "--views",
+            choices=[*URLCONFS, "both"],
+            default="drf",
+            help="Serve the requests with the DRF views, the async views or both",
+        )
+        parser.add_argument(
+            "--accept-encoding",
+            default="",
+            metavar="CODINGS",
+            help="Accept-Encoding header sent with every request, e.g. 'gzip, br'",
+        )
+        parser.add_argument(
+            "--scenario",
+            action="append",
+            choices=list(SCENARIOS),
+            help="Scenario to run (repeatable; default: all)",
+        )
+        parser.add_argument(
+            "--db-profile",
+            choices=PROFILES,
+            help="Database profile to benchmark (default: the configured one)",
+        )
+        parser.add_argument(
+            "--save", metavar="PATH", help="Write the results as a JSON baseline"
+        )
+        parser.add_argument(
+            "--compare", metavar="PATH", help="Compare with a saved JSON baseline"
+        )
+        parser.add_argument(
+            "--threshold",
+            type=float,
+            default=baseline.DEFAULT_THRESHOLD,
+            help="Relative change in rps or latency reported as a regression",
+        )
+        parser.add_argument(
+            "--fail-on-regression",
+            action="store_true",
+            help="Exit with an error if the comparison found regressions",
+        )
+
+    def handle(self, *args, **options):
+        if min(options["requests"], options["concurrency"], options["users"]) < 1:
+            raise CommandError("--requests, --concurrency and --users must be positive")
+        previous = (
+            baseline.load_baseline(options["compare"]) if options["compare"] else None
+        )
+        interfaces = (
+            runner.INTERFACES
+            if options["interface"] == "both"
+            else [options["interface"]]
+        )
+        scenarios = options["scenario"] or list(SCENARIOS)
+        views = list(URLCONFS) if options["views"] == "both" else [options["views"]]
+
+        if options["db_profile"]:
+            self.use_profile(options["db_profile"])
+
+        runner.install_query_counter()
+        with throwaway_database():
+            results = self.run_benchmarks(interfaces, views, scenarios, options)
+
+        if options["save"]:
+            data = baseline.make_baseline(
+                results,
+                **{
+                    key: options[key]
+                    for key in (
+                        "products",
+                        "users",
+                        "requests",
+                        "concurrency",
+                        "accept_encoding",
+                    )
+                },
+                db_profile=options["db_profile"],
+            )
+            baseline.save_baseline(options["save"], data)
+            self.stdout.write(f"Saved baseline to {options['save']}")
+
+        if previous is not None:
+            self.report_comparison(results, previous, options)
+
+    def use_profile(self, profile):
+        # Start from Django's defaults, then apply the profile. Every
+        # thread's connection shares this settings dict.
+        settings_dict = connection.settings_dict
+        options = settings_dict["OPTIONS"]
+        base = {
+            **settings_dict,
+            "CONN_MAX_AGE": 0,
+            "CONN_HEALTH_CHECKS": False,
+            "OPTIONS": {
+                key: value
+                for key, value in options.items()
+                if key not in PROFILE_OPTIONS
+            },
+        }
+        connection.close()
+        settings_dict.update(apply_profile(base, profile))
+
+    def run_benchmarks(self, interfaces, views, scenarios, options):
+        self.stdout.write(
+            f"Seeding {options['products']} products and {options['users']} users..."
+        )
+        workload = Workload(options["products"], options["users"])
+
+        self.stdout.write(
+            f"{'benchmark':<30}{'rps':>9}{'p50 ms':>9}{'p95 ms':>9}"
+            f"{'p99 ms':>9}{'queries':>9}{'bytes':>9}{'cpu ms':>9}{'errors':>8}"
+        )
+        headers = (
+            {"Accept-Encoding": options["accept_encoding"]}
+            if options["accept_encoding"]
+            else {}
+        )
+        results = {}
+        for view in views:
+            for interface in interfaces:
+                for name in scenarios:
+                    # Every simulated client waits for admission rather than
+                    # being shed, as with the server's socket backlog
+                    with override_settings(
+                        ROOT_URLCONF=URLCONFS[view],
+                        API_ADMISSION_QUEUE_SIZE=options["concurrency"],
+                    ):
+                        result = runner.run(
+                            interface,
+                            SCENARIOS[name],
+                            workload,
+                            options["requests"],
+                            options["concurrency"],
+                            warmup=options["warmup"],
+                            headers=headers,
+                        )
+                    # DRF results keep the names of earlier baselines
+                    prefix = interface if view == "drf" else f"{interface} {view}"
+                    key = f"{prefix} {name}"
+                    results[key] = result
+                    self.stdout.write(
+                        f"{key:<30}{result['rps']:>9.1f}{result['p50_ms']:>9.2f}"
+                        f"{result['p95_ms']:>9.2f}{result['p99_ms']:>9.2f}"
+                        f"{result['queries_per_request']:>9.2f}"
+                        f"{result['bytes_per_request']:>9}"
+                        f"{result['cpu_ms_per_request']:>9.2f}"
+                        f"{result['errors']:>8}"
+                    )
+        return results
+
+    def report_comparison(self, results, previous, options):
+        regressions = baseline.compare(
+            results, previous["results"], threshold=options["threshold"]
+        )
+        if not regressions:
+            self.stdout.write(
+                self.style.SUCCESS(f"No regressions against {options['compare']}")
+            )
+            return
+        for name, metric, before, after in regressions:
+            self.stdout.write(
+                self.style.WARNING(f"{name}: {metric} {before} -> {after}")
+            )
+        message = f"{len(regressions)} regressions against {options['compare']}"
+        if options["fail_on_regression"]:
+            raise CommandError(message)
+        self.stdout.write(self.style.WARNING(message))
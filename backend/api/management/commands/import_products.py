@@ -0,0 +1,227 @@
+import csv
+import io
+import json
+import os
+import sys
+import time
+from collections import deque
+from itertools import islice
+from multiprocessing import Pool
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from api.caching import bump_catalog_version
+from api.importing import FIELDS, FORMATS, read_records, validate_batch
+from api.models import CatalogVersion, Product
+
+# Errors printed individually; the rest are only counted
+MAX_REPORTED_ERRORS = 20
+
+UPDATE_FIELDS = ["name", "description", "price", "stock"]
+
+
+class Command(BaseCommand):
+    help = (
+        "Upsert products from a CSV or JSON lines feed, matching existing "
+        "products by SKU"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "path", help="Feed to import, or - to read it from standard input"
+        )
+        parser.add_argument(
+            "--format",
+            choices=FORMATS,
+            help="Feed format (default: guessed from the file extension)",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=5000,
+            help="Number of records validated and upserted per transaction",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=1,
+            help="Number of processes validating records (1 validates inline)",
+        )
+        parser.add_argument(
+            "--checkpoint",
+            metavar="PATH",
+            help=(
+                "File recording the records already imported; an interrupted "
+                "import run again with the same file resumes after them"
+            ),
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        workers = options["workers"]
+        if batch_size < 1 or workers < 1:
+            raise CommandError("--batch-size and --workers must be positive")
+        path = options["path"]
+        format = options["format"] or self.guess_format(path)
+        source = path if path == "-" else os.path.abspath(path)
+        checkpoint = options["checkpoint"]
+        skip = self.load_checkpoint(checkpoint, source) if checkpoint else 0
+
+        if skip:
+            self.stdout.write(f"Resuming after {skip} records...")
+        started = time.monotonic()
+        self.imported = self.invalid = 0
+        done = skip
+        with self.open(path) as file:
+            records = islice(read_records(file, format), skip, None)
+            batches = self.batches(records, skip + 1, batch_size)
+            for rows, errors, count in self.validate(batches, workers):
+                self.report_errors(errors)
+                self.upsert(rows)
+                done += count
+                if checkpoint:
+                    self.save_checkpoint(checkpoint, source, done)
+        if self.imported:
+            # The upserts bypass post_save: have every process rebuild its
+            # suggest index rather than wait for the periodic rebuild
+            bump_catalog_version()
+            bump_catalog_version(CatalogVersion.PRODUCT_NAMES)
+        if checkpoint and os.path.exists(checkpoint):
+            # Finished: running the import again should start over
+            os.remove(checkpoint)
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Imported {self.imported} products from {done - skip} records "
+                f"({self.invalid} invalid) in {elapsed:.1f}s "
+                f"({(done - skip) / max(elapsed, 1e-9):,.0f} rows/s)"
+            )
+        )
+
+    def guess_format(self, path):
+        extension = os.path.splitext(path)[1].lower()
+        if extension == ".csv":
+            return "csv"
+        if extension in (".jsonl", ".ndjson"):
+            return "jsonl"
+        raise CommandError(f"Can't tell the format of {path}; pass --format")
+
+    def open(self, path):
+        if path == "-":
+            # Keep stdin open when the context manager exits
+            return open(sys.stdin.fileno(), newline="", closefd=False)
+        try:
+            return open(path, newline="", encoding="utf-8-sig")
+        except OSError as exc:
+            raise CommandError(f"Can't read {path}: {exc}")
+
+    def batches(self, records, start, batch_size):
+        while batch := list(islice(records, batch_size)):
+            yield start, batch
+            start += len(batch)
+
+    def validate(self, batches, workers):
+        """Yield ``(rows, errors, record count)`` per batch, in input order."""
+        if workers == 1:
+            for task in batches:
+                yield (*validate_batch(task), len(task[1]))
+            return
+        with Pool(workers) as pool:
+            # Bounded so a large feed isn't read into memory ahead of the writes
+            pending = deque()
+            for task in batches:
+                pending.append(
+                    (pool.apply_async(validate_batch, (task,)), len(task[1]))
+                )
+                if len(pending) > 2 * workers:
+                    result, count = pending.popleft()
+                    yield (*result.get(), count)
+            while pending:
+                result, count = pending.popleft()
+                yield (*result.get(), count)
+
+    def report_errors(self, errors):
+        for number, message in errors:
+            self.invalid += 1
+            if self.invalid <= MAX_REPORTED_ERRORS:
+                self.stderr.write(f"Record {number}: {message}")
+            elif self.invalid == MAX_REPORTED_ERRORS + 1:
+                self.stderr.write("Further invalid records are only counted")
+
+    def upsert(self, rows):
+        if not rows:
+            return
+        with transaction.atomic():
+            if connection.vendor == "postgresql":
+                self.copy_upsert(rows)
+            elif connection.vendor == "sqlite":
+                self.insert_upsert(rows)
+            else:
+                Product.objects.bulk_create(
+                    [Product(**dict(zip(FIELDS, row))) for row in rows],
+                    update_conflicts=True,
+                    unique_fields=["sku"],
+                    update_fields=UPDATE_FIELDS,
+                )
+        self.imported += len(rows)
+
+    def insert_upsert(self, rows):
+        # The same statement bulk_create(update_conflicts=True) builds, but
+        # executemany skips building a model instance and preparing every value
+        columns = ", ".join(FIELDS)
+        updates = ", ".join(f"{field} = excluded.{field}" for field in UPDATE_FIELDS)
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f"INSERT INTO {Product._meta.db_table} ({columns}, selection_count) "
+                "VALUES (%s, %s, %s, %s, %s, 0) "
+                f"ON CONFLICT (sku) DO UPDATE SET {updates}",
+                rows,
+            )
+
+    def copy_upsert(self, rows):
+        # COPY into a staging table, then one INSERT ... ON CONFLICT from it
+        buffer = io.StringIO()
+        # Quoted, so COPY reads an empty description as "" rather than NULL
+        csv.writer(buffer, quoting=csv.QUOTE_NONNUMERIC).writerows(rows)
+        buffer.seek(0)
+        table = Product._meta.db_table
+        columns = ", ".join(FIELDS)
+        updates = ", ".join(f"{field} = EXCLUDED.{field}" for field in UPDATE_FIELDS)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "CREATE TEMPORARY TABLE import_products_staging "
+                "(sku varchar(64), name varchar(200), description text, "
+                "price numeric(10, 2), stock integer) ON COMMIT DROP"
+            )
+            cursor.copy_expert(
+                f"COPY import_products_staging ({columns}) "
+                "FROM STDIN WITH (FORMAT csv)",
+                buffer,
+            )
+            cursor.execute(
+                f"INSERT INTO {table} ({columns}, selection_count) "
+                f"SELECT {columns}, 0 FROM import_products_staging "
+                f"ON CONFLICT (sku) DO UPDATE SET {updates}"
+            )
+
+    def load_checkpoint(self, path, source):
+        try:
+            with open(path) as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return 0
+        except (OSError, ValueError) as exc:
+            raise CommandError(f"Can't read checkpoint {path}: {exc}")
+        if state.get("source") != source:
+            raise CommandError(
+                f"Checkpoint {path} belongs to an import of {state.get('source')}"
+            )
+        return state["records"]
+
+    def save_checkpoint(self, path, source, records):
+        # Written after the batch commits; a crash in between only repeats
+        # that batch's upserts, which is harmless
+        with open(f"{path}.tmp", "w") as f:
+            json.dump({"source": source, "records": records}, f)
+        os.replace(f"{path}.tmp", path)
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+from api.blacklist import prune_expired_tokens
+
+
+class Command(BaseCommand):
+    help = "Delete expired outstanding and blacklisted tokens in small batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of tokens deleted per transaction",
+        )
+        parser.add_argument(
+            "--pause",
+            type=float,
+            default=0.0,
+            help="Seconds to sleep between batches to let other writers in",
+        )
+
+    def handle(self, *args, **options):
+        if options["batch_size"] < 1:
+            raise CommandError("--batch-size must be positive")
+        self.stdout.write("Pruning expired tokens...")
+
+        deleted = prune_expired_tokens(
+            batch_size=options["batch_size"], pause=options["pause"]
+        )
+
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} expired tokens"))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+from api.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = "Create the product full-text search index and rebuild its contents"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--database",
+            default=DEFAULT_DB_ALIAS,
+            help="Database alias to rebuild the index on",
+        )
+
+    def handle(self, *args, **options):
+        backend = get_search_backend(options["database"])
+        self.stdout.write(f"Rebuilding search index with {type(backend).__name__}...")
+
+        backend.install()
+        backend.rebuild()
+
+        self.stdout.write(self.style.SUCCESS("Search index rebuilt"))
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from api.selection import RECOUNT_BATCH_SIZE, recount_selection_counts
+
+
+class Command(BaseCommand):
+    help = "Repair drift in the denormalized Product.selection_count column"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=RECOUNT_BATCH_SIZE,
+            help="Number of product ids to reconcile per transaction",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only report how many products have drifted",
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write("Reconciling selection counts...")
+
+        drifted = recount_selection_counts(
+            batch_size=options["batch_size"], dry_run=options["dry_run"]
+        )
+
+        if options["dry_run"]:
+            self.stdout.write(f"{drifted} products have drifted selection counts")
+        else:
+            self.stdout.write(
+                self.style.SUCCESS(f"Repaired selection counts of {drifted} products")
+            )
@@ -1,22 +1,18 @@
-from django.core.management.base import BaseCommand
-from faker import Faker
-from api.models import Product
+import csv
+import io
 import random
+import time
+from multiprocessing import Pool
 
-fake = Faker()
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from api.caching import bump_catalog_version
+from api.models import CatalogVersion, CustomUser, Product
+from api.seeding import generate_rows
+from api.selection import BULK_BATCH_SIZE, Selection, recount_selection_counts
 
-PRODUCT_CATEGORIES = [
-    "Electronics",
-    "Books",
-    "Clothing",
-    "Home & Kitchen",
-    "Sports",
-    "Toys",
-    "Beauty",
-    "Automotive",
-    "Health",
-    "Garden",
-]
+SEED_USERNAME_PREFIX = "seed-user-"
 
 
 class Command(BaseCommand):
@@ -26,19 +22,159 @@ class Command(BaseCommand):
         parser.add_argument(
             "--count", type=int, default=10, help="Number of products to create"
         )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=5000,
+            help="Number of products generated and inserted per transaction",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=1,
+            help="Number of processes generating rows (1 generates inline)",
+        )
+        parser.add_argument(
+            "--seed", type=int, default=None, help="Random seed for reproducible data"
+        )
+        parser.add_argument(
+            "--users",
+            type=int,
+            default=0,
+            help="Number of synthetic users whose selections are seeded",
+        )
+        parser.add_argument(
+            "--selections-per-user",
+            type=int,
+            default=10,
+            help="Number of random products each synthetic user selects",
+        )
 
     def handle(self, *args, **options):
         count = options["count"]
+        batch_size = options["batch_size"]
+        if batch_size < 1 or options["workers"] < 1:
+            raise CommandError("--batch-size and --workers must be positive")
+        seed = options["seed"]
+        if seed is None:
+            seed = random.randrange(2**32)
+
         self.stdout.write("Seeding product data...")
+        started = time.monotonic()
+
+        # Continue the name sequence after existing rows so reruns stay unique
+        offset = Product.objects.count()
+        tasks = [
+            (offset + start, min(batch_size, count - start), seed)
+            for start in range(0, count, batch_size)
+        ]
+        if options["workers"] > 1:
+            with Pool(options["workers"]) as pool:
+                for rows in pool.imap_unordered(generate_rows, tasks):
+                    self.insert(rows)
+        else:
+            for task in tasks:
+                self.insert(generate_rows(task))
+        bump_catalog_version()
+        bump_catalog_version(CatalogVersion.PRODUCT_NAMES)
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Successfully created {count} products "
+                f"in {elapsed:.1f}s ({count / max(elapsed, 1e-9):,.0f} rows/s)"
+            )
+        )
+
+        if options["users"]:
+            self.seed_selections(options["users"], options["selections_per_user"], seed)
+
+    def insert(self, rows):
+        with transaction.atomic():
+            if connection.vendor == "postgresql":
+                self.copy_rows(rows)
+            else:
+                self.insert_rows(rows)
 
-        for _ in range(count):
-            category = random.choice(PRODUCT_CATEGORIES)
-            name = f"{fake.unique.word()} {category}"
-            Product.objects.create(
-                name=name,
-                description=fake.paragraph(nb_sentences=1),
-                price=round(random.uniform(9.99, 999.99), 2),
-                stock=random.randint(0, 100),
+    def insert_rows(self, rows):
+        # executemany skips building a model instance per row
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f"INSERT INTO {Product._meta.db_table} "
+                "(name, description, price, stock, selection_count) "
+                "VALUES (%s, %s, %s, %s, 0)",
+                [
+                    (name, description, f"{price:.2f}", stock)
+                    for name, description, price, stock in rows
+                ],
             )
 
-        self.stdout.write(self.style.SUCCESS(f"Successfully created {count} products"))
+    def copy_rows(self, rows):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in rows:
+            writer.writerow([*row, 0])
+        buffer.seek(0)
+        with connection.cursor() as cursor:
+            cursor.copy_expert(
+                f"COPY {Product._meta.db_table} "
+                "(name, description, price, stock, selection_count) "
+                "FROM STDIN WITH (FORMAT csv)",
+                buffer,
+            )
+
+    def seed_selections(self, user_count, per_user, seed):
+        self.stdout.write(f"Seeding selections for {user_count} users...")
+        started = time.monotonic()
+        rng = random.Random(seed)
+
+        usernames = [f"{SEED_USERNAME_PREFIX}{i}" for i in range(user_count)]
+        seed_users = CustomUser.objects.filter(
+            username__startswith=SEED_USERNAME_PREFIX
+        )
+        existing = set(seed_users.values_list("username", flat=True))
+        password = make_password(None)
+        # bulk_create skips CustomUser.save(), which sets username_key
+        CustomUser.objects.bulk_create(
+            (
+                CustomUser(
+                    username=username,
+                    username_key=CustomUser.normalize_username(username),
+                    email=username,
+                    password=password,
+                )
+                for username in usernames
+                if username not in existing
+            ),
+            batch_size=BULK_BATCH_SIZE,
+        )
+
+        product_ids = list(Product.objects.values_list("pk", flat=True))
+        per_user = min(per_user, len(product_ids))
+        wanted = set(usernames)
+        user_ids = [
+            pk
+            for pk, username in seed_users.values_list("pk", "username").iterator()
+            if username in wanted
+        ]
+        selections = 0
+        for user_id in user_ids:
+            with transaction.atomic():
+                Selection.objects.bulk_create(
+                    (
+                        Selection(product_id=product_id, customuser_id=user_id)
+                        for product_id in rng.sample(product_ids, per_user)
+                    ),
+                    batch_size=BULK_BATCH_SIZE,
+                    ignore_conflicts=True,
+                )
+            selections += per_user
+
+        recount_selection_counts()
+        bump_catalog_version()
+        elapsed = time.monotonic() - started
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Successfully seeded {selections} selections in {elapsed:.1f}s"
+            )
+        )
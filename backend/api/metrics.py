@@ -0,0 +1,424 @@
+"""
+Request metrics in the Prometheus text format, served at ``/api/metrics``.
+
+``MetricsMiddleware`` records, per view: request counts and a latency
+histogram, database queries and time, time spent serializing products,
+response bytes, and the requests in flight. ``api.admission`` adds the
+requests it sheds and the time requests wait for admission.
+
+Recording takes no locks: each thread updates its own shard of counters, and
+the shards are only summed when a snapshot is taken. Gunicorn runs several
+worker processes, so with ``API_METRICS_DIR`` set every process also writes
+its snapshot to ``<dir>/<pid>-<start>.json`` from a background thread every
+``API_METRICS_FLUSH_SECONDS`` and at exit, and a scrape, whichever worker
+serves it, merges the files of all processes. Counters of exited processes
+are kept, so totals never go backwards; their in-flight gauges are dropped.
+The directory should be emptied when the server starts.
+
+Scrapes must present ``API_METRICS_TOKEN`` as a bearer token when it is set.
+Without it, only requests made on the host itself (from a loopback address,
+not forwarded by a proxy) are answered.
+"""
+
+import atexit
+import contextvars
+import json
+import logging
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+LOOPBACK_ADDRESSES = ("127.0.0.1", "::1")
+
+COUNTER = "counter"
+GAUGE = "gauge"
+HISTOGRAM = "histogram"
+
+# name: (type, help, label names)
+METRICS = {
+    "api_requests_total": (
+        COUNTER,
+        "Requests handled.",
+        ("view", "method", "status"),
+    ),
+    "api_request_duration_seconds": (
+        HISTOGRAM,
+        "Time to produce a response.",
+        ("view", "method"),
+    ),
+    "api_db_queries_total": (COUNTER, "Database queries run.", ("view",)),
+    "api_db_query_duration_seconds_total": (
+        COUNTER,
+        "Time spent in database queries.",
+        ("view",),
+    ),
+    "api_serializer_duration_seconds_total": (
+        COUNTER,
+        "Time spent serializing products.",
+        ("view",),
+    ),
+    "api_response_bytes_total": (
+        COUNTER,
+        "Response body bytes, excluding streamed responses.",
+        ("view",),
+    ),
+    "api_requests_in_flight": (GAUGE, "Requests being handled.", ()),
+    "api_requests_shed_total": (
+        COUNTER,
+        "Requests rejected by admission control.",
+        ("view", "reason"),
+    ),
+    "api_admission_wait_seconds": (
+        HISTOGRAM,
+        "Time requests waited in line for admission.",
+        ("view",),
+    ),
+    "api_admission_waiting": (GAUGE, "Requests waiting for admission.", ()),
+}
+
+PROCESS_ID = f"{os.getpid()}-{time.time_ns()}"
+
+
+class Shard:
+    """Metric values written by a single thread."""
+
+    def __init__(self):
+        self.values = {}
+        self.histograms = {}
+
+    def inc(self, name, labels=(), amount=1):
+        key = (name, labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def observe(self, name, labels, value):
+        key = (name, labels)
+        counts = self.histograms.get(key)
+        if counts is None:
+            # One count per bucket plus +Inf, then the sum
+            counts = self.histograms[key] = [0] * (len(LATENCY_BUCKETS) + 2)
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                counts[i] += 1
+                break
+        else:
+            counts[len(LATENCY_BUCKETS)] += 1
+        counts[-1] += value
+
+
+class Registry:
+    def __init__(self):
+        self._local = threading.local()
+        self._shards = []
+        self._lock = threading.Lock()
+
+    @property
+    def shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = Shard()
+            # The only lock: taken once per thread, never when recording
+            with self._lock:
+                self._shards.append(shard)
+            return shard
+
+    def snapshot(self):
+        """Sum of all shards as a JSON-serializable list of samples."""
+        with self._lock:
+            shards = list(self._shards)
+        values, histograms = {}, {}
+        for shard in shards:
+            # dict.copy() is atomic under the GIL, unlike iterating the dict
+            for key, value in shard.values.copy().items():
+                values[key] = values.get(key, 0) + value
+            for key, counts in shard.histograms.copy().items():
+                total = histograms.setdefault(key, [0] * len(counts))
+                for i, count in enumerate(list(counts)):
+                    total[i] += count
+        return [
+            [name, list(labels), value]
+            for (name, labels), value in [*values.items(), *histograms.items()]
+        ]
+
+
+registry = Registry()
+
+
+class RequestStats:
+    __slots__ = ("queries", "db_time", "serializer_time")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.serializer_time = 0.0
+
+
+# Follows the request into sync_to_async threads under ASGI
+_current = contextvars.ContextVar("api_request_stats", default=None)
+
+
+def _time_query(execute, sql, params, many, context):
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.queries += 1
+        stats.db_time += time.perf_counter() - started
+
+
+def install_query_timer(connection, **kwargs):
+    if _time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_time_query)
+
+
+connection_created.connect(install_query_timer)
+
+
+@contextmanager
+def measure_serialization():
+    stats = _current.get()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if stats is not None:
+            stats.serializer_time += time.perf_counter() - started
+
+
+def view_label(request):
+    match = getattr(request, "resolver_match", None)
+    # Unrouted paths share one label to keep the series count bounded
+    return match.view_name if match is not None else "unmatched"
+
+
+def record(request, response, duration, stats):
+    shard = registry.shard
+    view = view_label(request)
+    shard.inc("api_requests_total", (view, request.method, str(response.status_code)))
+    shard.observe("api_request_duration_seconds", (view, request.method), duration)
+    shard.inc("api_db_queries_total", (view,), stats.queries)
+    shard.inc("api_db_query_duration_seconds_total", (view,), stats.db_time)
+    shard.inc("api_serializer_duration_seconds_total", (view,), stats.serializer_time)
+    if not response.streaming:
+        shard.inc("api_response_bytes_total", (view,), len(response.content))
+
+
+class MetricsFiles:
+    """Per-process snapshot files in ``API_METRICS_DIR``."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._flusher = None
+
+    @property
+    def directory(self):
+        return getattr(settings, "API_METRICS_DIR", None)
+
+    def start(self):
+        """Start flushing in the background, keeping file I/O off requests."""
+        if self._flusher is not None or not self.directory:
+            return
+        with self._lock:
+            if self._flusher is None:
+                self._flusher = threading.Thread(
+                    target=self._run, name="api-metrics-flusher", daemon=True
+                )
+                self._flusher.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Failed to write the metrics snapshot")
+            time.sleep(getattr(settings, "API_METRICS_FLUSH_SECONDS", 5))
+
+    def flush(self):
+        directory = self.directory
+        # Another thread is already writing the same snapshot
+        if not directory or not self._write_lock.acquire(blocking=False):
+            return
+        try:
+            path = os.path.join(directory, f"{PROCESS_ID}.json")
+            with open(f"{path}.tmp", "w") as f:
+                json.dump({"pid": os.getpid(), "samples": registry.snapshot()}, f)
+            os.replace(f"{path}.tmp", path)
+        finally:
+            self._write_lock.release()
+
+    def other_processes(self):
+        directory = self.directory
+        if not directory or not os.path.isdir(directory):
+            return
+        for filename in os.listdir(directory):
+            if not filename.endswith(".json") or filename == f"{PROCESS_ID}.json":
+                continue
+            try:
+                with open(os.path.join(directory, filename)) as f:
+                    yield json.load(f)
+            except (OSError, ValueError):
+                # Exited mid-write or removed while listing
+                continue
+
+
+metrics_files = MetricsFiles()
+atexit.register(metrics_files.flush)
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def collect():
+    """Samples of this process merged with the other processes' files."""
+    merged = {}
+
+    def add(samples, include_gauges=True):
+        for name, labels, value in samples:
+            if name not in METRICS or (
+                METRICS[name][0] == GAUGE and not include_gauges
+            ):
+                continue
+            key = (name, tuple(labels))
+            if isinstance(value, list):
+                total = merged.setdefault(key, [0] * len(value))
+                for i, count in enumerate(value):
+                    total[i] += count
+            else:
+                merged[key] = merged.get(key, 0) + value
+
+    add(registry.snapshot())
+    for snapshot in metrics_files.other_processes():
+        add(snapshot["samples"], include_gauges=_pid_alive(snapshot["pid"]))
+    return merged
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ""
+    escaped = (
+        (name, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for name, value in pairs
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+def _format_value(value):
+    if isinstance(value, float) and not value.is_integer():
+        return repr(value)
+    return str(int(value))
+
+
+def render(samples):
+    lines = []
+    for name, (kind, help_text, label_names) in METRICS.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        series = sorted(
+            (labels, value) for (n, labels), value in samples.items() if n == name
+        )
+        if kind == GAUGE and not series:
+            series = [((), 0)]
+        for labels, value in series:
+            if kind != HISTOGRAM:
+                label_text = _format_labels(label_names, labels)
+                lines.append(f"{name}{label_text} {_format_value(value)}")
+                continue
+            cumulative = 0
+            for bound, count in zip((*LATENCY_BUCKETS, math.inf), value):
+                cumulative += count
+                le = "+Inf" if bound == math.inf else repr(bound)
+                label_text = _format_labels(label_names, labels, [("le", le)])
+                lines.append(f"{name}_bucket{label_text} {cumulative}")
+            label_text = _format_labels(label_names, labels)
+            lines.append(f"{name}_sum{label_text} {_format_value(value[-1])}")
+            lines.append(f"{name}_count{label_text} {cumulative}")
+    return "\n".join(lines) + "\n"
+
+
+def is_local(request):
+    return request.META.get("REMOTE_ADDR") in LOOPBACK_ADDRESSES and not any(
+        header in request.headers for header in ("X-Forwarded-For", "X-Real-IP")
+    )
+
+
+def metrics_view(request):
+    token = getattr(settings, "API_METRICS_TOKEN", None)
+    if token:
+        if request.headers.get("Authorization") != f"Bearer {token}":
+            return HttpResponse(status=401)
+    elif not is_local(request):
+        return HttpResponse(status=403)
+    return HttpResponse(
+        render(collect()), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+        # Connections opened before the middleware was loaded
+        for connection in connections.all(initialized_only=True):
+            install_query_timer(connection)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        stats, token, started = self.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            self.finish(token)
+        self.end(request, response, stats, started)
+        return response
+
+    async def __acall__(self, request):
+        stats, token, started = self.start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            self.finish(token)
+        self.end(request, response, stats, started)
+        return response
+
+    def start(self):
+        stats = RequestStats()
+        registry.shard.inc("api_requests_in_flight")
+        return stats, _current.set(stats), time.perf_counter()
+
+    def finish(self, token):
+        _current.reset(token)
+        registry.shard.inc("api_requests_in_flight", amount=-1)
+
+    def end(self, request, response, stats, started):
+        record(request, response, time.perf_counter() - started, stats)
+        metrics_files.start()
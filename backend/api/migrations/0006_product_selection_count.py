@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:57
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_selection_count(apps, schema_editor):
+    Product = apps.get_model("api", "Product")
+    Selection = Product.selected_by.through
+    counts = (
+        Selection.objects.filter(product_id=OuterRef("pk"))
+        .order_by()
+        .values("product_id")
+        .annotate(count=Count("*"))
+        .values("count")
+    )
+    Product.objects.using(schema_editor.connection.alias).update(
+        selection_count=Coalesce(Subquery(counts), 0)
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0005_product_keyset_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="product",
+            name="selection_count",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_selection_count, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="product",
+            index=models.Index(
+                fields=["selection_count", "id"], name="api_product_selection_id_idx"
+            ),
+        ),
+    ]
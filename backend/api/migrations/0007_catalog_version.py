@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:58
+
+from django.db import migrations, models
+
+
+def create_products_version(apps, schema_editor):
+    CatalogVersion = apps.get_model("api", "CatalogVersion")
+    CatalogVersion.objects.using(schema_editor.connection.alias).get_or_create(
+        name="products"
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0006_product_selection_count"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CatalogVersion",
+            fields=[
+                (
+                    "name",
+                    models.CharField(max_length=50, primary_key=True, serialize=False),
+                ),
+                ("version", models.PositiveBigIntegerField(default=0)),
+            ],
+            options={
+                "db_table": "api_catalog_version",
+            },
+        ),
+        migrations.RunPython(create_products_version, migrations.RunPython.noop),
+    ]
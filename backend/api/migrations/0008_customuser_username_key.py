@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:09
+
+import unicodedata
+
+import api.models
+from django.db import migrations, models
+
+
+def fill_username_keys(apps, schema_editor):
+    CustomUser = apps.get_model("api", "CustomUser")
+    users = CustomUser.objects.using(schema_editor.connection.alias)
+    # The oldest user with a name keeps it; later duplicates stay keyless
+    seen = set()
+    for pk, username in users.order_by("pk").values_list("pk", "username").iterator():
+        key = unicodedata.normalize("NFKC", username)
+        if key not in seen:
+            seen.add(key)
+            users.filter(pk=pk).update(username_key=key)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0007_catalog_version"),
+    ]
+
+    operations = [
+        migrations.AlterModelManagers(
+            name="customuser",
+            managers=[
+                ("objects", api.models.CustomUserManager()),
+            ],
+        ),
+        migrations.AddField(
+            model_name="customuser",
+            name="username_key",
+            field=models.CharField(
+                editable=False, max_length=150, null=True, unique=True
+            ),
+        ),
+        migrations.RunPython(fill_username_keys, migrations.RunPython.noop),
+    ]
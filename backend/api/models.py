@@ -1,11 +1,39 @@
 from django.db import models
-from django.contrib.auth.models import AbstractUser
+from django.db.models import BooleanField, Exists, OuterRef, Prefetch, Value
+from django.contrib.auth.models import AbstractUser, UserManager
+
+
+class CustomUserManager(UserManager):
+    def get_or_create_for_login(self, username, email=""):
+        """
+        Return the user logging in as ``username``, creating it if needed.
+
+        Looks the user up by the unique ``username_key`` and creates it with
+        an ``INSERT`` that ignores conflicts, so concurrent logins with the
+        same name end up with the same row without a transaction or retries.
+        """
+        key = self.model.normalize_username(username)
+        user = self.filter(username_key=key).first()
+        if user is None:
+            self.bulk_create(
+                [self.model(username=username, username_key=key, email=email)],
+                ignore_conflicts=True,
+            )
+            user = self.get(username_key=key)
+        return user
 
 
 class CustomUser(AbstractUser):
     username = models.CharField(max_length=150, unique=False)
+    # Unicode-normalized username used for lookups. Null for duplicates of
+    # another user's name that predate the column; they can't log in.
+    username_key = models.CharField(
+        max_length=150, unique=True, null=True, editable=False
+    )
     email = models.EmailField(blank=True)
 
+    objects = CustomUserManager()
+
     USERNAME_FIELD = "username"
     REQUIRED_FIELDS = ["email"]
 
@@ -19,19 +47,103 @@ class CustomUser(AbstractUser):
     def __str__(self):
         return self.username
 
+    def save(self, *args, **kwargs):
+        if self._state.adding and self.username_key is None:
+            self.username_key = self.normalize_username(self.username)
+        super().save(*args, **kwargs)
+
+
+class ProductQuerySet(models.QuerySet):
+    def with_selection(self, user, is_selected=True, selected_by=True):
+        """Annotate ``is_selected`` for ``user`` and prefetch selector usernames.
+
+        ``is_selected`` is computed in SQL with an EXISTS on the M2M through
+        table, and the selectors are loaded in a single batched query that
+        only reads the ``username`` column, so serializing a list costs a
+        constant number of queries regardless of its length. Either part can
+        be left out when the response doesn't include it.
+        """
+        queryset = self
+        if is_selected:
+            if user is not None and user.pk is not None:
+                through = self.model.selected_by.through
+                value = Exists(
+                    through.objects.filter(
+                        product_id=OuterRef("pk"), customuser_id=user.pk
+                    )
+                )
+            else:
+                value = Value(False, output_field=BooleanField())
+            queryset = queryset.annotate(is_selected=value)
+
+        if selected_by:
+            queryset = queryset.prefetch_related(
+                Prefetch(
+                    "selected_by",
+                    queryset=CustomUser.objects.only("username").order_by("pk"),
+                )
+            )
+        return queryset
+
 
 class Product(models.Model):
     id = models.AutoField(primary_key=True)
+    # Supplier's natural key, used by import_products to upsert feed rows
+    sku = models.CharField(max_length=64, unique=True, null=True, blank=True)
     name = models.CharField(max_length=200)
     description = models.TextField()
     price = models.DecimalField(max_digits=10, decimal_places=2)
     stock = models.IntegerField(default=0)
+    # Denormalized number of selectors, maintained by api.selection
+    selection_count = models.PositiveIntegerField(default=0, editable=False)
     selected_by = models.ManyToManyField(
         "CustomUser", related_name="selected_products", blank=True
     )
 
+    objects = ProductQuerySet.as_manager()
+
     def __str__(self):
         return self.name
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Lets api.signals tell renames from other saves
+        instance._loaded_name = instance.__dict__.get("name")
+        return instance
+
     class Meta:
         db_table = "api_product"
+        # Composite indexes backing keyset pagination on the sortable columns
+        indexes = [
+            models.Index(fields=["name", "id"], name="api_product_name_id_idx"),
+            models.Index(fields=["price", "id"], name="api_product_price_id_idx"),
+            models.Index(fields=["stock", "id"], name="api_product_stock_id_idx"),
+            models.Index(
+                fields=["selection_count", "id"],
+                name="api_product_selection_id_idx",
+            ),
+        ]
+
+
+class CatalogVersion(models.Model):
+    """
+    Monotonic counter bumped whenever product data or selections change.
+
+    Read responses derive their ETags from it, so any write that can change
+    what ``/api/products/`` returns must bump it (see ``api.caching``).
+    ``PRODUCT_NAMES`` is bumped by writes that change product names, so that
+    every process rebuilds its suggest index (see ``api.suggest``).
+    """
+
+    PRODUCTS = "products"
+    PRODUCT_NAMES = "product-names"
+
+    name = models.CharField(max_length=50, primary_key=True)
+    version = models.PositiveBigIntegerField(default=0)
+
+    class Meta:
+        db_table = "api_catalog_version"
+
+    def __str__(self):
+        return f"{self.name}@{self.version}"
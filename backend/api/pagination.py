@@ -0,0 +1,158 @@
+import base64
+import binascii
+import json
+from decimal import Decimal
+
+from django.core.exceptions import FieldDoesNotExist
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Opaque-cursor pagination over ``(ordering field, id)``.
+
+    Each page is a range scan continuing after the last row of the previous
+    page, so fetching page N costs the same as page 1: there is no OFFSET and
+    no ``COUNT(*)``. Only forward links are produced; clients page
+    incrementally by following ``next``.
+    """
+
+    cursor_query_param = "cursor"
+    ordering_query_param = "ordering"
+    page_size_query_param = "page_size"
+    page_size = 50
+    max_page_size = 500
+    ordering_fields = ("id", "name", "price", "stock", "selection_count")
+    # Annotation added by the search backends; only orderable while searching
+    rank_field = "search_rank"
+    invalid_cursor_message = "Invalid cursor"
+
+    def get_page_size(self, request):
+        value = request.query_params.get(self.page_size_query_param)
+        if value is None:
+            return self.page_size
+        try:
+            page_size = int(value)
+        except ValueError:
+            raise ValidationError({self.page_size_query_param: "Must be an integer."})
+        if page_size < 1:
+            raise ValidationError({self.page_size_query_param: "Must be positive."})
+        return min(page_size, self.max_page_size)
+
+    def get_ordering(self, request, queryset):
+        ordering = request.query_params.get(self.ordering_query_param)
+        searching = self.rank_field in queryset.query.annotations
+        if not ordering:
+            return self.rank_field if searching else "id"
+
+        field = ordering.removeprefix("-")
+        if field in self.ordering_fields or (searching and field == self.rank_field):
+            return ordering
+        raise ValidationError(
+            {self.ordering_query_param: f"Cannot order by '{ordering}'."}
+        )
+
+    def encode_cursor(self, ordering, value, pk):
+        if isinstance(value, Decimal):
+            value = str(value)
+        payload = json.dumps([ordering, value, pk], separators=(",", ":"))
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+    def decode_cursor(self, encoded, ordering):
+        try:
+            padded = encoded + "=" * (-len(encoded) % 4)
+            cursor_ordering, value, pk = json.loads(base64.urlsafe_b64decode(padded))
+        except (TypeError, ValueError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+        if cursor_ordering != ordering or not isinstance(pk, int):
+            raise NotFound(self.invalid_cursor_message)
+        return value, pk
+
+    def clean_cursor_value(self, queryset, field, value):
+        try:
+            if field == self.rank_field:
+                return float(value)
+            return queryset.model._meta.get_field(field).to_python(value)
+        except (TypeError, ValueError, FieldDoesNotExist, DjangoValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def filter_after(self, queryset, ordering, value, pk):
+        descending = ordering.startswith("-")
+        field = ordering.removeprefix("-")
+        op = "lt" if descending else "gt"
+        if field == "id":
+            return queryset.filter(**{f"id__{op}": pk})
+        value = self.clean_cursor_value(queryset, field, value)
+        return queryset.filter(
+            Q(**{f"{field}__{op}": value}) | Q(**{field: value, f"id__{op}": pk})
+        )
+
+    def load_field(self, queryset, field):
+        # The next link is built from the last row's ordering value, which
+        # would cost a query of its own if only()/defer() left it out
+        names, deferring = queryset.query.deferred_loading
+        if field in ("id", self.rank_field) or not names:
+            return queryset
+        if deferring and field in names:
+            return queryset.defer(None).defer(*(names - {field}))
+        if not deferring and field not in names:
+            return queryset.only(*names, field)
+        return queryset
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.paginate_results(list(self.page_queryset(queryset, request)))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        queryset = self.page_queryset(queryset, request)
+        return self.paginate_results([row async for row in queryset])
+
+    def page_queryset(self, queryset, request):
+        """The unevaluated query for the requested page, plus one row."""
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(request, queryset)
+
+        field = self.ordering.removeprefix("-")
+        id_ordering = "-id" if self.ordering.startswith("-") else "id"
+        order_by = [id_ordering] if field == "id" else [self.ordering, id_ordering]
+        queryset = self.load_field(queryset.order_by(*order_by), field)
+
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded:
+            value, pk = self.decode_cursor(encoded, self.ordering)
+            queryset = self.filter_after(queryset, self.ordering, value, pk)
+
+        # Fetch one extra row to learn whether another page exists
+        return queryset[: self.page_size + 1]
+
+    def paginate_results(self, results):
+        self.has_next = len(results) > self.page_size
+        results = results[: self.page_size]
+        self.last = results[-1] if results else None
+        return results
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        value = getattr(self.last, self.ordering.removeprefix("-"))
+        cursor = self.encode_cursor(self.ordering, value, self.last.pk)
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def get_paginated_response(self, data):
+        return Response({"next": self.get_next_link(), "results": data})
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "required": ["results"],
+            "properties": {
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "results": schema,
+            },
+        }
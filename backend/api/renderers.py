@@ -0,0 +1,58 @@
+"""
+orjson-based drop-in replacements for DRF's ``JSONRenderer`` and ``JSONParser``.
+
+Enabled with ``API_FAST_JSON=1`` (see ``REST_FRAMEWORK`` in the settings).
+Compact responses are byte-for-byte what ``JSONRenderer`` produces for the
+API's data: values orjson doesn't handle the same way as DRF's encoder
+(``Decimal``, datetimes, lazy strings, ...) are passed through to that
+encoder, and U+2028/U+2029 are escaped the same way. ``price`` is a string
+by the time it is rendered (``COERCE_DECIMAL_TO_STRING``), so it is copied
+verbatim. Pretty-printed output (``?indent=``, the browsable API) and
+non-compact settings fall back to ``JSONRenderer``.
+
+orjson rejects NaN and infinity when parsing, as the strict ``JSONParser``
+does, but renders them as ``null`` where ``JSONRenderer`` raises.
+"""
+
+import codecs
+
+import orjson
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+OPTIONS = (
+    orjson.OPT_NON_STR_KEYS
+    | orjson.OPT_PASSTHROUGH_DATETIME
+    | orjson.OPT_PASSTHROUGH_DATACLASS
+)
+
+
+class ORJSONRenderer(JSONRenderer):
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        indent = self.get_indent(accepted_media_type, renderer_context or {})
+        if indent is not None or self.ensure_ascii or not self.compact:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        ret = orjson.dumps(data, default=self.encoder_class().default, option=OPTIONS)
+        # Same escaping as JSONRenderer, so output stays a javascript subset
+        return ret.replace(b"\xe2\x80\xa8", b"\\u2028").replace(
+            b"\xe2\x80\xa9", b"\\u2029"
+        )
+
+
+class ORJSONParser(JSONParser):
+    renderer_class = ORJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        encoding = (parser_context or {}).get("encoding", settings.DEFAULT_CHARSET)
+        try:
+            body = stream.read()
+            if codecs.lookup(encoding).name != "utf-8":
+                body = body.decode(encoding)
+            return orjson.loads(body)
+        except (ValueError, UnicodeDecodeError) as exc:
+            raise ParseError("JSON parse error - %s" % str(exc))
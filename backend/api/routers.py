@@ -0,0 +1,135 @@
+"""
+Read-replica routing for product reads.
+
+Replicas are the database aliases listed in ``DATABASE_REPLICAS`` (see
+``DATABASE_REPLICA_URLS`` in the settings). Nothing is read from them unless
+a view opts in with ``read_from_replicas()``, as ``ProductViewSet`` does for
+its reads once the request is authenticated; token checks and everything
+else stay on the primary.
+
+Replicas lag behind the primary, so a user who just wrote keeps reading
+from the primary for ``DATABASE_STICKY_SECONDS``: ``ReplicaRoutingMiddleware``
+pins the user when a request wrote anything, and a request that has written
+reads its own writes from the primary for the rest of the request. A request
+reads everything from the same replica, so that the catalog version behind
+its ETag is never newer than the rows it returns. Pins are
+kept in the ``DATABASE_PIN_CACHE`` cache, which has to be shared by all
+worker processes for the pin to follow the user's next request.
+"""
+
+import contextvars
+import random
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS
+
+PIN_KEY = "db-pin:{}"
+
+
+class RoutingState:
+    __slots__ = ("use_replicas", "replica", "wrote")
+
+    def __init__(self):
+        self.use_replicas = False
+        # Chosen at the first replica read, then used for the whole request
+        self.replica = None
+        self.wrote = False
+
+
+_state = contextvars.ContextVar("db_routing_state", default=None)
+
+
+def replicas():
+    return getattr(settings, "DATABASE_REPLICAS", [])
+
+
+def pin_cache():
+    return caches[getattr(settings, "DATABASE_PIN_CACHE", "default")]
+
+
+def pin_user(user_id):
+    """Keep ``user_id`` on the primary for ``DATABASE_STICKY_SECONDS``."""
+    if user_id is not None and replicas():
+        pin_cache().set(
+            PIN_KEY.format(user_id),
+            True,
+            timeout=getattr(settings, "DATABASE_STICKY_SECONDS", 5),
+        )
+
+
+def is_pinned(user_id):
+    return user_id is not None and bool(pin_cache().get(PIN_KEY.format(user_id)))
+
+
+def read_from_replicas(user_id):
+    """Send the rest of the current request's reads to a replica if allowed."""
+    state = _state.get()
+    if state is not None and replicas() and not is_pinned(user_id):
+        state.use_replicas = True
+
+
+class ReplicaRouter:
+    def choose_replica(self):
+        return random.choice(replicas())
+
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if state is None or not state.use_replicas or state.wrote:
+            return DEFAULT_DB_ALIAS
+        if state.replica is None:
+            state.replica = self.choose_replica()
+        return state.replica
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in replicas()
+
+
+class ReplicaRoutingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        state = RoutingState()
+        token = _state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _state.reset(token)
+        self.finish(request, state)
+        return response
+
+    async def __acall__(self, request):
+        state = RoutingState()
+        token = _state.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _state.reset(token)
+        self.finish(request, state)
+        return response
+
+    def finish(self, request, state):
+        if state.wrote:
+            # Set by DRF once it has authenticated the request
+            user = getattr(request, "user", None)
+            pin_user(getattr(user, "pk", None))
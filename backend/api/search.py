@@ -0,0 +1,201 @@
+"""
+Full-text search backends for products.
+
+The backend is picked from the database vendor unless ``PRODUCT_SEARCH_BACKEND``
+names one explicitly:
+
+* SQLite uses an external-content FTS5 table kept in sync by triggers, so
+  ``save()``, ``delete()``, ``bulk_create()`` and ``QuerySet.update()`` all
+  update the index without any Python-side hooks.
+* PostgreSQL uses a GIN index over the ``tsvector`` expression the queries
+  filter on, which the database maintains on every write.
+* Anything else falls back to the old ``icontains`` scan.
+
+Every backend annotates ``search_rank``, where lower values rank higher.
+"""
+
+import functools
+import re
+import sqlite3
+
+from django.conf import settings
+from django.db import connections, DEFAULT_DB_ALIAS
+from django.db.models import BooleanField, FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+from django.utils.module_loading import import_string
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def tokenize(query):
+    return TOKEN_RE.findall(query.lower())
+
+
+class BaseSearchBackend:
+    def __init__(self, connection):
+        self.connection = connection
+
+    def install(self):
+        """Create whatever index structures the backend needs (idempotent)."""
+
+    def rebuild(self):
+        """Rebuild the index from the ``api_product`` table."""
+
+    def search(self, queryset, query):
+        raise NotImplementedError
+
+
+class IContainsSearchBackend(BaseSearchBackend):
+    def search(self, queryset, query):
+        return queryset.filter(
+            Q(name__icontains=query) | Q(description__icontains=query)
+        ).annotate(search_rank=Value(0.0, output_field=FloatField()))
+
+
+class SQLiteFTS5SearchBackend(BaseSearchBackend):
+    table = "api_product_fts"
+
+    install_sql = [
+        f"""
+        CREATE VIRTUAL TABLE IF NOT EXISTS {table} USING fts5(
+            name, description,
+            content='api_product', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {table}_ai AFTER INSERT ON api_product BEGIN
+            INSERT INTO {table}(rowid, name, description)
+            VALUES (new.id, new.name, new.description);
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {table}_ad AFTER DELETE ON api_product BEGIN
+            INSERT INTO {table}({table}, rowid, name, description)
+            VALUES ('delete', old.id, old.name, old.description);
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {table}_au
+        AFTER UPDATE OF id, name, description ON api_product BEGIN
+            INSERT INTO {table}({table}, rowid, name, description)
+            VALUES ('delete', old.id, old.name, old.description);
+            INSERT INTO {table}(rowid, name, description)
+            VALUES (new.id, new.name, new.description);
+        END
+        """,
+    ]
+
+    @staticmethod
+    @functools.cache
+    def is_available():
+        try:
+            sqlite3.connect(":memory:").execute(
+                "CREATE VIRTUAL TABLE fts5_probe USING fts5(x)"
+            )
+        except sqlite3.OperationalError:
+            return False
+        return True
+
+    def install(self):
+        with self.connection.cursor() as cursor:
+            exists = self.table in self.connection.introspection.table_names(cursor)
+            for sql in self.install_sql:
+                cursor.execute(sql)
+        # Triggers only see new writes, so backfill rows that already existed.
+        # Table remakes during migrations drop the triggers, which is why
+        # install() runs again after every migrate.
+        if not exists:
+            self.rebuild()
+
+    def rebuild(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f"INSERT INTO {self.table}({self.table}) VALUES ('rebuild')")
+
+    @staticmethod
+    def match_expression(query):
+        # Quote every token so user input can't inject FTS5 query syntax, and
+        # prefix-match the words so partially typed queries still hit.
+        return " ".join(f'"{token}"*' for token in tokenize(query))
+
+    def search(self, queryset, query):
+        expression = self.match_expression(query)
+        if not expression:
+            return IContainsSearchBackend(self.connection).search(queryset, query)
+
+        return queryset.filter(
+            RawSQL(
+                f'"api_product"."id" IN (SELECT rowid FROM {self.table} '
+                f"WHERE {self.table} MATCH %s)",
+                [expression],
+                output_field=BooleanField(),
+            )
+        ).annotate(
+            search_rank=RawSQL(
+                f"(SELECT rank FROM {self.table} WHERE {self.table} MATCH %s "
+                f'AND rowid = "api_product"."id")',
+                [expression],
+                output_field=FloatField(),
+            )
+        )
+
+
+class PostgresSearchBackend(BaseSearchBackend):
+    index = "api_product_search_idx"
+    config = "english"
+    document_sql = (
+        f"to_tsvector('{config}', coalesce(\"api_product\".\"name\", '') || ' ' "
+        f'|| coalesce("api_product"."description", \'\'))'
+    )
+
+    def install(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS {self.index} "
+                f"ON api_product USING GIN (({self.document_sql}))"
+            )
+
+    def rebuild(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f"REINDEX INDEX {self.index}")
+
+    @staticmethod
+    def tsquery(query):
+        return " & ".join(f"{token}:*" for token in tokenize(query))
+
+    def search(self, queryset, query):
+        tsquery = self.tsquery(query)
+        if not tsquery:
+            return IContainsSearchBackend(self.connection).search(queryset, query)
+
+        query_sql = f"to_tsquery('{self.config}', %s)"
+        return queryset.filter(
+            RawSQL(
+                f"{self.document_sql} @@ {query_sql}",
+                [tsquery],
+                output_field=BooleanField(),
+            )
+        ).annotate(
+            search_rank=RawSQL(
+                f"-ts_rank({self.document_sql}, {query_sql})",
+                [tsquery],
+                output_field=FloatField(),
+            )
+        )
+
+
+def get_search_backend(using=DEFAULT_DB_ALIAS):
+    connection = connections[using]
+    backend_path = getattr(settings, "PRODUCT_SEARCH_BACKEND", None)
+    if backend_path:
+        return import_string(backend_path)(connection)
+    if connection.vendor == "sqlite" and SQLiteFTS5SearchBackend.is_available():
+        return SQLiteFTS5SearchBackend(connection)
+    if connection.vendor == "postgresql":
+        return PostgresSearchBackend(connection)
+    return IContainsSearchBackend(connection)
+
+
+def install_search_index(using=DEFAULT_DB_ALIAS, **kwargs):
+    """``post_migrate`` receiver that (re)installs the search index."""
+    get_search_backend(using).install()
@@ -0,0 +1,71 @@
+"""
+Fake product generation for ``seed_products``.
+
+This module deliberately avoids importing Django models so that worker
+processes can import it without setting up Django.
+"""
+
+import random
+
+from faker import Faker
+
+PRODUCT_CATEGORIES = [
+    "Electronics",
+    "Books",
+    "Clothing",
+    "Home & Kitchen",
+    "Sports",
+    "Toys",
+    "Beauty",
+    "Automotive",
+    "Health",
+    "Garden",
+]
+
+_vocabulary = None
+
+
+def vocabulary():
+    """Faker's word list in a fixed shuffled order, identical in every process."""
+    global _vocabulary
+    if _vocabulary is None:
+        words = sorted(set(Faker().get_words_list()))
+        random.Random(0).shuffle(words)
+        _vocabulary = words
+    return _vocabulary
+
+
+def product_name(index):
+    """
+    Return a name that is unique for every ``index``.
+
+    The category cycles fastest and the remaining quotient is written in
+    bijective base-N over the vocabulary, so names stay short ("word
+    Category") until the single-word space is used up and then grow a word
+    at a time, without any set of already used names.
+    """
+    words = vocabulary()
+    category = PRODUCT_CATEGORIES[index % len(PRODUCT_CATEGORIES)]
+    n = index // len(PRODUCT_CATEGORIES)
+    parts = []
+    while n >= 0:
+        parts.append(words[n % len(words)])
+        n = n // len(words) - 1
+    return " ".join([*parts, category])
+
+
+def generate_rows(task):
+    """Generate ``(name, description, price, stock)`` rows for one batch."""
+    start, size, seed = task
+    rng = random.Random(seed + start)
+    fake = Faker()
+    fake.seed_instance(seed + start)
+    return [
+        (
+            product_name(index),
+            fake.paragraph(nb_sentences=1),
+            round(rng.uniform(9.99, 999.99), 2),
+            rng.randint(0, 100),
+        )
+        for index in range(start, start + size)
+    ]
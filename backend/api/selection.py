@@ -0,0 +1,222 @@
+"""
+Product selection writes.
+
+All changes to who selected what go through these helpers, which work on the
+``Product.selected_by`` through table directly: membership is changed with
+conditional deletes and conflict-ignoring inserts instead of loading the
+related users first.
+
+They also maintain ``Product.selection_count`` with atomic ``F()`` updates in
+the same transaction, and bump the catalog version used for ETags once it
+commits. Counters only move by the rows a statement actually inserted or
+deleted, so concurrent writes to the same selection can't make them drift.
+Writes that bypass this module (e.g. the related managers or deleting a user)
+let the counters drift until ``recount_selection_counts()`` (the
+``reconcile_selection_counts`` command) repairs them. Committed changes are
+announced through the ``selection_changed`` signal.
+"""
+
+from django.db import connection, transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from .caching import bump_catalog_version
+from .models import Product
+from .signals import selection_changed
+
+SET = "set"
+UNSET = "unset"
+TOGGLE = "toggle"
+MODES = (SET, UNSET, TOGGLE)
+
+BULK_BATCH_SIZE = 500
+RECOUNT_BATCH_SIZE = 10000
+
+Selection = Product.selected_by.through
+
+
+def _batches(product_ids):
+    product_ids = list(product_ids)
+    for start in range(0, len(product_ids), BULK_BATCH_SIZE):
+        yield product_ids[start : start + BULK_BATCH_SIZE]
+
+
+def _insert(user, product_ids):
+    """
+    Select the existing ones of ``product_ids`` for ``user`` and return the
+    ids of the rows inserted, leaving out those already selected.
+    """
+    inserted = []
+    with connection.cursor() as cursor:
+        for batch in _batches(product_ids):
+            placeholders = ", ".join(["%s"] * len(batch))
+            # Selecting from the product table skips ids that don't exist
+            cursor.execute(
+                f"INSERT INTO {Selection._meta.db_table} (product_id, customuser_id) "
+                f"SELECT id, %s FROM {Product._meta.db_table} "
+                f"WHERE id IN ({placeholders}) "
+                "ON CONFLICT DO NOTHING RETURNING product_id",
+                [user.pk, *batch],
+            )
+            inserted.extend(product_id for (product_id,) in cursor.fetchall())
+    return inserted
+
+
+def _delete(user, product_ids=None):
+    """
+    Unselect ``product_ids`` (None: every product) for ``user`` and return
+    the ids of the rows deleted.
+    """
+    table = Selection._meta.db_table
+    with connection.cursor() as cursor:
+        if product_ids is None:
+            cursor.execute(
+                f"DELETE FROM {table} WHERE customuser_id = %s RETURNING product_id",
+                [user.pk],
+            )
+            return [product_id for (product_id,) in cursor.fetchall()]
+        deleted = []
+        for batch in _batches(product_ids):
+            placeholders = ", ".join(["%s"] * len(batch))
+            cursor.execute(
+                f"DELETE FROM {table} WHERE customuser_id = %s "
+                f"AND product_id IN ({placeholders}) RETURNING product_id",
+                [user.pk, *batch],
+            )
+            deleted.extend(product_id for (product_id,) in cursor.fetchall())
+    return deleted
+
+
+def _adjust_counts(product_ids, delta):
+    for batch in _batches(product_ids):
+        Product.objects.filter(pk__in=batch).update(
+            selection_count=F("selection_count") + delta
+        )
+
+
+def _announce(user, added=(), removed=()):
+    transaction.on_commit(
+        lambda: selection_changed.send(
+            sender=Product, user=user, added=list(added), removed=list(removed)
+        )
+    )
+
+
+def toggle_selection(user, product_id):
+    """
+    Flip ``user``'s selection of a product and return whether it is now selected.
+
+    Raises ``Product.DoesNotExist`` if the product does not exist.
+    """
+    with transaction.atomic():
+        deleted, _ = Selection.objects.filter(
+            product_id=product_id, customuser_id=user.pk
+        ).delete()
+        if deleted:
+            _adjust_counts([product_id], -1)
+            bump_catalog_version()
+            _announce(user, removed=[product_id])
+            return False
+        if not _insert(user, [product_id]):
+            if not Product.objects.filter(pk=product_id).exists():
+                raise Product.DoesNotExist
+            # A concurrent toggle selected it first and counted it
+            return True
+        _adjust_counts([product_id], 1)
+        bump_catalog_version()
+        _announce(user, added=[product_id])
+        return True
+
+
+def apply_selection(user, product_ids, mode):
+    """
+    Set, unset or toggle ``user``'s selection of many products at once.
+
+    Returns ``(added, removed)`` as sorted lists of product ids. Raises
+    ``Product.DoesNotExist`` if any of the products does not exist, in which
+    case nothing is changed.
+    """
+    if mode not in MODES:
+        raise ValueError(f"Unknown selection mode: {mode!r}")
+    requested = set(product_ids)
+
+    with transaction.atomic():
+        found = set(
+            Product.objects.filter(pk__in=requested).values_list("pk", flat=True)
+        )
+        if found != requested:
+            raise Product.DoesNotExist(sorted(requested - found))
+
+        selected = set(
+            Selection.objects.filter(
+                customuser_id=user.pk, product_id__in=requested
+            ).values_list("product_id", flat=True)
+        )
+        added = requested - selected if mode in (SET, TOGGLE) else set()
+        removed = selected if mode in (UNSET, TOGGLE) else set()
+
+        # Concurrent writes may have changed some of them since the read;
+        # only the rows actually deleted and inserted are counted
+        if removed:
+            removed = set(_delete(user, removed))
+            _adjust_counts(removed, -1)
+        if added:
+            added = set(_insert(user, added))
+            _adjust_counts(added, 1)
+        if added or removed:
+            bump_catalog_version()
+            _announce(user, sorted(added), sorted(removed))
+
+    return sorted(added), sorted(removed)
+
+
+def clear_selection(user):
+    """Unselect everything ``user`` selected and return the affected product ids."""
+    selections = Selection.objects.filter(customuser_id=user.pk)
+    # Most logins have nothing to clear; don't open a transaction for them
+    if not selections.exists():
+        return []
+    with transaction.atomic():
+        removed = _delete(user)
+        if removed:
+            _adjust_counts(removed, -1)
+            bump_catalog_version()
+            _announce(user, removed=removed)
+    return removed
+
+
+def recount_selection_counts(batch_size=RECOUNT_BATCH_SIZE, dry_run=False):
+    """
+    Recompute ``selection_count`` from the through table, one id range per
+    transaction so the product table is never locked as a whole.
+
+    Returns the number of products whose counter had drifted.
+    """
+    counts = (
+        Selection.objects.filter(product_id=OuterRef("pk"))
+        .order_by()
+        .values("product_id")
+        .annotate(count=Count("*"))
+        .values("count")
+    )
+    actual = Coalesce(Subquery(counts), 0)
+
+    drifted = 0
+    start = 0
+    last_id = Product.objects.order_by("-pk").values_list("pk", flat=True).first()
+    while last_id is not None and start <= last_id:
+        with transaction.atomic():
+            batch = (
+                Product.objects.filter(pk__gte=start, pk__lt=start + batch_size)
+                .annotate(actual=actual)
+                .exclude(selection_count=F("actual"))
+            )
+            if dry_run:
+                drifted += batch.count()
+            else:
+                drifted += batch.update(selection_count=actual)
+        start += batch_size
+
+    if drifted and not dry_run:
+        bump_catalog_version()
+    return drifted
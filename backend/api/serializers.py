@@ -1,5 +1,7 @@
 from rest_framework import serializers
+from .metrics import measure_serialization
 from .models import CustomUser, Product
+from .selection import MODES, TOGGLE
 
 
 class CustomUserSerializer(serializers.ModelSerializer):
@@ -25,27 +27,60 @@ class CustomUserSerializer(serializers.ModelSerializer):
         return user
 
 
+class TimedListSerializer(serializers.ListSerializer):
+    @property
+    def data(self):
+        with measure_serialization():
+            return super().data
+
+
 class ProductSerializer(serializers.ModelSerializer):
     is_selected = serializers.SerializerMethodField()
     selected_by_usernames = serializers.SerializerMethodField()
 
     class Meta:
         model = Product
+        list_serializer_class = TimedListSerializer
         fields = (
             "id",
             "name",
             "description",
             "price",
             "stock",
+            "selection_count",
             "is_selected",
             "selected_by_usernames",
         )
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Sparse fieldset picked by ProductViewSet from ?fields= / ?omit=
+        requested = self.context.get("fields")
+        if requested is not None:
+            for name in set(self.fields) - set(requested):
+                self.fields.pop(name)
+
+    @property
+    def data(self):
+        with measure_serialization():
+            return super().data
+
     def get_is_selected(self, obj):
+        # Annotated by ProductQuerySet.with_selection() on the list path
+        if hasattr(obj, "is_selected"):
+            return obj.is_selected
         request = self.context.get("request")
-        if request and request.user:
-            return request.user in obj.selected_by.all()
+        if request and request.user and request.user.pk is not None:
+            return obj.selected_by.filter(pk=request.user.pk).exists()
         return False
 
     def get_selected_by_usernames(self, obj):
+        # Served from the prefetch cache when with_selection() was applied
         return [user.username for user in obj.selected_by.all()]
+
+
+class ProductSelectionSerializer(serializers.Serializer):
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1), allow_empty=False, max_length=1000
+    )
+    action = serializers.ChoiceField(choices=MODES, default=TOGGLE)
@@ -0,0 +1,68 @@
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import Signal, receiver
+
+from .authentication import forget_user
+from .blacklist import revoked_tokens
+from .caching import bump_catalog_version
+from .events import publish_selection_change
+from .leaderboard import leaderboard
+from .models import CatalogVersion, CustomUser, Product
+from .suggest import suggest_index
+
+# Sent by api.selection after a selection change commits, with the ``user``
+# whose selection changed and the ``added`` / ``removed`` product ids.
+selection_changed = Signal()
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def product_changed(sender, **kwargs):
+    bump_catalog_version()
+
+
+@receiver(post_save, sender=Product)
+def product_saved(sender, instance, created, **kwargs):
+    product_id, name = instance.pk, instance.name
+    if created or getattr(instance, "_loaded_name", None) != name:
+        # Other processes rebuild their suggest index
+        bump_catalog_version(CatalogVersion.PRODUCT_NAMES)
+        instance._loaded_name = name
+    transaction.on_commit(lambda: suggest_index.update(product_id, name))
+
+
+@receiver(post_delete, sender=Product)
+def product_deleted(sender, instance, **kwargs):
+    bump_catalog_version(CatalogVersion.PRODUCT_NAMES)
+    leaderboard.discard(instance.pk)
+    # Deleting clears instance.pk once the signals are sent
+    product_id = instance.pk
+    transaction.on_commit(lambda: suggest_index.remove(product_id))
+
+
+@receiver(m2m_changed, sender=Product.selected_by.through)
+def selected_by_changed(sender, action, **kwargs):
+    # api.selection bumps the version itself; this covers the related managers
+    if action in ("post_add", "post_remove", "post_clear"):
+        bump_catalog_version()
+
+
+@receiver(post_save, sender=CustomUser)
+@receiver(post_delete, sender=CustomUser)
+def user_changed(sender, instance, **kwargs):
+    forget_user(instance.pk)
+
+
+@receiver(post_save, sender=CustomUser)
+def user_saved(sender, instance, **kwargs):
+    # ClaimsJWTAuthentication doesn't load the user to check is_active
+    if not instance.is_active:
+        revoked_tokens.revoke_user(instance.pk)
+
+
+@receiver(pre_delete, sender=CustomUser)
+def user_deleting(sender, instance, **kwargs):
+    revoked_tokens.revoke_user(instance.pk)
+
+
+selection_changed.connect(publish_selection_change)
@@ -0,0 +1,296 @@
+"""
+In-memory prefix index for search box completions.
+
+``suggest_index.suggest(query)`` returns, for a partially typed query:
+
+* terms: words of product names and of the ``PRODUCT_CATEGORIES``
+  vocabulary starting with the query's last word, most frequent first;
+* products: products whose name starts with the query, in name order.
+
+Names are kept sorted case-insensitively in one UTF-8 buffer with arrays of
+offsets and ids: the name's UTF-8 bytes plus 20 bytes per product, instead
+of the few hundred bytes a list of tuples of Python objects would take.
+They are searched with ``bisect``. The index is built by streaming the
+names from the database in that order straight into the buffer. Saves and
+deletes (see ``api.signals``) go to a small overlay, merged into the
+results, that shadows the products' entries in the buffer until the index
+is rebuilt.
+
+The index is built from the database at the first request. Writes that
+change product names (saves that rename, deletes, imports) bump the
+``PRODUCT_NAMES`` catalog version; each process checks it at most every
+``NAMES_CHECK_SECONDS`` and rebuilds in the background when it moved, which
+picks up changes made by other processes and bulk writes. It also rebuilds
+once the overlay holds ``SUGGEST_OVERLAY_LIMIT`` changes.
+"""
+
+import heapq
+import logging
+import threading
+import time
+from array import array
+from bisect import bisect_left, insort
+from collections import Counter
+from itertools import islice, takewhile
+
+from django.db import connection, connections
+from django.db.models.functions import Collate, Lower
+
+from .caching import get_catalog_version
+from .models import CatalogVersion, Product
+from .search import tokenize
+from .seeding import PRODUCT_CATEGORIES
+
+logger = logging.getLogger(__name__)
+
+SUGGEST_OVERLAY_LIMIT = 10000
+NAMES_CHECK_SECONDS = 1.0
+CATEGORY_WORDS = frozenset(tokenize(" ".join(PRODUCT_CATEGORIES)))
+
+
+class PackedNames:
+    """Names sorted by ``str.lower``, with their product ids, in flat arrays."""
+
+    def __init__(self, names=(), ids=()):
+        self.buffer = bytearray()
+        self.offsets = array("Q", [0])
+        self.ids = array("q")
+        for name, product_id in zip(names, ids):
+            self.append(name, product_id)
+        self.index()
+
+    def append(self, name, product_id):
+        """Add a name that sorts after the ones already added."""
+        self.buffer += name.encode()
+        self.offsets.append(len(self.buffer))
+        self.ids.append(product_id)
+
+    def index(self):
+        """Index the ids once every name was added."""
+        # Positions ordered by product id, to find a product's name
+        self.by_id = array("I", sorted(range(len(self.ids)), key=self.ids.__getitem__))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, position):
+        offsets = self.offsets
+        return self.buffer[offsets[position] : offsets[position + 1]].decode()
+
+    def name_of(self, product_id):
+        i = bisect_left(self.by_id, product_id, key=self.ids.__getitem__)
+        if i < len(self.by_id) and self.ids[self.by_id[i]] == product_id:
+            return self[self.by_id[i]]
+        return None
+
+    def starting_with(self, prefix):
+        """Yield ``(key, id, name)`` of the names starting with ``prefix``."""
+        position = bisect_left(self, prefix, key=str.lower)
+        while position < len(self):
+            name = self[position]
+            key = name.lower()
+            if not key.startswith(prefix):
+                return
+            yield key, self.ids[position], name
+            position += 1
+
+
+class SuggestIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._names = PackedNames()
+        self._words = []
+        self._word_counts = Counter()
+        # Product id -> current name (None once deleted) of changed products
+        self._changed = {}
+        # (key, id, name) of the changed products that exist
+        self._overlay = []
+        self._built_at = None
+        self._rebuilding = False
+        # PRODUCT_NAMES version read by the last rebuild, and when it was checked
+        self._names_version = None
+        self._checked_at = None
+        # Changes made while a rebuild reads the database, replayed after it
+        self._pending = None
+
+    def rebuild(self):
+        with self._lock:
+            self._pending = []
+        try:
+            version = get_catalog_version(CatalogVersion.PRODUCT_NAMES)
+            counts = Counter()
+            names = self._read_names(counts)
+        except BaseException:
+            with self._lock:
+                self._pending = None
+            raise
+        with self._lock:
+            self._names = names
+            self._word_counts = counts
+            self._words = sorted(counts.keys() | CATEGORY_WORDS)
+            self._changed = {}
+            self._overlay = []
+            self._built_at = self._checked_at = time.monotonic()
+            self._names_version = version
+            pending, self._pending = self._pending, None
+            for product_id, name in pending:
+                self._change(product_id, name)
+
+    def _read_names(self, counts):
+        """Stream the names into ``PackedNames``, counting their words."""
+        key = Lower("name")
+        if connection.vendor == "postgresql":
+            # Code point order, as str comparisons
+            key = Collate(key, "C")
+        rows = Product.objects.order_by(key, "pk").values_list("name", "pk")
+        names = PackedNames()
+        # Rows the database sorted differently from str.lower (e.g. SQLite
+        # only lowers ASCII letters)
+        stragglers = []
+        last = ""
+        for name, product_id in rows.iterator(chunk_size=2000):
+            counts.update(set(tokenize(name)))
+            lowered = name.lower()
+            if lowered >= last:
+                names.append(name, product_id)
+                last = lowered
+            else:
+                stragglers.append((lowered, product_id, name))
+        if stragglers:
+            stragglers.sort()
+            merged = PackedNames()
+            for _, product_id, name in heapq.merge(names.starting_with(""), stragglers):
+                merged.append(name, product_id)
+            names = merged
+        names.index()
+        return names
+
+    def _name_of(self, product_id):
+        if product_id in self._changed:
+            return self._changed[product_id]
+        return self._names.name_of(product_id)
+
+    def _count_words(self, name, delta):
+        words = self._words
+        for word in set(tokenize(name)):
+            self._word_counts[word] += delta
+            if delta > 0:
+                i = bisect_left(words, word)
+                if i == len(words) or words[i] != word:
+                    words.insert(i, word)
+
+    def _change(self, product_id, name):
+        # Called with the lock held
+        old = self._name_of(product_id)
+        if old == name:
+            return
+        if old is not None:
+            self._count_words(old, -1)
+            if product_id in self._changed:
+                entry = (old.lower(), product_id, old)
+                del self._overlay[bisect_left(self._overlay, entry)]
+        if name is not None:
+            self._count_words(name, 1)
+            insort(self._overlay, (name.lower(), product_id, name))
+        self._changed[product_id] = name
+
+    def update(self, product_id, name):
+        """Record that a product was saved with ``name`` (None: deleted)."""
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append((product_id, name))
+            if self._built_at is None:
+                return
+            self._change(product_id, name)
+            full = len(self._changed) >= SUGGEST_OVERLAY_LIMIT
+        if full:
+            self.rebuild_in_background()
+
+    def remove(self, product_id):
+        self.update(product_id, None)
+
+    def suggest(self, query, limit=10):
+        """``(terms, products)``: ``(word, count)`` and ``(id, name)`` lists."""
+        if self._built_at is None:
+            with self._build_lock:
+                if self._built_at is None:
+                    self.rebuild()
+        elif time.monotonic() - self._checked_at > NAMES_CHECK_SECONDS:
+            self._checked_at = time.monotonic()
+            version = get_catalog_version(CatalogVersion.PRODUCT_NAMES)
+            if version != self._names_version:
+                self.rebuild_in_background()
+
+        prefix = query.lower().lstrip()
+        if not prefix:
+            return [], []
+        words = tokenize(prefix)
+        # A trailing space starts a new word: no word to complete
+        word = words[-1] if words and prefix[-1].isalnum() else None
+
+        with self._lock:
+            terms = self._terms(word, limit) if word else []
+            products = self._products(prefix, limit)
+        return terms, products
+
+    def _terms(self, prefix, limit):
+        counts = self._word_counts
+        start = bisect_left(self._words, prefix)
+        matches = []
+        for word in islice(self._words, start, None):
+            if not word.startswith(prefix):
+                break
+            if counts[word] > 0 or word in CATEGORY_WORDS:
+                matches.append(word)
+        # nlargest keeps the alphabetical order of words with equal counts
+        return [
+            (word, counts[word])
+            for word in heapq.nlargest(limit, matches, key=counts.__getitem__)
+        ]
+
+    def _products(self, prefix, limit):
+        changed = self._changed
+        stored = (
+            match
+            for match in self._names.starting_with(prefix)
+            if match[1] not in changed
+        )
+        overlay = takewhile(
+            lambda match: match[0].startswith(prefix),
+            islice(self._overlay, bisect_left(self._overlay, (prefix,)), None),
+        )
+        return [
+            (product_id, name)
+            for _, product_id, name in islice(heapq.merge(stored, overlay), limit)
+        ]
+
+    def rebuild_in_background(self):
+        with self._lock:
+            if self._rebuilding:
+                return
+            self._rebuilding = True
+        threading.Thread(
+            target=self._rebuild, name="api-suggest-rebuild", daemon=True
+        ).start()
+
+    def _rebuild(self):
+        try:
+            self.rebuild()
+        except Exception:
+            logger.exception("Failed to rebuild the product suggest index")
+        finally:
+            connections.close_all()
+            self._rebuilding = False
+
+    def reset(self):
+        with self._lock:
+            self._built_at = None
+            self._names = PackedNames()
+            self._words = []
+            self._word_counts = Counter()
+            self._changed = {}
+            self._overlay = []
+
+
+suggest_index = SuggestIndex()
@@ -1 +1,1898 @@
-# Create your tests here.
+import asyncio
+import gzip
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timedelta
+from datetime import timezone as dt_timezone
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import skipIf
+from unittest.mock import patch
+
+from asgiref.sync import sync_to_async
+from core.database import apply_profile
+from core.log_handlers import JSONFormatter, QueueingHandler
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import AsyncClient, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils.translation import gettext_lazy
+from rest_framework.exceptions import ErrorDetail, ParseError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.token_blacklist.models import (
+    BlacklistedToken,
+    OutstandingToken,
+)
+from rest_framework_simplejwt.tokens import AccessToken
+from rest_framework_simplejwt.utils import aware_utcnow
+
+from . import selection
+from .admission import TIMEOUT, QUEUE_FULL, Gate, TokenBuckets, gates
+from .authentication import ClaimsUser, user_cache
+from .benchmarks.baseline import compare
+from .benchmarks.workload import access_token
+from .benchmarks.runner import summarize
+from .blacklist import BloomFilter, RevokedTokens, revoked_tokens
+from .caching import bump_catalog_version, get_catalog_version, response_cache
+from .compression import brotli, negotiate
+from .export import CSVRenderer, NDJSONRenderer
+from .events import SQLiteLogBackend, broker, selection_events
+from .leaderboard import leaderboard
+from .metrics import PROCESS_ID, metrics_files
+from .models import CatalogVersion, CustomUser, Product
+from .renderers import ORJSONParser, ORJSONRenderer
+from .routers import (
+    ReplicaRouter,
+    ReplicaRoutingMiddleware,
+    is_pinned,
+    pin_cache,
+    read_from_replicas,
+)
+from .suggest import PackedNames, suggest_index
+from .selection import (
+    SET,
+    TOGGLE,
+    apply_selection,
+    clear_selection,
+    recount_selection_counts,
+    toggle_selection,
+)
+
+
+def create_products(count, start=0):
+    products = Product.objects.bulk_create(
+        Product(
+            name=f"product {i}",
+            description=f"description {i}",
+            price="9.99",
+            stock=i,
+        )
+        for i in range(start, start + count)
+    )
+    # bulk_create bypasses the signals that version product responses
+    with TestCase.captureOnCommitCallbacks(execute=True):
+        bump_catalog_version()
+    return products
+
+
+class APITestCase(TestCase):
+    def setUp(self):
+        super().setUp()
+        # Rolled-back ids and versions repeat between tests; so would cache keys
+        response_cache.clear()
+        revoked_tokens.reset()
+
+
+class ProductListQueryBudgetTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = CustomUser.objects.create(username="alice")
+        self.others = [CustomUser.objects.create(username=f"user{i}") for i in range(3)]
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def count_list_queries(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get("/api/products/")
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries), response
+
+    def test_query_count_is_constant_in_catalog_size(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            for product in create_products(5):
+                product.selected_by.add(*self.others)
+        small, _ = self.count_list_queries()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            for product in create_products(50, start=5):
+                product.selected_by.add(self.user, *self.others)
+        large, response = self.count_list_queries()
+
+        self.assertEqual(small, large)
+        # Catalog version, products (with is_selected) and the selectors
+        self.assertLessEqual(large, 3)
+        self.assertEqual(len(response.data["results"]), 50)
+
+    def test_is_selected_and_usernames(self):
+        first, second = create_products(2)
+        first.selected_by.add(self.user, self.others[0])
+        second.selected_by.add(self.others[1])
+
+        _, response = self.count_list_queries()
+        by_id = {item["id"]: item for item in response.data["results"]}
+
+        self.assertTrue(by_id[first.id]["is_selected"])
+        self.assertEqual(by_id[first.id]["selected_by_usernames"], ["alice", "user0"])
+        self.assertFalse(by_id[second.id]["is_selected"])
+        self.assertEqual(by_id[second.id]["selected_by_usernames"], ["user1"])
+
+    def test_selector_prefetch_only_reads_username(self):
+        create_products(1)[0].selected_by.add(self.user)
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get("/api/products/")
+        prefetch_sql = ctx.captured_queries[-1]["sql"]
+        self.assertIn('"api_user"."username"', prefetch_sql)
+        self.assertNotIn('"api_user"."password"', prefetch_sql)
+
+    def test_select_returns_fresh_selection_state(self):
+        product = create_products(1)[0]
+
+        response = self.client.post(f"/api/products/{product.id}/select/")
+        self.assertTrue(response.data["is_selected"])
+        self.assertEqual(response.data["selected_by_usernames"], ["alice"])
+
+        response = self.client.post(f"/api/products/{product.id}/select/")
+        self.assertFalse(response.data["is_selected"])
+        self.assertEqual(response.data["selected_by_usernames"], [])
+
+
+class SparseFieldsetTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = CustomUser.objects.create(username="alice")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.products = create_products(3)
+        self.products[0].selected_by.add(self.user)
+
+    def get(self, url, **params):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url, params)
+        product_sql = [
+            query["sql"]
+            for query in ctx.captured_queries
+            if '"api_product"' in query["sql"]
+        ]
+        return response, product_sql
+
+    def test_fields_trim_output_and_queries(self):
+        response, product_sql = self.get("/api/products/", fields="id,name")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.data["results"][0],
+            {"id": self.products[0].id, "name": "product 0"},
+        )
+        # One product query, without the description or the selection joins
+        self.assertEqual(len(product_sql), 1)
+        self.assertNotIn("description", product_sql[0])
+        self.assertNotIn("api_product_selected_by", product_sql[0])
+
+    def test_omit(self):
+        response, product_sql = self.get(
+            "/api/products/", omit="selected_by_usernames, description"
+        )
+        self.assertEqual(
+            set(response.data["results"][0]),
+            {"id", "name", "price", "stock", "selection_count", "is_selected"},
+        )
+        self.assertTrue(response.data["results"][0]["is_selected"])
+        self.assertEqual(len(product_sql), 1)
+        self.assertNotIn("description", product_sql[0])
+
+    def test_ordering_field_is_loaded_for_the_next_link(self):
+        response, product_sql = self.get(
+            "/api/products/", fields="name", ordering="-stock", page_size=2
+        )
+        self.assertEqual(
+            response.data["results"], [{"name": "product 2"}, {"name": "product 1"}]
+        )
+        self.assertIsNotNone(response.data["next"])
+        self.assertEqual(len(product_sql), 1)
+
+        response = self.client.get(response.data["next"])
+        self.assertEqual(response.data["results"], [{"name": "product 0"}])
+
+    def test_retrieve(self):
+        response, _ = self.get(
+            f"/api/products/{self.products[0].id}/", fields="is_selected,price"
+        )
+        self.assertEqual(response.data, {"price": "9.99", "is_selected": True})
+
+    def test_unknown_field(self):
+        response, _ = self.get("/api/products/", fields="id,secret")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("secret", response.data["fields"])
+
+
+class ProductSearchTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(CustomUser.objects.create(username="alice"))
+        self.lamp = Product.objects.create(
+            name="Desk lamp", description="Bright light", price="19.99"
+        )
+        self.kettle = Product.objects.create(
+            name="Kettle", description="Boils water, lamp not included", price="29.99"
+        )
+
+    def search(self, query):
+        response = self.client.get("/api/products/", {"search": query})
+        self.assertEqual(response.status_code, 200)
+        return [item["id"] for item in response.data["results"]]
+
+    def test_prefix_match_ranks_name_hits_first(self):
+        self.assertEqual(self.search("lam"), [self.lamp.id, self.kettle.id])
+        self.assertEqual(self.search("desk bri"), [self.lamp.id])
+        self.assertEqual(self.search("toaster"), [])
+
+    def test_query_syntax_is_escaped(self):
+        self.assertEqual(self.search('kettle" (*'), [self.kettle.id])
+
+    def test_index_follows_writes_and_bulk_operations(self):
+        self.kettle.name = "Toaster"
+        with self.captureOnCommitCallbacks(execute=True):
+            self.kettle.save()
+        self.assertEqual(self.search("toaster"), [self.kettle.id])
+
+        Product.objects.filter(pk=self.lamp.pk).update(name="Floor light")
+        self.assertEqual(self.search("floor"), [self.lamp.id])
+        self.assertEqual(self.search("desk"), [])
+
+        (bulk,) = create_products(1)
+        self.assertEqual(self.search("product"), [bulk.id])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.kettle.delete()
+        self.assertEqual(self.search("toaster"), [])
+
+    def test_rebuild_command(self):
+        call_command("rebuild_search_index", stdout=StringIO())
+        self.assertEqual(self.search("kettle"), [self.kettle.id])
+
+
+class ProductPaginationTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(CustomUser.objects.create(username="alice"))
+        # Duplicate prices and stock values exercise the id tie-breaker
+        Product.objects.bulk_create(
+            Product(
+                name=f"product {i:02d}",
+                description="",
+                price=f"{i % 4}.50",
+                stock=i % 3,
+            )
+            for i in range(23)
+        )
+
+    def collect(self, **params):
+        pages, rows = [], []
+        response = self.client.get("/api/products/", {"page_size": 5, **params})
+        while True:
+            self.assertEqual(response.status_code, 200)
+            pages.append(response.data["results"])
+            rows.extend(response.data["results"])
+            if not response.data["next"]:
+                return pages, rows
+            response = self.client.get(response.data["next"])
+
+    def test_pages_cover_every_row_once_in_order(self):
+        for ordering, key in [
+            ("id", lambda row: row["id"]),
+            ("-price", lambda row: (-float(row["price"]), -row["id"])),
+            ("stock", lambda row: (row["stock"], row["id"])),
+            ("name", lambda row: (row["name"], row["id"])),
+        ]:
+            with self.subTest(ordering=ordering):
+                pages, rows = self.collect(ordering=ordering)
+                self.assertEqual([len(page) for page in pages], [5, 5, 5, 5, 3])
+                self.assertEqual(rows, sorted(rows, key=key))
+                self.assertEqual(len({row["id"] for row in rows}), 23)
+
+    def test_later_pages_do_not_offset_or_count(self):
+        first = self.client.get("/api/products/", {"page_size": 5})
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(first.data["next"])
+        sql = " ".join(query["sql"] for query in ctx.captured_queries).upper()
+        self.assertNotIn("OFFSET", sql)
+        self.assertNotIn("COUNT(", sql)
+
+    def test_invalid_parameters(self):
+        response = self.client.get("/api/products/", {"cursor": "garbage"})
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get("/api/products/", {"ordering": "description"})
+        self.assertEqual(response.status_code, 400)
+        # A cursor is only valid for the ordering that produced it
+        first = self.client.get("/api/products/", {"page_size": 5})
+        cursor = first.data["next"].split("cursor=")[1]
+        response = self.client.get(
+            "/api/products/", {"cursor": cursor, "ordering": "name"}
+        )
+        self.assertEqual(response.status_code, 404)
+
+
+class ProductSelectionTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = CustomUser.objects.create(username="alice")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.products = create_products(4)
+        self.ids = [product.id for product in self.products]
+
+    def selected_ids(self):
+        return sorted(self.user.selected_products.values_list("pk", flat=True))
+
+    def bulk(self, ids, action):
+        return self.client.post(
+            "/api/products/select/", {"ids": ids, "action": action}, format="json"
+        )
+
+    def test_bulk_set_unset_toggle(self):
+        response = self.bulk(self.ids[:2], "set")
+        self.assertEqual(response.data["added"], self.ids[:2])
+        self.assertEqual(self.selected_ids(), self.ids[:2])
+
+        response = self.bulk(self.ids[1:3], "toggle")
+        self.assertEqual(response.data["added"], [self.ids[2]])
+        self.assertEqual(response.data["removed"], [self.ids[1]])
+        self.assertEqual(response.data["selected"], [self.ids[2]])
+        self.assertEqual(self.selected_ids(), [self.ids[0], self.ids[2]])
+
+        response = self.bulk(self.ids, "unset")
+        self.assertEqual(response.data["removed"], [self.ids[0], self.ids[2]])
+        self.assertEqual(self.selected_ids(), [])
+
+    def test_bulk_select_is_all_or_nothing(self):
+        response = self.bulk([self.ids[0], 999999], "set")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data["ids"], [999999])
+        self.assertEqual(self.selected_ids(), [])
+
+    def test_bulk_select_query_count_does_not_grow_with_ids(self):
+        with CaptureQueriesContext(connection) as small:
+            self.bulk(self.ids[:1], "set")
+        self.bulk(self.ids, "unset")
+        with CaptureQueriesContext(connection) as large:
+            self.bulk(self.ids, "set")
+        self.assertEqual(len(small.captured_queries), len(large.captured_queries))
+
+    def test_toggle_does_not_load_selectors(self):
+        product = self.products[0]
+        product.selected_by.add(CustomUser.objects.create(username="bob"))
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.post(f"/api/products/{product.id}/select/")
+        writes = [q["sql"] for q in ctx.captured_queries if "api_user" in q["sql"]]
+        # Only the response's batched username prefetch touches the user table
+        self.assertEqual(len(writes), 1)
+        self.assertEqual(self.selected_ids(), [product.id])
+
+    def test_toggle_unknown_product(self):
+        response = self.client.post("/api/products/999999/select/")
+        self.assertEqual(response.status_code, 404)
+
+
+class LoginTests(APITestCase):
+    def test_login_reuses_the_user_with_the_normalized_name(self):
+        first = self.client.post("/api/login/", {"username": "ﬁona"}).data
+        second = self.client.post("/api/login/", {"username": "fiona"}).data
+        self.assertEqual(first["id"], second["id"])
+        self.assertEqual(CustomUser.objects.count(), 1)
+        self.assertEqual(CustomUser.objects.get().username_key, "fiona")
+
+    def test_lookup_is_indexed_and_creates_without_a_transaction(self):
+        with CaptureQueriesContext(connection) as ctx:
+            user = CustomUser.objects.get_or_create_for_login("alice")
+        statements = [query["sql"].split()[0] for query in ctx.captured_queries]
+        self.assertEqual(statements, ["SELECT", "INSERT", "SELECT"])
+        self.assertIn('"username_key" = ', ctx.captured_queries[0]["sql"])
+
+        with self.assertNumQueries(1):
+            self.assertEqual(CustomUser.objects.get_or_create_for_login("alice"), user)
+
+    def test_seeded_users_log_in_without_duplicates(self):
+        call_command(
+            "seed_products", count=3, users=2, selections_per_user=1, stdout=StringIO()
+        )
+        seeded = CustomUser.objects.get(username="seed-user-0")
+        response = self.client.post("/api/login/", {"username": "seed-user-0"})
+        self.assertEqual(response.data["id"], seeded.pk)
+        self.assertEqual(CustomUser.objects.filter(username="seed-user-0").count(), 1)
+
+    def test_clearing_nothing_skips_the_transaction(self):
+        user = CustomUser.objects.create(username="alice")
+        with self.assertNumQueries(1):
+            self.assertEqual(clear_selection(user), [])
+
+
+class SelectionCountTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.alice = CustomUser.objects.create(username="alice")
+        self.bob = CustomUser.objects.create(username="bob")
+        self.products = create_products(3)
+        self.ids = [product.id for product in self.products]
+
+    def counts(self):
+        return list(
+            Product.objects.order_by("pk").values_list("selection_count", flat=True)
+        )
+
+    def test_selection_writes_maintain_counts(self):
+        toggle_selection(self.alice, self.ids[0])
+        apply_selection(self.bob, self.ids, SET)
+        self.assertEqual(self.counts(), [2, 1, 1])
+
+        apply_selection(self.bob, self.ids[:2], TOGGLE)
+        self.assertEqual(self.counts(), [1, 0, 1])
+
+        clear_selection(self.bob)
+        toggle_selection(self.alice, self.ids[1])
+        self.assertEqual(self.counts(), [1, 1, 0])
+
+        toggle_selection(self.alice, self.ids[0])
+        clear_selection(self.alice)
+        self.assertEqual(self.counts(), [0, 0, 0])
+
+    def racing_insert(self, user, product_id):
+        """Patch the insert so another request selects ``product_id`` first."""
+        insert = selection._insert
+
+        def insert_after_concurrent_select(*args):
+            selection.Selection.objects.create(
+                product_id=product_id, customuser_id=user.pk
+            )
+            Product.objects.filter(pk=product_id).update(selection_count=1)
+            return insert(*args)
+
+        return patch.object(
+            selection, "_insert", side_effect=insert_after_concurrent_select
+        )
+
+    def test_toggle_counts_only_the_row_it_inserted(self):
+        with self.racing_insert(self.alice, self.ids[0]):
+            self.assertTrue(toggle_selection(self.alice, self.ids[0]))
+        self.assertEqual(self.counts(), [1, 0, 0])
+        self.assertFalse(toggle_selection(self.alice, self.ids[0]))
+        self.assertEqual(self.counts(), [0, 0, 0])
+
+    def test_bulk_select_counts_only_the_rows_it_inserted(self):
+        with self.racing_insert(self.alice, self.ids[0]):
+            added, _ = apply_selection(self.alice, self.ids[:2], SET)
+        self.assertEqual(added, [self.ids[1]])
+        self.assertEqual(self.counts(), [1, 1, 0])
+        self.assertEqual(sorted(clear_selection(self.alice)), self.ids[:2])
+        self.assertEqual(self.counts(), [0, 0, 0])
+
+    def test_login_and_logout_clear_counts(self):
+        apply_selection(self.alice, self.ids, SET)
+        self.client.post("/api/login/", {"username": "alice"})
+        self.assertEqual(self.counts(), [0, 0, 0])
+
+    def test_reconcile_repairs_drift(self):
+        # Related managers bypass api.selection and leave the counters stale
+        self.products[0].selected_by.add(self.alice, self.bob)
+        self.products[2].selected_by.add(self.bob)
+        Product.objects.filter(pk=self.ids[1]).update(selection_count=5)
+
+        self.assertEqual(recount_selection_counts(batch_size=2, dry_run=True), 3)
+        call_command("reconcile_selection_counts", batch_size=2, stdout=StringIO())
+        self.assertEqual(self.counts(), [2, 0, 1])
+        self.assertEqual(recount_selection_counts(), 0)
+
+    def test_list_orders_by_selection_count(self):
+        apply_selection(self.alice, self.ids[1:], SET)
+        apply_selection(self.bob, self.ids[2:], SET)
+        client = APIClient()
+        client.force_authenticate(self.alice)
+        response = client.get("/api/products/", {"ordering": "-selection_count"})
+        results = response.data["results"]
+        self.assertEqual([row["id"] for row in results], self.ids[::-1])
+        self.assertEqual([row["selection_count"] for row in results], [2, 1, 0])
+
+
+class ConditionalReadTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = CustomUser.objects.create(username="alice")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.product = create_products(1)[0]
+
+    def get(self, url="/api/products/", **headers):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url, headers=headers)
+        return response, len(ctx.captured_queries)
+
+    def test_if_none_match_skips_serialization(self):
+        response, _ = self.get()
+        etag = response["ETag"]
+
+        response, queries = self.get(**{"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+        self.assertEqual(queries, 1)
+
+    def test_repeated_reads_are_served_from_cache(self):
+        first, _ = self.get()
+        second, queries = self.get()
+        self.assertEqual(queries, 1)
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second["ETag"], first["ETag"])
+
+    def test_writes_change_the_etag(self):
+        etag = self.get()[0]["ETag"]
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f"/api/products/{self.product.id}/select/")
+        response, _ = self.get(**{"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()["results"][0]["is_selected"])
+
+        etag = response["ETag"]
+        self.product.name = "renamed"
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.save()
+        response, _ = self.get(**{"If-None-Match": etag})
+        self.assertEqual(response.json()["results"][0]["name"], "renamed")
+
+    def test_version_is_bumped_once_the_write_commits(self):
+        version = get_catalog_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            toggle_selection(self.user, self.product.id)
+            # The version row isn't locked for the rest of the transaction
+            self.assertEqual(get_catalog_version(), version)
+        self.assertEqual(get_catalog_version(), version + 1)
+
+    def test_etags_are_per_user_and_url(self):
+        etag = self.get()[0]["ETag"]
+        self.assertNotEqual(self.get("/api/products/?ordering=name")[0]["ETag"], etag)
+
+        self.client.force_authenticate(CustomUser.objects.create(username="bob"))
+        response, _ = self.get(**{"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+
+    def test_cache_is_bounded(self):
+        for i in range(response_cache.maxsize + 10):
+            self.get(f"/api/products/?page_size={i + 1}")
+        self.assertEqual(len(response_cache), response_cache.maxsize)
+
+
+class CompressionTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = CustomUser.objects.create(username="alice")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        create_products(30)
+
+    def get(self, url="/api/products/", **headers):
+        return self.client.get(url, headers=headers)
+
+    def test_negotiation(self):
+        preferred = "br" if brotli is not None else "gzip"
+        for header, encoding in (
+            ("", None),
+            ("identity", None),
+            ("gzip", "gzip"),
+            ("gzip, deflate, br", preferred),
+            ("br;q=0.5, gzip", "gzip"),
+            ("gzip;q=0, *", "br" if brotli is not None else None),
+            ("*;q=0", None),
+            ("GZIP; Q=0.8", "gzip"),
+        ):
+            with self.subTest(header=header):
+                self.assertEqual(negotiate(header), encoding)
+
+    def test_product_list_is_compressed(self):
+        plain = self.get()
+        self.assertFalse(plain.has_header("Content-Encoding"))
+
+        response_cache.clear()
+        response = self.get(**{"Accept-Encoding": "gzip"})
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(int(response["Content-Length"]), len(response.content))
+        self.assertLess(len(response.content), len(plain.content))
+        self.assertEqual(gzip.decompress(response.content), plain.content)
+        self.assertEqual(response["ETag"], plain["ETag"][:-1] + '-gzip"')
+        self.assertIn("Accept-Encoding", response["Vary"])
+
+    @skipIf(brotli is None, "brotli is not installed")
+    def test_brotli(self):
+        plain = self.get()
+        response = self.get(**{"Accept-Encoding": "gzip, br"})
+        self.assertEqual(response["Content-Encoding"], "br")
+        self.assertEqual(brotli.decompress(response.content), plain.content)
+
+    def test_cached_reads_are_not_compressed_again(self):
+        first = self.get(**{"Accept-Encoding": "gzip"})
+        with patch("api.caching.compress") as compress:
+            second = self.get(**{"Accept-Encoding": "gzip"})
+        compress.assert_not_called()
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second["ETag"], first["ETag"])
+
+        # Another encoding of the same entry is compressed once
+        plain = self.get()
+        self.assertEqual(len(plain.content), len(gzip.decompress(first.content)))
+
+    def test_encoded_etags_revalidate(self):
+        etag = self.get(**{"Accept-Encoding": "gzip"})["ETag"]
+        response = self.get(**{"Accept-Encoding": "gzip", "If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            bump_catalog_version()
+        response = self.get(**{"Accept-Encoding": "gzip", "If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(API_COMPRESSION_MIN_BYTES=1024 * 1024)
+    def test_small_responses_are_not_compressed(self):
+        response = self.get(**{"Accept-Encoding": "gzip"})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header("Content-Encoding"))
+
+    def test_export_is_compressed_while_streaming(self):
+        plain = b"".join(self.get("/api/products/export/").streaming_content)
+        response = self.get("/api/products/export/", **{"Accept-Encoding": "gzip"})
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(b"".join(response.streaming_content)), plain)
+
+
+class ClaimsAuthenticationTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        user_cache.clear()
+        self.addCleanup(user_cache.clear)
+        create_products(2)
+        response = self.client.post("/api/login/", {"username": "alice"})
+        self.user = CustomUser.objects.get(pk=response.data["id"])
+        self.client.defaults["HTTP_AUTHORIZATION"] = f"Bearer {response.data['token']}"
+
+    def test_reads_do_not_load_the_user(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get("/api/products/")
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(
+            [
+                q
+                for q in ctx.captured_queries
+                if q["sql"].startswith('SELECT "api_user"')
+            ]
+        )
+
+    def test_other_attributes_hydrate_through_the_cache(self):
+        token = AccessToken.for_user(self.user)
+        token["username"] = "alice"
+        user = ClaimsUser(token)
+        self.assertEqual((user.pk, user.username), (self.user.pk, "alice"))
+        with self.assertNumQueries(1):
+            self.assertEqual(user.date_joined, self.user.date_joined)
+            self.assertEqual(ClaimsUser(token).email, self.user.email)
+        self.assertEqual(user, self.user)
+
+        self.user.email = "alice@example.com"
+        self.user.save()
+        with self.assertNumQueries(1):
+            self.assertEqual(ClaimsUser(token).email, "alice@example.com")
+
+    def test_deactivated_and_deleted_users_are_rejected(self):
+        # Logins don't write to the blacklist tables
+        self.assertFalse(OutstandingToken.objects.exists())
+        self.assertEqual(self.client.get("/api/products/").status_code, 200)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get("/api/products/").status_code, 401)
+
+        client = APIClient()
+        response = client.post("/api/login/", {"username": "bob"})
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {response.data['token']}")
+        self.assertEqual(client.get("/api/products/").status_code, 200)
+        CustomUser.objects.get(pk=response.data["id"]).delete()
+        self.assertEqual(client.get("/api/products/").status_code, 401)
+
+    def test_reactivated_users_log_in_again(self):
+        # Deactivated two seconds ago: iat is in whole seconds
+        earlier = aware_utcnow() - timedelta(seconds=2)
+        with patch("api.blacklist.aware_utcnow", return_value=earlier):
+            self.user.is_active = False
+            self.user.save()
+        self.user.is_active = True
+        self.user.save()
+        token = AccessToken.for_user(self.user)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {token}")
+        self.assertEqual(client.get("/api/products/").status_code, 200)
+
+    def test_logout_forgets_the_user(self):
+        ClaimsUser(AccessToken.for_user(self.user)).email
+        self.assertEqual(len(user_cache), 1)
+        self.assertEqual(self.client.post("/api/logout/").status_code, 200)
+        self.assertEqual(len(user_cache), 0)
+
+
+class TokenBlacklistTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = CustomUser.objects.create(username="alice")
+
+    def token(self, **lifetime):
+        token = AccessToken.for_user(self.user)
+        if lifetime:
+            token.set_exp(lifetime=timedelta(**lifetime))
+        return token
+
+    def test_logout_revokes_the_access_token(self):
+        token = self.client.post("/api/login/", {"username": "bob"}).data["token"]
+        self.client.defaults["HTTP_AUTHORIZATION"] = f"Bearer {token}"
+        self.assertEqual(self.client.get("/api/products/").status_code, 200)
+        self.assertEqual(self.client.post("/api/logout/").status_code, 200)
+        self.assertEqual(self.client.get("/api/products/").status_code, 401)
+
+    def test_unrevoked_tokens_are_checked_without_queries(self):
+        revoked = RevokedTokens(refresh_seconds=60)
+        revoked.revoke(self.token(), self.user.pk)
+        revoked.refresh(force=True)
+        with self.assertNumQueries(0):
+            for _ in range(100):
+                self.assertFalse(revoked.is_revoked(self.token()["jti"]))
+
+    def test_revocations_by_other_processes_are_picked_up(self):
+        worker, other = RevokedTokens(capacity=4), RevokedTokens(capacity=4)
+        tokens = [self.token() for _ in range(10)]
+        other.refresh(force=True)
+        for token in tokens:
+            worker.revoke(token, self.user.pk)
+
+        other.refresh(force=True)
+        self.assertTrue(all(other.is_revoked(token["jti"]) for token in tokens))
+        # The filter outgrew its capacity and was rebuilt larger
+        self.assertGreaterEqual(other.filter.capacity, 10)
+
+    def test_rows_committed_out_of_id_order_are_picked_up(self):
+        def blacklist(token, pk):
+            outstanding = OutstandingToken.objects.create(
+                jti=token["jti"],
+                token=str(token),
+                user=self.user,
+                expires_at=datetime.fromtimestamp(token["exp"], tz=dt_timezone.utc),
+            )
+            BlacklistedToken.objects.create(pk=pk, token=outstanding)
+
+        revoked = RevokedTokens()
+        early, late = self.token(), self.token()
+        blacklist(early, 10)
+        revoked.refresh(force=True)
+        revoked.refresh(force=True)
+        # A transaction that got a lower id commits after the refreshes
+        blacklist(late, 5)
+
+        revoked.refresh(force=True)
+        self.assertTrue(revoked.is_revoked(late["jti"]))
+        self.assertEqual(revoked.filter.count, 2)
+
+    def test_own_revocations_are_counted_once(self):
+        revoked = RevokedTokens()
+        revoked.refresh(force=True)
+        token = self.token()
+        revoked.revoke(token, self.user.pk)
+        revoked.revoke(token, self.user.pk)
+        revoked.refresh(force=True)
+        self.assertEqual(revoked.filter.count, 1)
+        self.assertTrue(revoked.is_revoked(token["jti"]))
+
+    def test_bloom_filter_false_positive_rate(self):
+        bloom = BloomFilter(1000, error_rate=0.01)
+        for i in range(1000):
+            bloom.add(f"member-{i}")
+        self.assertTrue(all(f"member-{i}" in bloom for i in range(1000)))
+        false_positives = sum(f"other-{i}" in bloom for i in range(10000))
+        self.assertLess(false_positives, 200)
+
+    def test_prune_deletes_only_expired_tokens(self):
+        for token in [self.token(seconds=-1) for _ in range(5)] + [self.token()]:
+            revoked_tokens.revoke(token, self.user.pk)
+
+        call_command("prune_tokens", batch_size=2, stdout=StringIO())
+        self.assertEqual(OutstandingToken.objects.count(), 1)
+        self.assertEqual(BlacklistedToken.objects.count(), 1)
+
+
+@override_settings(DATABASE_REPLICAS=["replica1"], DATABASE_PIN_CACHE="default")
+class ReplicaRoutingTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        pin_cache().clear()
+        self.user = CustomUser.objects.create(username="alice")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.product = create_products(1)[0]
+        # Replica reads are served by the test database
+        patcher = patch.object(ReplicaRouter, "choose_replica", return_value="default")
+        self.choose_replica = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def reads_from_replica(self, client, path):
+        self.choose_replica.reset_mock()
+        response = client.get(path)
+        self.assertEqual(response.status_code, 200)
+        return self.choose_replica.called
+
+    def test_reads_use_replicas_until_the_user_writes(self):
+        self.assertTrue(self.reads_from_replica(self.client, "/api/products/"))
+        self.assertTrue(
+            self.reads_from_replica(self.client, f"/api/products/{self.product.id}/")
+        )
+
+        self.choose_replica.reset_mock()
+        response = self.client.post(f"/api/products/{self.product.id}/select/")
+        self.assertTrue(response.data["is_selected"])
+        self.assertFalse(self.choose_replica.called)
+
+        self.assertTrue(is_pinned(self.user.pk))
+        self.assertFalse(self.reads_from_replica(self.client, "/api/products/"))
+        other = APIClient()
+        other.force_authenticate(CustomUser.objects.create(username="bob"))
+        self.assertTrue(self.reads_from_replica(other, "/api/products/"))
+
+    def test_login_pins_the_user(self):
+        response = APIClient().post("/api/login/", {"username": "alice"}, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(is_pinned(self.user.pk))
+
+    @override_settings(DATABASE_REPLICAS=["replica1", "replica2"])
+    def test_a_request_reads_from_one_replica(self):
+        # The version lookup, the page and the prefetch share one replica
+        self.assertTrue(self.reads_from_replica(self.client, "/api/products/"))
+        self.assertEqual(self.choose_replica.call_count, 1)
+
+        router = ReplicaRouter()
+
+        def view(request):
+            read_from_replicas(None)
+            return {router.db_for_read(Product) for _ in range(10)}
+
+        self.choose_replica.side_effect = ["replica1", "replica2"]
+        self.assertEqual(ReplicaRoutingMiddleware(view)(None), {"replica1"})
+
+    def test_writes_and_unrouted_reads_use_the_primary(self):
+        router = ReplicaRouter()
+        self.assertEqual(router.db_for_read(Product), "default")
+        self.assertEqual(router.db_for_write(Product), "default")
+        self.assertFalse(router.allow_migrate("replica1", "api"))
+        self.assertTrue(router.allow_migrate("default", "api"))
+
+
+class SelectionEventTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = CustomUser.objects.create(username="alice")
+        self.products = create_products(2)
+        self.events = []
+        self.addCleanup(broker.subscribe(self.events.append))
+
+    def test_committed_changes_are_published(self):
+        ids = [product.id for product in self.products]
+        with self.captureOnCommitCallbacks(execute=True):
+            toggle_selection(self.user, ids[0])
+        with self.captureOnCommitCallbacks(execute=True):
+            apply_selection(self.user, ids, TOGGLE)
+        with self.captureOnCommitCallbacks(execute=True):
+            clear_selection(self.user)
+
+        self.assertEqual(
+            self.events,
+            [
+                {"username": "alice", "added": [ids[0]], "removed": []},
+                {"username": "alice", "added": [ids[1]], "removed": [ids[0]]},
+                {"username": "alice", "added": [], "removed": [ids[1]]},
+            ],
+        )
+
+    def test_large_deltas_are_split(self):
+        events = list(selection_events("alice", list(range(1200)), [1]))
+        self.assertEqual([len(event["added"]) for event in events], [500, 500, 200])
+        self.assertEqual([event["removed"] for event in events], [[1], [], []])
+
+    def test_sqlite_log_reaches_other_processes(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, "events.sqlite3")
+        received = []
+        listener = SQLiteLogBackend(received.append, path)
+        publisher = SQLiteLogBackend(lambda event: None, path)
+        event = {"username": "bob", "added": [1], "removed": []}
+
+        last_id = listener.receive()
+        with patch("api.events.os.getpid", return_value=0):
+            publisher.publish(event)
+        # Written by a thread of its own
+        publisher.flush()
+        last_id = listener.receive(last_id)
+        self.assertEqual(received, [event])
+
+        # Its own events are delivered when published, and only then
+        listener.publish(event)
+        self.assertEqual(received, [event, event])
+        listener.flush()
+        self.assertEqual(listener.receive(last_id), last_id + 1)
+        self.assertEqual(received, [event, event])
+
+    def test_stream_requires_asgi(self):
+        self.assertEqual(self.client.get("/api/products/events/").status_code, 501)
+
+
+class LeaderboardTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        leaderboard.stop()
+        self.addCleanup(leaderboard.stop)
+        self.users = [
+            CustomUser.objects.create(username=name) for name in ("alice", "bob")
+        ]
+        self.client = APIClient()
+        self.client.force_authenticate(self.users[0])
+        self.ids = [product.id for product in create_products(4)]
+
+    def select(self, user, ids, mode=SET):
+        with self.captureOnCommitCallbacks(execute=True):
+            apply_selection(user, ids, mode)
+
+    def top(self, **params):
+        response = self.client.get("/api/products/top/", params)
+        self.assertEqual(response.status_code, 200)
+        return [(row["id"], row["selection_count"]) for row in response.data["results"]]
+
+    def test_loads_the_ranking_from_the_database(self):
+        ids = self.ids
+        self.select(self.users[0], ids[1:3])
+        self.select(self.users[1], [ids[2]])
+        self.assertEqual(self.top(), [(ids[2], 2), (ids[1], 1)])
+        self.assertEqual(self.top(limit=1), [(ids[2], 2)])
+
+    def test_follows_selection_changes_without_queries(self):
+        ids = self.ids
+        self.assertEqual(self.top(), [])
+
+        self.select(self.users[0], ids[:2])
+        self.select(self.users[1], [ids[3], ids[1]])
+        with self.captureOnCommitCallbacks(execute=True):
+            toggle_selection(self.users[0], ids[0])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.top(), [(ids[1], 2), (ids[3], 1)])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            clear_selection(self.users[1])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.top(), [(ids[1], 1)])
+
+        Product.objects.get(pk=ids[1]).delete()
+        self.assertEqual(self.top(), [])
+
+    def test_limit_is_validated(self):
+        for limit in ("0", "101", "x", ""):
+            with self.subTest(limit=limit):
+                response = self.client.get("/api/products/top/", {"limit": limit})
+                self.assertEqual(response.status_code, 400)
+
+    def test_events_during_a_rebuild_are_replayed(self):
+        self.top()
+        self.select(self.users[0], [self.ids[0]])
+
+        def announce_then_sort(ranking):
+            # A selection announced after the rebuild read the counts
+            broker.publish({"username": "bob", "added": [self.ids[0]], "removed": []})
+            return sorted(ranking)
+
+        with patch("api.leaderboard.sorted", announce_then_sort, create=True):
+            leaderboard.rebuild()
+        self.assertEqual(self.top(), [(self.ids[0], 2)])
+
+    def test_stale_rankings_are_reconciled(self):
+        self.top()
+        # Bypasses api.selection, so no event reaches the leaderboard
+        Product.objects.filter(pk=self.ids[0]).update(selection_count=3)
+        self.assertEqual(self.top(), [])
+
+        with (
+            override_settings(API_LEADERBOARD_RECONCILE_SECONDS=0),
+            patch.object(leaderboard, "reconcile_in_background") as reconcile,
+        ):
+            self.top()
+        reconcile.assert_called_once()
+        leaderboard.rebuild()
+        self.assertEqual(self.top(), [(self.ids[0], 3)])
+
+    def test_requires_authentication(self):
+        self.client.force_authenticate(None)
+        self.assertEqual(self.client.get("/api/products/top/").status_code, 401)
+
+
+class SuggestTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        suggest_index.reset()
+        self.addCleanup(suggest_index.reset)
+        self.client = APIClient()
+        self.client.force_authenticate(CustomUser.objects.create(username="alice"))
+        self.products = Product.objects.bulk_create(
+            Product(name=name, price="9.99")
+            for name in (
+                "Alpha Books",
+                "alpha Electronics",
+                "Alpine Electronics",
+                "Beta Electronics",
+                "Älpler Garden",
+            )
+        )
+
+    def suggest(self, q, **params):
+        response = self.client.get("/api/products/suggest/", {"q": q, **params})
+        self.assertEqual(response.status_code, 200)
+        return (
+            [(row["term"], row["count"]) for row in response.data["terms"]],
+            [row["name"] for row in response.data["products"]],
+        )
+
+    def test_completes_words_and_names(self):
+        terms, products = self.suggest("al")
+        self.assertEqual(terms, [("alpha", 2), ("alpine", 1)])
+        self.assertEqual(
+            products, ["Alpha Books", "alpha Electronics", "Alpine Electronics"]
+        )
+
+        terms, products = self.suggest("ALPHA E", limit=1)
+        self.assertEqual(terms, [("electronics", 3)])
+        self.assertEqual(products, ["alpha Electronics"])
+
+        self.assertEqual(self.suggest("alpha ")[0], [])
+        self.assertEqual(self.suggest("äl"), ([("älpler", 1)], ["Älpler Garden"]))
+        self.assertEqual(self.suggest("   "), ([], []))
+
+    def test_category_words_are_suggested_without_products(self):
+        self.assertEqual(self.suggest("toy")[0], [("toys", 0)])
+        self.assertEqual(self.suggest("kit")[0], [("kitchen", 0)])
+
+    def test_follows_saves_and_deletes_without_queries(self):
+        self.suggest("a")
+        alpha, alpine = self.products[0], self.products[2]
+        with self.captureOnCommitCallbacks(execute=True):
+            alpha.name = "Omega Books"
+            alpha.save()
+            Product.objects.create(name="Alps Garden", price="1.00")
+            alpine.delete()
+        with self.assertNumQueries(0):
+            terms, products = self.suggest("alp")
+        self.assertEqual(terms, [("alpha", 1), ("alps", 1)])
+        self.assertEqual(products, ["alpha Electronics", "Alps Garden"])
+        self.assertEqual(self.suggest("omega")[1], ["Omega Books"])
+
+        # Renaming again replaces the overlay entry
+        with self.captureOnCommitCallbacks(execute=True):
+            alpha.name = "Alpha Books"
+            alpha.save()
+        self.assertEqual(self.suggest("omega"), ([], []))
+        self.assertEqual(
+            self.suggest("alp")[1],
+            ["Alpha Books", "alpha Electronics", "Alps Garden"],
+        )
+
+    def test_rebuild_picks_up_bulk_writes(self):
+        self.suggest("a")
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.filter(name="Beta Electronics").update(name="Alpaca Toys")
+        self.assertEqual(self.suggest("alpa")[1], [])
+        with patch("api.suggest.NAMES_CHECK_SECONDS", 0):
+            with patch.object(suggest_index, "rebuild_in_background") as rebuild:
+                # Nothing changed the names version yet
+                self.suggest("a")
+            rebuild.assert_not_called()
+            with self.captureOnCommitCallbacks(execute=True):
+                bump_catalog_version(CatalogVersion.PRODUCT_NAMES)
+            with patch.object(suggest_index, "rebuild_in_background") as rebuild:
+                self.suggest("a")
+        rebuild.assert_called_once()
+        suggest_index.rebuild()
+        self.assertEqual(self.suggest("alpa"), ([("alpaca", 1)], ["Alpaca Toys"]))
+
+    def test_renames_and_deletes_bump_the_names_version(self):
+        alpha = Product.objects.get(pk=self.products[0].pk)
+        version = get_catalog_version(CatalogVersion.PRODUCT_NAMES)
+        with self.captureOnCommitCallbacks(execute=True):
+            alpha.stock = 3
+            alpha.save()
+        self.assertEqual(get_catalog_version(CatalogVersion.PRODUCT_NAMES), version)
+        with self.captureOnCommitCallbacks(execute=True):
+            alpha.name = "Omega Books"
+            alpha.save()
+            alpha.delete()
+        self.assertEqual(get_catalog_version(CatalogVersion.PRODUCT_NAMES), version + 2)
+
+    def test_names_the_database_sorts_differently_are_merged(self):
+        # SQLite only lowers ASCII: it sorts "Älpler" before "äbte"
+        Product.objects.create(name="äbte Books", price="1.00")
+        self.assertEqual(self.suggest("ä")[1], ["äbte Books", "Älpler Garden"])
+
+    def test_imports_rebuild_the_index(self):
+        self.suggest("a")
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "feed.csv")
+            with open(path, "w") as f:
+                f.write("sku,name,description,price,stock\nZ9,Alpaca Toys,,5,1\n")
+            with self.captureOnCommitCallbacks(execute=True):
+                call_command("import_products", path, stdout=StringIO())
+        with (
+            patch("api.suggest.NAMES_CHECK_SECONDS", 0),
+            patch.object(suggest_index, "rebuild_in_background") as rebuild,
+        ):
+            self.suggest("a")
+        rebuild.assert_called_once()
+        suggest_index.rebuild()
+        self.assertEqual(self.suggest("alpa")[1], ["Alpaca Toys"])
+
+    def test_limit_is_validated(self):
+        response = self.client.get("/api/products/suggest/", {"q": "a", "limit": 51})
+        self.assertEqual(response.status_code, 400)
+
+    def test_packed_names(self):
+        names = PackedNames(["a", "bc", "Äb"], [3, 2, 1])
+        self.assertEqual(list(names), ["a", "bc", "Äb"])
+        self.assertEqual(
+            [names.name_of(i) for i in (1, 2, 3, 4)], ["Äb", "bc", "a", None]
+        )
+        self.assertEqual([m[2] for m in names.starting_with("b")], ["bc"])
+
+
+class SelectionEventStreamTests(TestCase):
+    async def test_stream_delivers_published_events(self):
+        token = AccessToken.for_user(CustomUser(pk=1, username="alice"))
+        client = AsyncClient()
+
+        response = await client.get("/api/products/events/")
+        self.assertEqual(response.status_code, 401)
+
+        response = await client.get(
+            "/api/products/events/",
+            {"token": str(token)},
+            headers={"Accept-Encoding": "gzip, br"},
+        )
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        # Compressing would hold events back until enough of them follow
+        self.assertFalse(response.has_header("Content-Encoding"))
+        chunks = aiter(response.streaming_content)
+        self.assertEqual(await anext(chunks), b"retry: 3000\n\n")
+
+        broker.publish({"username": "bob", "added": [1], "removed": []})
+        self.assertEqual(
+            await anext(chunks),
+            b'event: selection\ndata: {"username":"bob","added":[1],"removed":[]}\n\n',
+        )
+        await chunks.aclose()
+
+
+class AsyncViewTests(APITestCase):
+    """The async endpoints answer exactly like the DRF views."""
+
+    def setUp(self):
+        super().setUp()
+        self.user = CustomUser.objects.create(username="alice")
+        self.products = create_products(3)
+        toggle_selection(self.user, self.products[1].id)
+        self.headers = {"Authorization": f"Bearer {access_token(self.user)}"}
+
+    async def both(self, method, path, data=None, headers=None):
+        """Send a request to the DRF views, then to the async ones."""
+        headers = self.headers if headers is None else headers
+        kwargs = {"headers": headers}
+        if data is not None:
+            kwargs.update(data=data, content_type="application/json")
+        responses = []
+        for urlconf in ("core.urls", "core.async_urls"):
+            await sync_to_async(response_cache.clear)()
+            with override_settings(ROOT_URLCONF=urlconf):
+                responses.append(await getattr(AsyncClient(), method)(path, **kwargs))
+        return responses
+
+    def assertSameResponse(self, drf, native):
+        self.assertEqual(native.status_code, drf.status_code)
+        self.assertEqual(native.content, drf.content)
+        for header in ("Content-Type", "ETag", "WWW-Authenticate"):
+            self.assertEqual(native.get(header), drf.get(header), header)
+
+    async def test_reads_match(self):
+        detail = f"/api/products/{self.products[1].id}/"
+        for path in (
+            "/api/products/",
+            "/api/products/?page_size=2&ordering=-stock",
+            "/api/products/?fields=id,is_selected&search=product",
+            "/api/products/?fields=nope",
+            detail,
+            f"{detail}?omit=description",
+            "/api/products/999999/",
+        ):
+            with self.subTest(path=path):
+                self.assertSameResponse(*await self.both("get", path))
+
+        next_page = (await self.both("get", "/api/products/?page_size=1"))[1]
+        self.assertSameResponse(
+            *await self.both("get", json.loads(next_page.content)["next"])
+        )
+
+    @override_settings(API_COMPRESSION_MIN_BYTES=0)
+    async def test_compressed_reads_match(self):
+        headers = {**self.headers, "Accept-Encoding": "gzip"}
+        drf, native = await self.both("get", "/api/products/", headers=headers)
+        self.assertEqual(native["Content-Encoding"], "gzip")
+        self.assertSameResponse(drf, native)
+
+    async def test_authentication_errors_match(self):
+        for headers in ({}, {"Authorization": "Bearer nonsense"}):
+            with self.subTest(headers=headers):
+                drf, native = await self.both("get", "/api/products/", headers=headers)
+                self.assertEqual(native.status_code, 401)
+                self.assertSameResponse(drf, native)
+
+    async def test_not_modified(self):
+        _, native = await self.both("get", "/api/products/")
+        with override_settings(ROOT_URLCONF="core.async_urls"):
+            response = await AsyncClient().get(
+                "/api/products/",
+                headers={**self.headers, "If-None-Match": native["ETag"]},
+            )
+        self.assertEqual(response.status_code, 304)
+
+    async def test_select_login_and_logout(self):
+        product_id = self.products[0].id
+        with override_settings(ROOT_URLCONF="core.async_urls"):
+            client = AsyncClient()
+            response = await client.post(
+                f"/api/products/{product_id}/select/", headers=self.headers
+            )
+            self.assertTrue(json.loads(response.content)["is_selected"])
+            response = await client.post(
+                "/api/products/999999/select/", headers=self.headers
+            )
+            self.assertEqual(response.status_code, 404)
+
+            response = await client.post(
+                "/api/login/", {"username": "bob"}, content_type="application/json"
+            )
+            login = json.loads(response.content)
+            self.assertEqual(login["username"], "bob")
+            headers = {"Authorization": f"Bearer {login['token']}"}
+            response = await client.post("/api/logout/", headers=headers)
+            self.assertEqual(response.status_code, 200)
+            response = await client.get("/api/products/", headers=headers)
+            self.assertEqual(response.status_code, 401)
+
+            response = await client.post(
+                "/api/login/", {}, content_type="application/json"
+            )
+            self.assertEqual(response.status_code, 400)
+            response = await client.delete("/api/login/")
+            self.assertEqual(response.status_code, 405)
+
+    async def test_selection_state_matches(self):
+        path = f"/api/products/{self.products[2].id}/select/"
+        drf, native = await self.both("post", path)
+        # Each view toggled once: selected by the DRF view, unselected again
+        self.assertTrue(json.loads(drf.content)["is_selected"])
+        self.assertFalse(json.loads(native.content)["is_selected"])
+
+
+class MetricsTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = CustomUser.objects.create(username="alice")
+        create_products(3)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def scrape(self):
+        response = self.client.get("/api/metrics")
+        self.assertEqual(response.status_code, 200)
+        samples = {}
+        for line in response.content.decode().splitlines():
+            if line and not line.startswith("#"):
+                series, value = line.rsplit(" ", 1)
+                samples[series] = float(value)
+        return samples
+
+    def test_scrapes_through_the_proxy_need_the_token(self):
+        forwarded = {"HTTP_X_FORWARDED_FOR": "203.0.113.7"}
+        self.assertEqual(self.client.get("/api/metrics", **forwarded).status_code, 403)
+        with override_settings(API_METRICS_TOKEN="secret"):
+            self.assertEqual(self.client.get("/api/metrics").status_code, 401)
+            response = self.client.get(
+                "/api/metrics", HTTP_AUTHORIZATION="Bearer secret", **forwarded
+            )
+            self.assertEqual(response.status_code, 200)
+
+    def test_requests_are_recorded_per_view(self):
+        view = 'view="product-list"'
+        requests = f'api_requests_total{{{view},method="GET",status="200"}}'
+        latency = f'api_request_duration_seconds_count{{{view},method="GET"}}'
+        before = self.scrape()
+        for _ in range(2):
+            response = self.client.get("/api/products/", {"page_size": 2})
+        after = self.scrape()
+
+        def delta(series):
+            return after[series] - before.get(series, 0)
+
+        self.assertEqual(delta(requests), 2)
+        self.assertEqual(delta(latency), 2)
+        self.assertEqual(
+            after[
+                f'api_request_duration_seconds_bucket{{{view},method="GET",le="+Inf"}}'
+            ],
+            after[latency],
+        )
+        self.assertGreater(delta(f"api_db_queries_total{{{view}}}"), 0)
+        self.assertGreater(delta(f"api_db_query_duration_seconds_total{{{view}}}"), 0)
+        self.assertGreater(delta(f"api_serializer_duration_seconds_total{{{view}}}"), 0)
+        self.assertEqual(
+            delta(f"api_response_bytes_total{{{view}}}"), 2 * len(response.content)
+        )
+        # The scrape counts itself
+        self.assertEqual(after["api_requests_in_flight"], 1)
+
+    def test_scrape_merges_other_processes(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with override_settings(API_METRICS_DIR=directory):
+                samples = [
+                    ["api_requests_total", ["login", "POST", "200"], 5],
+                    ["api_requests_in_flight", [], 3],
+                ]
+                for name, pid in [("exited", 2**22 + 1), ("live", os.getpid())]:
+                    with open(os.path.join(directory, f"{name}.json"), "w") as f:
+                        json.dump({"pid": pid, "samples": samples}, f)
+                metrics_files.flush()
+                self.assertTrue(
+                    os.path.exists(os.path.join(directory, f"{PROCESS_ID}.json"))
+                )
+                scraped = self.scrape()
+
+        series = 'api_requests_total{view="login",method="POST",status="200"}'
+        self.assertEqual(scraped[series], 10 + self.own_logins())
+        # Only the live process's gauge counts (plus the scrape itself)
+        self.assertEqual(scraped["api_requests_in_flight"], 4)
+
+    def test_snapshots_are_written_off_the_request_thread(self):
+        flushed = threading.Event()
+        threads = []
+
+        def flush():
+            threads.append(threading.get_ident())
+            flushed.set()
+
+        with (
+            tempfile.TemporaryDirectory() as directory,
+            override_settings(API_METRICS_DIR=directory),
+            patch.object(metrics_files, "flush", side_effect=flush),
+            patch.object(metrics_files, "_flusher", None),
+        ):
+            self.scrape()
+            self.assertTrue(flushed.wait(5))
+        self.assertNotIn(threading.get_ident(), threads)
+
+    def own_logins(self):
+        series = 'api_requests_total{view="login",method="POST",status="200"}'
+        return self.scrape().get(series, 0)
+
+
+class AdmissionTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = CustomUser.objects.create(username="alice")
+        self.headers = {"Authorization": f"Bearer {access_token(self.user)}"}
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.db = os.path.join(directory.name, "buckets.sqlite3")
+
+    def test_gate_queue_is_bounded(self):
+        gate = Gate(limit=1, queue_size=1)
+        self.assertTrue(gate.try_acquire())
+        results = []
+        waiter = threading.Thread(target=lambda: results.append(gate.acquire(5)))
+        waiter.start()
+        while not gate.waiting:
+            time.sleep(0.001)
+        # The line is full, and the free slot goes to the waiting request
+        self.assertEqual(gate.acquire(5), QUEUE_FULL)
+        gate.release()
+        waiter.join()
+        self.assertEqual(results, [None])
+        self.assertFalse(gate.try_acquire())
+        self.assertEqual(gate.acquire(0.01), TIMEOUT)
+        gate.release()
+        self.assertEqual(gate.active, 0)
+
+    def test_buckets_are_shared_and_refill(self):
+        first, second = TokenBuckets(), TokenBuckets()
+        bucket = {"rate": 1, "burst": 2, "path": self.db}
+        self.assertEqual(first.take("user:1", now=100.0, **bucket), 0)
+        self.assertEqual(second.take("user:1", now=100.0, **bucket), 0)
+        self.assertEqual(first.take("user:1", now=100.25, **bucket), 0.75)
+        self.assertEqual(second.take("user:2", now=100.25, **bucket), 0)
+        self.assertEqual(second.take("user:1", now=101.0, **bucket), 0)
+
+    def test_rate_limited_requests_get_429(self):
+        with override_settings(
+            API_RATE_LIMIT_PER_SECOND=0.01,
+            API_RATE_LIMIT_BURST=2,
+            API_RATE_LIMIT_DB=self.db,
+        ):
+            statuses = [
+                self.client.get("/api/products/", headers=self.headers).status_code
+                for _ in range(3)
+            ]
+            response = self.client.get("/api/products/", headers=self.headers)
+            # Anonymous clients have buckets of their own
+            anonymous = self.client.get("/api/products/").status_code
+        self.assertEqual(statuses, [200, 200, 429])
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(int(response["Retry-After"]), 100)
+        self.assertEqual(anonymous, 401)
+
+    def test_overloaded_views_are_shed(self):
+        before = self.shed_count()
+        with override_settings(
+            API_ADMISSION_LIMITS={"product-list": 1}, API_ADMISSION_QUEUE_SIZE=0
+        ):
+            gate = gates.get("product-list")
+            self.assertTrue(gate.try_acquire())
+            try:
+                response = self.client.get("/api/products/", headers=self.headers)
+                # Other views have limits of their own
+                logout = self.client.post("/api/logout/", headers=self.headers)
+            finally:
+                gate.release()
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response["Retry-After"], "1")
+        self.assertEqual(logout.status_code, 200)
+        self.assertEqual(self.shed_count() - before, 1)
+
+    async def test_async_requests_wait_in_line(self):
+        with override_settings(
+            API_ADMISSION_LIMITS={"product-list": 1}, API_ADMISSION_QUEUE_SIZE=1
+        ):
+            gate = gates.get("product-list")
+            self.assertTrue(gate.try_acquire())
+            asyncio.get_running_loop().call_later(0.05, gate.release)
+            response = await AsyncClient().get("/api/products/", headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(gate.active, 0)
+
+    async def test_async_rate_limit_runs_off_the_event_loop(self):
+        threads = []
+
+        def check(request):
+            threads.append(threading.get_ident())
+            return 0
+
+        with (
+            override_settings(API_RATE_LIMIT_PER_SECOND=1),
+            patch("api.admission.check_rate_limit", side_effect=check),
+        ):
+            response = await AsyncClient().get("/api/products/", headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(threads), 1)
+        self.assertNotEqual(threads[0], threading.get_ident())
+
+    @override_settings(
+        API_WORKER_THREADS=8,
+        API_ADMISSION_RESERVED_THREADS=2,
+        API_ADMISSION_LIMITS={"product-list": 4},
+        API_ADMISSION_DEFAULT_LIMIT=8,
+        API_ADMISSION_QUEUE_SIZE=None,
+    )
+    def test_lines_leave_threads_for_other_views(self):
+        gate = gates.get("product-list")
+        self.assertEqual((gate.limit, gate.queue_size), (4, 2))
+        gate = gates.get("logout")
+        self.assertEqual((gate.limit, gate.queue_size), (6, 0))
+
+    def test_streamed_responses_hold_their_slot(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        with override_settings(API_ADMISSION_LIMITS={"product-export": 1}):
+            gate = gates.get("product-export")
+            response = client.get("/api/products/export/")
+            self.assertEqual(gate.active, 1)
+            b"".join(response.streaming_content)
+            response.close()
+            self.assertEqual(gate.active, 0)
+
+    def shed_count(self):
+        series = 'api_requests_shed_total{view="product-list",reason="queue_full"}'
+        for line in self.client.get("/api/metrics").content.decode().splitlines():
+            if line.startswith(series):
+                return float(line.rsplit(" ", 1)[1])
+        return 0
+
+
+class CapturingHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.setFormatter(JSONFormatter())
+        self.lines = []
+
+    def emit(self, record):
+        self.lines.append((json.loads(self.format(record)), threading.get_ident()))
+
+
+class DatabaseProfileTests(SimpleTestCase):
+    sqlite = {"ENGINE": "django.db.backends.sqlite3", "NAME": "db.sqlite3"}
+    postgres = {"ENGINE": "django.db.backends.postgresql", "NAME": "app"}
+
+    def test_default_keeps_django_defaults(self):
+        self.assertEqual(
+            apply_profile(self.sqlite, "default"), {**self.sqlite, "OPTIONS": {}}
+        )
+
+    def test_sqlite_performance(self):
+        database = apply_profile(self.sqlite, "performance", conn_max_age=60)
+        self.assertIn("PRAGMA journal_mode=WAL", database["OPTIONS"]["init_command"])
+        self.assertIn("PRAGMA busy_timeout=5000", database["OPTIONS"]["init_command"])
+        self.assertEqual(database["OPTIONS"]["transaction_mode"], "IMMEDIATE")
+        self.assertEqual(database["CONN_MAX_AGE"], 60)
+        self.assertTrue(database["CONN_HEALTH_CHECKS"])
+        self.assertNotIn("OPTIONS", self.sqlite)
+
+    def test_postgres_performance(self):
+        with patch("core.database.has_psycopg_pool", return_value=False):
+            database = apply_profile(self.postgres, "performance")
+        self.assertEqual(database["CONN_MAX_AGE"], 600)
+        self.assertTrue(database["CONN_HEALTH_CHECKS"])
+        self.assertEqual(database["OPTIONS"], {})
+
+    def test_unknown_profile(self):
+        with self.assertRaises(ValueError):
+            apply_profile(self.sqlite, "fastest")
+
+
+class QueueingHandlerTests(SimpleTestCase):
+    def make_logger(self, **options):
+        capture = CapturingHandler()
+        handler = QueueingHandler(handlers=[capture], **options)
+        self.addCleanup(handler.close)
+        logger = logging.Logger("test")
+        logger.addHandler(handler)
+        return logger, handler, capture
+
+    def test_records_are_formatted_off_the_calling_thread(self):
+        formatted_on = []
+
+        class Argument:
+            def __str__(self):
+                formatted_on.append(threading.get_ident())
+                return "value"
+
+        logger, handler, capture = self.make_logger()
+        logger.warning("got %s", Argument(), extra={"user_id": 7})
+        handler.close()
+
+        [(entry, thread)] = capture.lines
+        self.assertEqual(entry["message"], "got value")
+        self.assertEqual((entry["level"], entry["user_id"]), ("WARNING", 7))
+        self.assertNotEqual(formatted_on, [threading.get_ident()])
+        self.assertNotEqual(thread, threading.get_ident())
+
+    def test_full_queue_drops_and_reports(self):
+        logger, handler, capture = self.make_logger(queue_size=4, shed_fraction=0.5)
+        # Nothing drains the queue until the listener is restarted
+        handler.listener.stop()
+        for i in range(4):
+            logger.info("info %d", i)
+        for i in range(4):
+            logger.error("error %d", i)
+        handler.listener.start()
+        handler.close()
+
+        messages = [entry["message"] for entry, _ in capture.lines]
+        # Below WARNING is shed at half capacity; errors fill the rest, and the
+        # first one queued after the drops is followed by their report
+        self.assertEqual(
+            messages,
+            [
+                "info 0",
+                "info 1",
+                "error 0",
+                "Dropped 2 log records while the log queue was full",
+            ],
+        )
+        self.assertEqual(handler.dropped, 3)
+
+        logger, handler, capture = self.make_logger(queue_size=4)
+        handler.dropped = 4
+        logger.error("after")
+        handler.close()
+        self.assertEqual(
+            [entry["message"] for entry, _ in capture.lines],
+            ["after", "Dropped 4 log records while the log queue was full"],
+        )
+
+    def test_per_process_file_keeps_warnings(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        logger, handler, _ = self.make_logger(
+            filename=os.path.join(directory.name, "django.jsonl"),
+            per_process=True,
+            file_level="WARNING",
+        )
+        logger.info("info")
+        logger.warning("warning")
+        handler.close()
+
+        path = os.path.join(directory.name, f"django.{os.getpid()}.jsonl")
+        with open(path) as f:
+            self.assertEqual([json.loads(line)["message"] for line in f], ["warning"])
+
+    def test_sampling(self):
+        logger, handler, capture = self.make_logger(sample_rates={"DEBUG": 0})
+        logger.setLevel(logging.DEBUG)
+        for i in range(10):
+            logger.debug("debug %d", i)
+        logger.info("info")
+        handler.close()
+        self.assertEqual([entry["message"] for entry, _ in capture.lines], ["info"])
+
+
+class ProductExportTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = CustomUser.objects.create(username="alice")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.products = create_products(5)
+
+    def export(self, **kwargs):
+        response = self.client.get("/api/products/export/", kwargs)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return response, b"".join(response.streaming_content).decode()
+
+    def test_ndjson_is_the_default(self):
+        response, body = self.export()
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        rows = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual([row["id"] for row in rows], [p.id for p in self.products])
+        self.assertEqual(
+            rows[0],
+            {
+                "id": self.products[0].id,
+                "sku": None,
+                "name": "product 0",
+                "description": "description 0",
+                "price": "9.99",
+                "stock": 0,
+                "selection_count": 0,
+            },
+        )
+
+    def test_csv(self):
+        response, body = self.export(format="csv")
+        self.assertEqual(response["Content-Type"], "text/csv; charset=utf-8")
+        self.assertIn('filename="products.csv"', response["Content-Disposition"])
+        lines = body.splitlines()
+        self.assertEqual(
+            lines[0], "id,sku,name,description,price,stock,selection_count"
+        )
+        self.assertEqual(
+            lines[1], f"{self.products[0].id},,product 0,description 0,9.99,0,0"
+        )
+        self.assertEqual(len(lines), 6)
+
+    def test_rows_are_streamed_in_chunks(self):
+        with patch("api.views.EXPORT_CHUNK_SIZE", 2):
+            response = self.client.get("/api/products/export/", {"format": "ndjson"})
+            chunks = list(response.streaming_content)
+        self.assertEqual([chunk.count(b"\n") for chunk in chunks], [2, 2, 1])
+
+    def test_unknown_format_and_anonymous(self):
+        response = self.client.get("/api/products/export/", {"format": "xml"})
+        self.assertEqual(response.status_code, 404)
+        response = APIClient().get("/api/products/export/", {"format": "csv"})
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.content.splitlines()[0], b"detail")
+
+    def test_error_rendering(self):
+        self.assertEqual(
+            NDJSONRenderer().render({"detail": "no"}), b'{"detail":"no"}\n'
+        )
+        self.assertEqual(CSVRenderer().render({"detail": "no"}), b"detail\r\nno\r\n")
+
+
+class ImportProductsTests(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def feed(self, name, content):
+        path = os.path.join(self.tmp.name, name)
+        with open(path, "w") as f:
+            f.write(content)
+        return path
+
+    def run_import(self, path, **options):
+        out, err = StringIO(), StringIO()
+        call_command("import_products", path, stdout=out, stderr=err, **options)
+        return out.getvalue(), err.getvalue()
+
+    def products(self):
+        return list(
+            Product.objects.order_by("sku").values_list(
+                "sku", "name", "description", "price", "stock"
+            )
+        )
+
+    def test_csv_upserts_by_sku(self):
+        Product.objects.create(
+            sku="A1", name="old", description="old", price="1.00", stock=1
+        )
+        path = self.feed(
+            "feed.csv",
+            "sku,name,description,price,stock\n"
+            "A1,Lamp,Bright,19.5,3\n"
+            "B2,Chair,,5,\n"
+            "B2,Chair,Wooden,6.00,2\n",
+        )
+        out, err = self.run_import(path, batch_size=2)
+        self.assertEqual(err, "")
+        self.assertIn("Imported 3 products from 3 records (0 invalid)", out)
+        self.assertEqual(
+            self.products(),
+            [
+                ("A1", "Lamp", "Bright", Decimal("19.50"), 3),
+                ("B2", "Chair", "Wooden", Decimal("6.00"), 2),
+            ],
+        )
+
+    def test_invalid_records_are_reported_and_skipped(self):
+        path = self.feed(
+            "feed.jsonl",
+            '{"sku": "A1", "name": "Lamp", "price": "1.999"}\n'
+            "not json\n"
+            '{"sku": "B2", "name": "Chair", "price": 5, "stock": "x"}\n'
+            '{"sku": "C3", "price": 5}\n'
+            "\n"
+            '{"sku": "D4", "name": "Desk", "price": 99.99, "stock": 7}\n',
+        )
+        out, err = self.run_import(path)
+        self.assertIn("(4 invalid)", out)
+        self.assertIn("Record 1: price '1.999' has more than 2 decimal places", err)
+        self.assertIn("Record 2: invalid JSON", err)
+        self.assertIn("Record 3: stock 'x' is not an integer", err)
+        self.assertIn("Record 4: name is required", err)
+        self.assertEqual(self.products(), [("D4", "Desk", "", Decimal("99.99"), 7)])
+
+    def test_resumes_from_checkpoint(self):
+        path = self.feed(
+            "feed.csv",
+            "sku,name,price\n" + "".join(f"S{i},Item {i},{i}\n" for i in range(5)),
+        )
+        checkpoint = os.path.join(self.tmp.name, "checkpoint.json")
+        with open(checkpoint, "w") as f:
+            json.dump({"source": path, "records": 3}, f)
+        out, err = self.run_import(path, checkpoint=checkpoint, batch_size=1)
+        self.assertIn("Resuming after 3 records", out)
+        self.assertEqual([row[0] for row in self.products()], ["S3", "S4"])
+        self.assertFalse(os.path.exists(checkpoint))
+
+        with open(checkpoint, "w") as f:
+            json.dump({"source": "/elsewhere.csv", "records": 3}, f)
+        with self.assertRaises(CommandError):
+            self.run_import(path, checkpoint=checkpoint)
+
+    def test_worker_pool(self):
+        path = self.feed(
+            "feed.csv",
+            "sku,name,price\n" + "".join(f"S{i},Item {i},{i}\n" for i in range(50)),
+        )
+        out, err = self.run_import(path, batch_size=7, workers=2)
+        self.assertIn("Imported 50 products", out)
+        self.assertEqual(Product.objects.filter(sku__startswith="S").count(), 50)
+
+
+class ORJSONRendererTests(APITestCase):
+    def test_output_matches_json_renderer(self):
+        data = {
+            "price": Decimal("9.90"),
+            "when": datetime(2024, 1, 2, 3, 4, 5, 678000, tzinfo=dt_timezone.utc),
+            "day": date(2024, 1, 2),
+            "text": "caf\u00e9 \u2028 \u2029 \U0001f600",
+            "lazy": gettext_lazy("Not found."),
+            "error": ErrorDetail("invalid", code="invalid"),
+            "keys": {1: "one"},
+            "nested": [None, True, 1.5, (2, 3)],
+        }
+        self.assertEqual(ORJSONRenderer().render(data), JSONRenderer().render(data))
+
+    def test_product_list_is_byte_identical(self):
+        user = CustomUser.objects.create(username="alice")
+        products = create_products(3)
+        toggle_selection(user, products[0].id)
+        client = APIClient()
+        client.force_authenticate(user)
+        response = client.get("/api/products/")
+        self.assertEqual(ORJSONRenderer().render(response.data), response.content)
+
+    def test_indent_falls_back_to_json_renderer(self):
+        data = {"a": [1, 2]}
+        media_type = "application/json; indent=4"
+        self.assertEqual(
+            ORJSONRenderer().render(data, media_type),
+            JSONRenderer().render(data, media_type),
+        )
+
+    def test_parser(self):
+        parser = ORJSONParser()
+        self.assertEqual(
+            parser.parse(BytesIO(b'{"ids": [1, 2], "name": "caf\xc3\xa9"}')),
+            {"ids": [1, 2], "name": "caf\u00e9"},
+        )
+        latin = BytesIO('{"name": "caf\u00e9"}'.encode("latin-1"))
+        self.assertEqual(
+            parser.parse(latin, parser_context={"encoding": "latin-1"}),
+            {"name": "caf\u00e9"},
+        )
+        for body in (b"{", b'{"a": NaN}'):
+            with self.assertRaises(ParseError):
+                parser.parse(BytesIO(body))
+
+
+class BenchmarkReportTests(SimpleTestCase):
+    def test_summary(self):
+        samples = [(200, i / 1000, 2, 100) for i in range(1, 101)]
+        samples.append((500, 0.2, 4, 1110))
+        result = summarize(samples, elapsed=2.0, cpu_time=1.01)
+        self.assertEqual(result["requests"], 101)
+        self.assertEqual(result["errors"], 1)
+        self.assertEqual(result["rps"], 50.5)
+        self.assertEqual((result["p50_ms"], result["p99_ms"]), (51.0, 100.0))
+        self.assertEqual(result["queries_per_request"], 2.02)
+        self.assertEqual(result["bytes_per_request"], 110)
+        self.assertEqual(result["cpu_ms_per_request"], 10.0)
+
+    def test_regressions_are_relative_to_the_baseline(self):
+        before = {
+            "rps": 100.0,
+            "p50_ms": 10.0,
+            "p95_ms": 20.0,
+            "p99_ms": 40.0,
+            "queries_per_request": 2.0,
+            "errors": 0,
+        }
+        noise = {**before, "rps": 90.0, "p99_ms": 45.0, "queries_per_request": 2.3}
+        worse = {**before, "rps": 70.0, "p95_ms": 30.0, "queries_per_request": 3.0}
+        regressions = compare(
+            {"wsgi a": noise, "wsgi b": worse, "asgi c": before},
+            {"wsgi a": before, "wsgi b": before},
+        )
+        self.assertEqual(
+            regressions,
+            [
+                ("wsgi b", "rps", 100.0, 70.0),
+                ("wsgi b", "p95_ms", 20.0, 30.0),
+                ("wsgi b", "queries_per_request", 2.0, 3.0),
+            ],
+        )
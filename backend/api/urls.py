@@ -1,5 +1,7 @@
-from django.urls import path, include
+from django.urls import path, include, re_path
 from rest_framework.routers import DefaultRouter
+from .events import product_events
+from .metrics import metrics_view
 from .views import login_user, logout_user, ProductViewSet
 
 router = DefaultRouter()
@@ -8,5 +10,8 @@ router.register(r"products", ProductViewSet)
 urlpatterns = [
     path("login/", login_user, name="login"),
     path("logout/", logout_user, name="logout"),
+    re_path(r"^metrics/?$", metrics_view, name="metrics"),
+    # Registered ahead of the router, which would treat "events" as a pk
+    path("products/events/", product_events, name="product-events"),
     path("", include(router.urls)),
 ]
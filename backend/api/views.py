@@ -1,57 +1,265 @@
+from django.http import StreamingHttpResponse
+from django.utils.functional import cached_property
 from rest_framework import status, viewsets
 from rest_framework.decorators import api_view, permission_classes, action
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
-from rest_framework_simplejwt.tokens import RefreshToken, AccessToken
-from rest_framework_simplejwt.authentication import JWTAuthentication
-from rest_framework_simplejwt.token_blacklist.models import (
-    OutstandingToken,
-    BlacklistedToken,
-)
-from django.db.models import Q
+from rest_framework_simplejwt.tokens import AccessToken
+from .authentication import ClaimsJWTAuthentication, USERNAME_CLAIM, forget_user
+from .blacklist import revoked_tokens
+from .caching import ConditionalReadMixin, purge_user_responses
+from .export import CSVRenderer, NDJSONRenderer
+from .leaderboard import leaderboard
 from .models import Product, CustomUser
-from .serializers import ProductSerializer, CustomUserSerializer
+from .routers import pin_user, read_from_replicas
+from .pagination import KeysetPagination
+from .search import get_search_backend
+from .selection import (
+    SET,
+    TOGGLE,
+    UNSET,
+    apply_selection,
+    clear_selection,
+    toggle_selection,
+)
+from .serializers import (
+    CustomUserSerializer,
+    ProductSelectionSerializer,
+    ProductSerializer,
+)
+from .suggest import suggest_index
 import logging
-from datetime import datetime, timezone
 
 logger = logging.getLogger(__name__)
 
+EXPORT_FIELDS = (
+    "id",
+    "sku",
+    "name",
+    "description",
+    "price",
+    "stock",
+    "selection_count",
+)
+EXPORT_CHUNK_SIZE = 2000
+TOP_DEFAULT_LIMIT = 10
+TOP_MAX_LIMIT = 100
+SUGGEST_DEFAULT_LIMIT = 10
+SUGGEST_MAX_LIMIT = 50
+
+PRODUCT_COLUMNS = {field.name for field in Product._meta.concrete_fields}
+# Reads that don't need the user's latest writes unless the user is pinned
+REPLICA_ACTIONS = ("list", "retrieve", "export")
+
+
+def requested_fields(params):
+    """
+    Fields picked with ``?fields=`` and/or ``?omit=`` (comma-separated), or
+    None to return every field.
+    """
+    if not (params.get("fields") or params.get("omit")):
+        return None
+    fields = list(ProductSerializer.Meta.fields)
+    for param in ("fields", "omit"):
+        names = [name.strip() for name in params.get(param, "").split(",")]
+        names = [name for name in names if name]
+        unknown = [name for name in names if name not in fields]
+        if unknown:
+            raise ValidationError({param: f"Unknown fields: {', '.join(unknown)}."})
+        if names:
+            keep = param == "fields"
+            fields = [name for name in fields if (name in names) == keep]
+    return tuple(fields)
+
+
+def limit_param(params, default, maximum):
+    """The ``?limit=`` of a request, between 1 and ``maximum``."""
+    try:
+        limit = int(params.get("limit", default))
+    except (TypeError, ValueError):
+        limit = 0
+    if not 1 <= limit <= maximum:
+        raise ValidationError({"limit": f"Must be an integer between 1 and {maximum}."})
+    return limit
+
+
+def product_queryset(user, params, fields=None):
+    """Products as ``user`` reads them, searched with ``?search=``."""
+    if fields is None:
+        queryset = Product.objects.with_selection(user)
+    else:
+        columns = [name for name in fields if name in PRODUCT_COLUMNS]
+        # Only what the response includes: no selection prefetch or
+        # description column unless asked for
+        queryset = Product.objects.only(*columns or ["id"]).with_selection(
+            user,
+            is_selected="is_selected" in fields,
+            selected_by="selected_by_usernames" in fields,
+        )
+    search = params.get("search", None)
+
+    if search:
+        queryset = (
+            get_search_backend(queryset.db)
+            .search(queryset, search)
+            .order_by("search_rank", "id")
+        )
+
+    return queryset
+
+
+def start_session(username, email=""):
+    """Log ``username`` in and return the login response data."""
+    # Create or get user
+    user = CustomUser.objects.get_or_create_for_login(username, email=email)
+
+    # Unselect any products previously selected by this user
+    clear_selection(user)
+    purge_user_responses(user.pk)
+    # The request was anonymous, so the middleware can't pin the new session
+    pin_user(user.pk)
+
+    # Only the access token is handed out; RefreshToken.for_user would also
+    # write an OutstandingToken row for a refresh token nobody receives
+    access = AccessToken.for_user(user)
+    # Lets ClaimsJWTAuthentication serve requests without loading the user
+    access[USERNAME_CLAIM] = user.username
+    serializer = CustomUserSerializer(user)
+    return {"token": str(access), **serializer.data}
 
-class ProductViewSet(viewsets.ReadOnlyModelViewSet):
+
+def end_session(user, token):
+    """Clear ``user``'s selection and revoke the access token ``token``."""
+    # Unselect any products selected by the user
+    clear_selection(user)
+    purge_user_responses(user.pk)
+    forget_user(user.pk)
+
+    try:
+        # Blacklist the token
+        revoked_tokens.revoke(AccessToken(token), user.id)
+    except Exception as token_error:
+        logger.error("Error blacklisting token: %s", token_error)
+        # Even if token blacklisting fails, we've already unselected products
+        # Just log the error and return success
+
+
+class ProductViewSet(ConditionalReadMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [ClaimsJWTAuthentication]
     permission_classes = [IsAuthenticated]
+    pagination_class = KeysetPagination
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        # Authenticated: the rest of a read can be served by a replica
+        if self.action in REPLICA_ACTIONS:
+            read_from_replicas(request.user.pk)
 
     def get_queryset(self):
-        queryset = Product.objects.all()
-        search = self.request.query_params.get("search", None)
+        return product_queryset(
+            self.request.user, self.request.query_params, self.requested_fields
+        )
 
-        if search:
-            queryset = queryset.filter(
-                Q(name__icontains=search) | Q(description__icontains=search)
-            )
+    @cached_property
+    def requested_fields(self):
+        if self.action not in ("list", "retrieve"):
+            return None
+        return requested_fields(self.request.query_params)
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context["fields"] = self.requested_fields
+        return context
+
+    @action(detail=False, renderer_classes=[NDJSONRenderer, CSVRenderer])
+    def export(self, request):
+        renderer = request.accepted_renderer
+        queryset = Product.objects.order_by("pk")
+        # The rows are read after the view returns, outside the request's
+        # routing, so pick the database now
+        rows = (
+            queryset.using(queryset.db)
+            .values_list(*EXPORT_FIELDS)
+            .iterator(chunk_size=EXPORT_CHUNK_SIZE)
+        )
+        content_type = renderer.media_type
+        if renderer.charset:
+            content_type += f"; charset={renderer.charset}"
+        response = StreamingHttpResponse(
+            renderer.stream(EXPORT_FIELDS, rows, EXPORT_CHUNK_SIZE),
+            content_type=content_type,
+        )
+        response["Content-Disposition"] = (
+            f'attachment; filename="products.{renderer.format}"'
+        )
+        return response
 
-        return queryset
+    @action(detail=False)
+    def top(self, request):
+        """The most selected products, from the in-memory leaderboard."""
+        limit = limit_param(request.query_params, TOP_DEFAULT_LIMIT, TOP_MAX_LIMIT)
+        return Response(
+            {
+                "results": [
+                    {"id": pk, "selection_count": count}
+                    for pk, count in leaderboard.top(limit)
+                ]
+            }
+        )
+
+    @action(detail=False)
+    def suggest(self, request):
+        """Completions of ``?q=`` from the in-memory prefix index."""
+        limit = limit_param(
+            request.query_params, SUGGEST_DEFAULT_LIMIT, SUGGEST_MAX_LIMIT
+        )
+        terms, products = suggest_index.suggest(
+            request.query_params.get("q", ""), limit
+        )
+        return Response(
+            {
+                "terms": [{"term": term, "count": count} for term, count in terms],
+                "products": [{"id": pk, "name": name} for pk, name in products],
+            }
+        )
 
     @action(detail=True, methods=["post"])
     def select(self, request, pk=None):
-        product = self.get_object()
-        user = request.user
+        try:
+            toggle_selection(request.user, int(pk))
+        except (ValueError, Product.DoesNotExist):
+            raise NotFound()
 
-        # Toggle selection
-        if user in product.selected_by.all():
-            product.selected_by.remove(user)
-        else:
-            product.selected_by.add(user)
+        # Loaded after the toggle so is_selected reflects it
+        return Response(self.get_serializer(self.get_object()).data)
 
-        return Response(self.get_serializer(product).data)
+    @action(detail=False, methods=["post"], url_path="select", url_name="bulk-select")
+    def bulk_select(self, request):
+        serializer = ProductSelectionSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = serializer.validated_data["ids"]
+        mode = serializer.validated_data["action"]
+
+        try:
+            added, removed = apply_selection(request.user, ids, mode)
+        except Product.DoesNotExist as e:
+            return Response(
+                {"error": "Products not found", "ids": e.args[0]},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        # Which of the requested products end up selected follows from the mode
+        selected = {SET: sorted(set(ids)), UNSET: [], TOGGLE: added}[mode]
+        return Response({"added": added, "removed": removed, "selected": selected})
 
 
 @api_view(["POST"])
 @permission_classes([AllowAny])
 def login_user(request):
-    logger.info(f"Received login request with data: {request.data}")
+    logger.info("Received login request for %r", request.data.get("username"))
 
     username = request.data.get("username")
     if not username:
@@ -59,17 +267,7 @@ def login_user(request):
             {"error": "Username is required"}, status=status.HTTP_400_BAD_REQUEST
         )
 
-    # Create or get user
-    user, created = CustomUser.objects.get_or_create(
-        username=username, defaults={"email": request.data.get("email", "")}
-    )
-
-    # Unselect any products previously selected by this user
-    user.selected_products.clear()
-
-    refresh = RefreshToken.for_user(user)
-    serializer = CustomUserSerializer(user)
-    return Response({"token": str(refresh.access_token), **serializer.data})
+    return Response(start_session(username, request.data.get("email", "")))
 
 
 @api_view(["POST"])
@@ -84,31 +282,10 @@ def logout_user(request):
             )
 
         token = auth_header.split(" ")[1]
-
-        # Unselect any products selected by the user
-        request.user.selected_products.clear()
-
-        try:
-            # Blacklist the token
-            token_obj = AccessToken(token)
-            # Convert timestamp to datetime
-            expires_at = datetime.fromtimestamp(token_obj["exp"], tz=timezone.utc)
-
-            outstanding_token = OutstandingToken.objects.create(
-                token=token,
-                user_id=request.user.id,
-                jti=token_obj["jti"],
-                expires_at=expires_at,
-            )
-            BlacklistedToken.objects.create(token=outstanding_token)
-        except Exception as token_error:
-            logger.error(f"Error blacklisting token: {str(token_error)}")
-            # Even if token blacklisting fails, we've already unselected products
-            # Just log the error and return success
-
+        end_session(request.user, token)
         return Response({"message": "Successfully logged out"})
     except Exception as e:
-        logger.error(f"Error during logout: {str(e)}")
+        logger.error("Error during logout: %s", e)
         return Response(
             {"error": "Failed to logout"}, status=status.HTTP_400_BAD_REQUEST
         )
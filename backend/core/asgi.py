@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "core.settings")
 
 application = get_asgi_application()
+
+from api.leaderboard import leaderboard  # noqa: E402
+
+# Load the most selected products ranking before the first request
+leaderboard.warm()
@@ -0,0 +1,13 @@
+"""
+URL configuration serving the async API endpoints (``API_ASYNC_VIEWS``).
+
+Meant for the ASGI application; see ``api.async_views``.
+"""
+
+from django.contrib import admin
+from django.urls import path, include
+
+urlpatterns = [
+    path("admin/", admin.site.urls),
+    path("api/", include("api.async_urls")),
+]
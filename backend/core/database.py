@@ -0,0 +1,75 @@
+"""
+Database performance profiles, picked with ``DATABASE_PROFILE``.
+
+``default`` leaves Django's defaults: a new connection per request and, on
+SQLite, the rollback journal, where a writer blocks every reader.
+
+``performance`` keeps connections open between requests, checking them
+before reuse. PostgreSQL uses Django's psycopg pool instead when psycopg 3
+and psycopg_pool are installed. SQLite connections switch the database to
+WAL, so readers and the writer don't block each other, and wait for the
+write lock instead of failing with "database is locked". Transactions take
+the write lock when they begin, since a transaction that reads before it
+writes can't wait for the lock once another writer has committed.
+"""
+
+import importlib.util
+
+PROFILES = ("default", "performance")
+# OPTIONS a profile may set
+PROFILE_OPTIONS = ("init_command", "transaction_mode", "pool")
+
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    # Durable across application crashes; only a power loss can drop the
+    # last transactions, never corrupt the database
+    "synchronous": "NORMAL",
+    "busy_timeout": 5000,
+    "mmap_size": 256 * 1024 * 1024,
+    # Negative sizes are in KiB: 64 MiB of page cache per connection
+    "cache_size": -64 * 1024,
+    "temp_store": "MEMORY",
+}
+
+
+def has_psycopg_pool():
+    return all(
+        importlib.util.find_spec(module) is not None
+        for module in ("psycopg", "psycopg_pool")
+    )
+
+
+def apply_profile(database, profile, conn_max_age=600, pool_max_size=4):
+    """Return a copy of a ``DATABASES`` entry configured for ``profile``."""
+    if profile not in PROFILES:
+        raise ValueError(
+            f"Unknown database profile {profile!r}; use one of {', '.join(PROFILES)}"
+        )
+    database = {**database, "OPTIONS": {**database.get("OPTIONS", {})}}
+    if profile == "default":
+        return database
+
+    engine = database["ENGINE"]
+    if engine.endswith("sqlite3"):
+        database["OPTIONS"].setdefault(
+            "init_command",
+            ";".join(
+                f"PRAGMA {name}={value}" for name, value in SQLITE_PRAGMAS.items()
+            ),
+        )
+        database["OPTIONS"].setdefault("transaction_mode", "IMMEDIATE")
+    elif engine.endswith("postgresql") and has_psycopg_pool():
+        from psycopg_pool import ConnectionPool
+
+        pool = {"min_size": 1, "max_size": pool_max_size, "timeout": 10}
+        if hasattr(ConnectionPool, "check_connection"):
+            # psycopg_pool 3.2+: check connections as they leave the pool
+            pool["check"] = ConnectionPool.check_connection
+        # Pooled connections are returned after each request, so they can't
+        # also be persistent
+        database["CONN_MAX_AGE"] = 0
+        database["OPTIONS"].setdefault("pool", pool)
+        return database
+    database["CONN_MAX_AGE"] = conn_max_age
+    database["CONN_HEALTH_CHECKS"] = True
+    return database
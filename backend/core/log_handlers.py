@@ -0,0 +1,151 @@
+"""
+Logging that never blocks the request thread on I/O.
+
+``QueueingHandler`` is the only handler attached to loggers. Its ``emit``
+puts the unformatted record on a bounded in-memory queue. A ``QueueListener``
+thread takes records off the queue, formats them and writes them to a
+rotating file of JSON lines and, optionally, to the console.
+
+When the queue is full the record is dropped rather than waiting for the
+writer. Records below WARNING are dropped earlier, once the queue is
+``shed_fraction`` full, so errors still get through a burst of debug output.
+``sample_rates`` keeps only a fraction of the records of chatty levels to
+begin with. Dropped records are counted and reported in a warning once the
+queue has room again.
+
+Every worker process has its own listener. With ``per_process`` each one
+writes to a file of its own, named after its pid (``django.<pid>.jsonl``),
+so processes never rotate a file another one is writing to.
+"""
+
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import sys
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+# Attributes every LogRecord has; anything else was passed with ``extra=``
+_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+
+class JSONFormatter(logging.Formatter):
+    """Formats records as one JSON object per line."""
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(
+                timespec="milliseconds"
+            ),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "process": record.process,
+            "thread": record.threadName,
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        if record.stack_info:
+            entry["stack"] = self.formatStack(record.stack_info)
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and key not in entry:
+                entry[key] = value
+        return json.dumps(entry, default=str)
+
+
+class QueueingHandler(QueueHandler):
+    def __init__(
+        self,
+        filename=None,
+        max_bytes=10 * 1024 * 1024,
+        backup_count=5,
+        file_level=None,
+        per_process=False,
+        console_level=None,
+        queue_size=10000,
+        shed_fraction=0.8,
+        sample_rates=None,
+        handlers=None,
+    ):
+        super().__init__(queue.Queue(maxsize=queue_size))
+        self.shed_size = int(queue_size * shed_fraction)
+        # Level name -> fraction of records kept, e.g. {"DEBUG": 0.1}
+        self.sample_rates = {
+            logging.getLevelName(level): rate
+            for level, rate in (sample_rates or {}).items()
+        }
+        self.dropped = 0
+
+        handlers = list(handlers or [])
+        if filename:
+            if per_process:
+                root, extension = os.path.splitext(filename)
+                filename = f"{root}.{os.getpid()}{extension}"
+            file_handler = RotatingFileHandler(
+                filename, maxBytes=max_bytes, backupCount=backup_count, delay=True
+            )
+            if file_level:
+                file_handler.setLevel(file_level)
+            file_handler.setFormatter(JSONFormatter())
+            handlers.append(file_handler)
+        if console_level:
+            console = logging.StreamHandler(sys.stderr)
+            console.setLevel(console_level)
+            console.setFormatter(
+                logging.Formatter("[{levelname}] {message}", style="{")
+            )
+            handlers.append(console)
+        self.listener = QueueListener(self.queue, *handlers, respect_handler_level=True)
+        self.listener.start()
+        self.stopped = False
+        atexit.register(self.close)
+
+    def prepare(self, record):
+        # Unlike QueueHandler.prepare, leave formatting to the listener thread
+        return record
+
+    def emit(self, record):
+        rate = self.sample_rates.get(record.levelno)
+        if rate is not None and random.random() >= rate:
+            return
+        if record.levelno < logging.WARNING and self.queue.qsize() >= self.shed_size:
+            self.dropped += 1
+            return
+        try:
+            self.enqueue(self.prepare(record))
+        except queue.Full:
+            self.dropped += 1
+            return
+        if self.dropped:
+            self.report_dropped()
+
+    def report_dropped(self):
+        dropped, self.dropped = self.dropped, 0
+        record = logging.makeLogRecord(
+            {
+                "name": __name__,
+                "levelno": logging.WARNING,
+                "levelname": "WARNING",
+                "msg": "Dropped %d log records while the log queue was full",
+                "args": (dropped,),
+            }
+        )
+        try:
+            self.enqueue(record)
+        except queue.Full:
+            self.dropped += dropped
+
+    def enqueue(self, record):
+        self.queue.put_nowait(record)
+
+    def close(self):
+        # Stopping the listener writes out what is still queued
+        if not self.stopped:
+            self.stopped = True
+            self.listener.stop()
+        for handler in self.listener.handlers:
+            handler.close()
+        super().close()
@@ -20,38 +20,43 @@ except (IOError, PermissionError):
 
 print(f"Using log directory: {log_dir}")
 
+LOG_LEVEL = os.environ.get("DJANGO_LOG_LEVEL", "INFO").upper()
+
+# All records go through one queue; a background thread formats and writes
+# them (see core.log_handlers), so request threads never wait on log I/O.
 LOGGING = {
     "version": 1,
     "disable_existing_loggers": False,
-    "formatters": {
-        "simple": {
-            "format": "[{levelname}] {message}",
-            "style": "{",
-        },
-    },
     "handlers": {
-        "console": {
-            "level": "INFO",
-            "class": "logging.StreamHandler",
-            "formatter": "simple",
-        },
-        "file": {
-            "level": "WARNING",
-            "class": "logging.FileHandler",
-            "filename": os.path.join(log_dir, "django.log"),
-            "formatter": "simple",
+        "queue": {
+            "()": "core.log_handlers.QueueingHandler",
+            # One file per worker process: django.<pid>.jsonl
+            "filename": os.path.join(log_dir, "django.jsonl"),
+            "per_process": True,
+            "max_bytes": 10 * 1024 * 1024,
+            "backup_count": 5,
+            "file_level": "WARNING",
+            "console_level": "INFO",
+            "queue_size": 10000,
+            # Debug output is for spotting patterns, not a complete record
+            "sample_rates": {"DEBUG": 0.1},
         },
     },
     "loggers": {
         "django": {
-            "handlers": ["console", "file"],
+            "handlers": ["queue"],
             "level": "INFO",
             "propagate": False,
         },
         "django.db.backends": {
-            "handlers": ["file"],
+            "handlers": ["queue"],
             "level": "WARNING",
             "propagate": False,
         },
+        "api": {
+            "handlers": ["queue"],
+            "level": LOG_LEVEL,
+            "propagate": False,
+        },
     },
 }
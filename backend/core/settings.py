@@ -12,7 +12,9 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 
 from pathlib import Path
 import os
+import tempfile
 import dj_database_url
+from .database import apply_profile
 from .logging_settings import LOGGING  # Import logging settings
 
 # Configure Django logging with the imported LOGGING settings
@@ -56,6 +58,10 @@ INSTALLED_APPS = [
 AUTH_USER_MODEL = "api.CustomUser"
 
 MIDDLEWARE = [
+    "api.metrics.MetricsMiddleware",
+    "api.admission.AdmissionMiddleware",
+    "api.compression.CompressionMiddleware",
+    "api.routers.ReplicaRoutingMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "corsheaders.middleware.CorsMiddleware",
@@ -66,7 +72,59 @@ MIDDLEWARE = [
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
 
-ROOT_URLCONF = "core.urls"
+# Admission control (api.admission). Limits are concurrent requests per view
+# and process; the rest wait in line or are shed with 503.
+API_ADMISSION_LIMITS = {
+    "product-list": 4,
+    "product-detail": 4,
+    "product-export": 1,
+    "product-select": 2,
+    "product-bulk-select": 1,
+    "login": 2,
+}
+API_ADMISSION_DEFAULT_LIMIT = int(os.environ.get("API_ADMISSION_DEFAULT_LIMIT", 8))
+# Threads per gunicorn worker (--threads); a view's admitted and waiting
+# requests leave the reserved ones free for other views
+API_WORKER_THREADS = int(os.environ.get("API_WORKER_THREADS", 8))
+API_ADMISSION_RESERVED_THREADS = int(
+    os.environ.get("API_ADMISSION_RESERVED_THREADS", 2)
+)
+# Unset: each view's line fills the threads its limit leaves unreserved
+API_ADMISSION_QUEUE_SIZE = (
+    int(os.environ["API_ADMISSION_QUEUE_SIZE"])
+    if os.environ.get("API_ADMISSION_QUEUE_SIZE")
+    else None
+)
+API_ADMISSION_QUEUE_TIMEOUT = float(os.environ.get("API_ADMISSION_QUEUE_TIMEOUT", 5))
+API_ADMISSION_RETRY_AFTER = 1
+# Long-lived or operational views that are never shed
+API_ADMISSION_EXEMPT = ["metrics", "product-events"]
+# Per-user token buckets shared by the worker processes; 0 disables them
+API_RATE_LIMIT_PER_SECOND = float(os.environ.get("API_RATE_LIMIT_PER_SECOND", 0))
+API_RATE_LIMIT_BURST = float(
+    os.environ.get("API_RATE_LIMIT_BURST", 2 * API_RATE_LIMIT_PER_SECOND)
+)
+API_RATE_LIMIT_DB = os.environ.get(
+    "API_RATE_LIMIT_DB", os.path.join(tempfile.gettempdir(), "api-rate-limits.sqlite3")
+)
+
+# Selection events (api.events): with SQLite, the processes on the host
+# exchange them through this file
+API_EVENTS_DB = os.environ.get(
+    "API_EVENTS_DB", os.path.join(tempfile.gettempdir(), "api-events.sqlite3")
+)
+
+# Smallest response body api.compression.CompressionMiddleware compresses
+API_COMPRESSION_MIN_BYTES = int(os.environ.get("API_COMPRESSION_MIN_BYTES", 1024))
+
+# Age after which api.leaderboard rebuilds its ranking from the database
+API_LEADERBOARD_RECONCILE_SECONDS = float(
+    os.environ.get("API_LEADERBOARD_RECONCILE_SECONDS", 60)
+)
+
+# Async product and session endpoints (api.async_views), for the ASGI server
+API_ASYNC_VIEWS = os.environ.get("API_ASYNC_VIEWS", "").lower() in ("1", "true", "yes")
+ROOT_URLCONF = "core.async_urls" if API_ASYNC_VIEWS else "core.urls"
 
 TEMPLATES = [
     {
@@ -101,6 +159,49 @@ DATABASES = {
 if "DATABASE_URL" in os.environ:
     DATABASES["default"] = dj_database_url.config()
 
+# Persistent or pooled connections and SQLite WAL tuning; "default" keeps
+# Django's defaults (see core.database)
+DATABASES["default"] = apply_profile(
+    DATABASES["default"],
+    os.environ.get("DATABASE_PROFILE", "performance"),
+    conn_max_age=int(os.environ.get("DATABASE_CONN_MAX_AGE", 600)),
+    pool_max_size=int(os.environ.get("DATABASE_POOL_MAX_SIZE", 4)),
+)
+
+# Read replicas for product reads (api.routers): a comma-separated list of
+# DATABASE_URL-style URLs, e.g. a copy of db.sqlite3 when testing locally
+DATABASE_REPLICAS = []
+for index, url in enumerate(
+    url for url in os.environ.get("DATABASE_REPLICA_URLS", "").split(",") if url
+):
+    alias = f"replica{index + 1}"
+    DATABASES[alias] = apply_profile(
+        dj_database_url.parse(url.strip()),
+        os.environ.get("DATABASE_PROFILE", "performance"),
+        conn_max_age=int(os.environ.get("DATABASE_CONN_MAX_AGE", 600)),
+        pool_max_size=int(os.environ.get("DATABASE_POOL_MAX_SIZE", 4)),
+    )
+    # Tests read the primary's test database through replica aliases
+    DATABASES[alias]["TEST"] = {"MIRROR": "default"}
+    DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ["api.routers.ReplicaRouter"]
+# Users who wrote read from the primary for this long
+DATABASE_STICKY_SECONDS = float(os.environ.get("DATABASE_STICKY_SECONDS", 5))
+# Must be shared by all worker processes
+DATABASE_PIN_CACHE = "replica_pins"
+
+CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+    "replica_pins": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": os.environ.get(
+            "DATABASE_PIN_CACHE_DIR",
+            os.path.join(tempfile.gettempdir(), "api-replica-pins"),
+        ),
+    },
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -180,18 +281,41 @@ CORS_ALLOW_HEADERS = [
     "x-requested-with",
 ]
 
-# REST Framework settings
+# REST Framework settings. ClaimsJWTAuthentication trusts the token's claims
+# instead of loading the user per request. Deactivating or deleting a user
+# revokes the tokens issued to it until then (api.blacklist); other processes
+# reject them within TOKEN_BLACKLIST_REFRESH_SECONDS (1 s).
 REST_FRAMEWORK = {
     "DEFAULT_PERMISSION_CLASSES": [
         "rest_framework.permissions.IsAuthenticated",
     ],
     "DEFAULT_AUTHENTICATION_CLASSES": [
-        "rest_framework_simplejwt.authentication.JWTAuthentication",
+        "api.authentication.ClaimsJWTAuthentication",
         "rest_framework.authentication.SessionAuthentication",
         "rest_framework.authentication.BasicAuthentication",
     ],
 }
 
+# Opt-in orjson renderer and parser (api.renderers), byte-compatible with
+# DRF's JSONRenderer for compact output
+if os.environ.get("API_FAST_JSON", "").lower() in ("1", "true", "yes"):
+    REST_FRAMEWORK["DEFAULT_RENDERER_CLASSES"] = [
+        "api.renderers.ORJSONRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ]
+    REST_FRAMEWORK["DEFAULT_PARSER_CLASSES"] = [
+        "api.renderers.ORJSONParser",
+        "rest_framework.parsers.FormParser",
+        "rest_framework.parsers.MultiPartParser",
+    ]
+
+# Request metrics served at /api/metrics. Each worker process writes its
+# counters to this directory so that a scrape sees all of them.
+API_METRICS_DIR = os.environ.get("API_METRICS_DIR")
+# Require "Authorization: Bearer <token>" on scrapes when set; without it
+# only scrapes made on the host, not through nginx, are answered
+API_METRICS_TOKEN = os.environ.get("API_METRICS_TOKEN")
+
 # Custom authentication backend
 AUTHENTICATION_BACKENDS = [
     "api.auth.AnyCredentialsBackend",
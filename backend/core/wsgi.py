@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "core.settings")
 
 application = get_wsgi_application()
+
+from api.leaderboard import leaderboard  # noqa: E402
+
+# Load the most selected products ranking before the first request
+leaderboard.warm()
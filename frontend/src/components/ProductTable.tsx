@@ -1,6 +1,6 @@
-import { Table, TextInput, Paper, Stack, Container, Button, Group, Text, Skeleton, UnstyledButton, Center } from '@mantine/core';
-import { useState, useEffect, useCallback } from 'react';
-import { getToken, removeToken } from '../utils/auth';
+import { Table, Autocomplete, Paper, Stack, Container, Button, Group, Text, Skeleton, UnstyledButton, Center } from '@mantine/core';
+import { useState, useEffect, useCallback, useRef } from 'react';
+import { getToken, getUser, removeToken } from '../utils/auth';
 import { useUser } from '../contexts/UserContext';
 import { IconChevronUp, IconChevronDown, IconSelector } from '@tabler/icons-react';
 import { getApiUrl } from '@/utils/config';
@@ -11,10 +11,36 @@ interface Product {
   description: string;
   price: string | number;
   stock: number;
+  selection_count: number;
   is_selected: boolean;
-  selected_by_username: string | null;
+  selected_by_usernames: string[];
 }
 
+// Compact selection delta pushed by /api/products/events/
+interface SelectionDelta {
+  username: string;
+  added: number[];
+  removed: number[];
+}
+
+interface ProductPage {
+  next: string | null;
+  results: Product[];
+}
+
+// Completions returned by /api/products/suggest/
+interface Suggestions {
+  terms: { term: string; count: number }[];
+  products: { id: number; name: string }[];
+}
+
+// Columns the API can order by (keyset pagination on the server)
+const SORTABLE_FIELDS: (keyof Product)[] = ['name', 'price', 'stock'];
+const PAGE_SIZE = 50;
+const SUGGEST_LIMIT = 5;
+// Trailing word of a query, the part the suggested terms complete
+const LAST_WORD = new RegExp('[\\p{L}\\p{N}_]+$', 'u');
+
 interface ThProps {
   children: React.ReactNode;
   sortBy: keyof Product | null;
@@ -51,14 +77,21 @@ export function ProductTable() {
   const [searchQuery, setSearchQuery] = useState(() => 
     localStorage.getItem(STORAGE_KEYS.SEARCH_QUERY) || ''
   );
-  const [sortBy, setSortBy] = useState<keyof Product>(() => 
-    (localStorage.getItem(STORAGE_KEYS.SORT_BY) as keyof Product) || 'name'
-  );
+  const [sortBy, setSortBy] = useState<keyof Product>(() => {
+    const saved = localStorage.getItem(STORAGE_KEYS.SORT_BY) as keyof Product;
+    return SORTABLE_FIELDS.includes(saved) ? saved : 'name';
+  });
   const [sortOrder, setSortOrder] = useState<'asc' | 'desc'>(() => 
     (localStorage.getItem(STORAGE_KEYS.SORT_ORDER) as 'asc' | 'desc') || 'asc'
   );
   const [isSearching, setIsSearching] = useState(false);
   const [products, setProducts] = useState<Product[]>([]);
+  const [nextPageUrl, setNextPageUrl] = useState<string | null>(null);
+  const [isLoadingMore, setIsLoadingMore] = useState(false);
+  const [resyncCount, setResyncCount] = useState(0);
+  // Whether the event stream is connected; without it, selects refetch
+  const isStreamOpen = useRef(false);
+  const [suggestions, setSuggestions] = useState<string[]>([]);
   const [isLoading, setIsLoading] = useState(() => {
     // Only show loading if we have a saved search
     return !!localStorage.getItem(STORAGE_KEYS.SEARCH_QUERY);
@@ -91,11 +124,12 @@ export function ProductTable() {
     return !isNaN(numPrice) ? `$${numPrice.toFixed(2)}` : '$0.00';
   };
 
-  const fetchProducts = useCallback(async (search?: string) => {
+  const fetchProducts = useCallback(async (search?: string, pageUrl?: string) => {
     // Don't fetch if there's no search query
     if (!search?.trim()) {
       setIsLoading(false);
       setProducts([]);
+      setNextPageUrl(null);
       setIsSearching(false);
       return;
     }
@@ -113,23 +147,31 @@ export function ProductTable() {
     // Check if the URL is absolute or relative
     const isAbsoluteUrl = apiUrl.startsWith('http://') || apiUrl.startsWith('https://');
     
-    // Create the final URL with search parameter
+    // Create the final URL with search, ordering and page size parameters
+    const params = new URLSearchParams({
+      search,
+      ordering: `${sortOrder === 'desc' ? '-' : ''}${sortBy}`,
+      page_size: String(PAGE_SIZE),
+    });
     let finalUrl: string;
     
-    if (isAbsoluteUrl) {
+    if (pageUrl) {
+      // Follow the opaque cursor link returned by the previous page
+      finalUrl = pageUrl;
+    } else if (isAbsoluteUrl) {
       // For absolute URLs, use URL constructor
       try {
         const url = new URL(apiUrl);
-        url.searchParams.append('search', search);
+        params.forEach((value, key) => url.searchParams.append(key, value));
         finalUrl = url.toString();
       } catch (error) {
         console.error('Error creating URL object:', error);
         // Fallback to manual query string construction
-        finalUrl = `${apiUrl}${apiUrl.includes('?') ? '&' : '?'}search=${encodeURIComponent(search)}`;
+        finalUrl = `${apiUrl}${apiUrl.includes('?') ? '&' : '?'}${params.toString()}`;
       }
     } else {
       // For relative URLs, manually construct the query string
-      finalUrl = `${apiUrl}${apiUrl.includes('?') ? '&' : '?'}search=${encodeURIComponent(search)}`;
+      finalUrl = `${apiUrl}${apiUrl.includes('?') ? '&' : '?'}${params.toString()}`;
     }
     
     console.log('Validating token with request to:', finalUrl);
@@ -168,14 +210,20 @@ export function ProductTable() {
         throw new Error(`Failed to fetch products: ${response.status}`);
       }
       
-      const data = await response.json();
-      await new Promise(resolve => setTimeout(resolve, 250));
+      const data: ProductPage = await response.json();
       
-      setProducts(data);
+      if (pageUrl) {
+        setProducts(prevProducts => [...prevProducts, ...data.results]);
+      } else {
+        await new Promise(resolve => setTimeout(resolve, 250));
+        setProducts(data.results);
+      }
+      setNextPageUrl(data.next);
       setIsSearching(false);
     } catch (error) {
       console.error('Error fetching products:', error);
       setProducts([]);
+      setNextPageUrl(null);
       
       // Check if the error is an instance of Error and contains 401
       if (error instanceof Error && 
@@ -186,49 +234,65 @@ export function ProductTable() {
     } finally {
       setIsLoading(false);
     }
-  }, [setUser]);
+  }, [setUser, sortBy, sortOrder]);
 
-  // Effect to handle sorting whenever products, sortBy, or sortOrder changes
-  useEffect(() => {
-    if (products.length > 0) {
-      setProducts(prevProducts => sortProducts(prevProducts, sortBy, sortOrder));
+  const handleLoadMore = async () => {
+    if (!nextPageUrl) return;
+    setIsLoadingMore(true);
+    try {
+      await fetchProducts(searchQuery, nextPageUrl);
+    } finally {
+      setIsLoadingMore(false);
     }
-  }, [sortBy, sortOrder, products.length]);
-
-  // Helper function to sort products
-  const sortProducts = (products: Product[], field: keyof Product, order: 'asc' | 'desc') => {
-    return [...products].sort((a, b) => {
-      let aValue = a[field];
-      let bValue = b[field];
-
-      // Handle special cases for price
-      if (field === 'price') {
-        aValue = typeof aValue === 'string' ? parseFloat(aValue) : aValue;
-        bValue = typeof bValue === 'string' ? parseFloat(bValue) : bValue;
-      }
+  };
 
-      // Handle string comparison
-      if (typeof aValue === 'string' && typeof bValue === 'string') {
-        return order === 'asc' 
-          ? aValue.localeCompare(bValue)
-          : bValue.localeCompare(aValue);
-      }
+  // Completions from the server's prefix index while typing
+  useEffect(() => {
+    const query = searchQuery.trimStart();
+    const token = getToken();
+    if (!query || !token) {
+      setSuggestions([]);
+      return;
+    }
 
-      // Handle number comparison
-      if (typeof aValue === 'number' && typeof bValue === 'number') {
-        return order === 'asc' 
-          ? aValue - bValue 
-          : bValue - aValue;
+    const controller = new AbortController();
+    const timer = setTimeout(async () => {
+      const apiUrl = getApiUrl('products/suggest/');
+      const params = new URLSearchParams({ q: query, limit: String(SUGGEST_LIMIT) });
+      try {
+        const response = await fetch(
+          `${apiUrl}${apiUrl.includes('?') ? '&' : '?'}${params.toString()}`,
+          {
+            headers: { 'Authorization': `Bearer ${token}` },
+            signal: controller.signal,
+          }
+        );
+        if (!response.ok) return;
+        const data: Suggestions = await response.json();
+        const head = query.replace(LAST_WORD, '');
+        const options = [
+          ...data.terms.map(({ term }) => head + term),
+          ...data.products.map(({ name }) => name),
+        ];
+        setSuggestions(Array.from(new Set(options)));
+      } catch (error) {
+        if (!(error instanceof DOMException && error.name === 'AbortError')) {
+          console.error('Error fetching suggestions:', error);
+        }
       }
+    }, 150);
 
-      return 0;
-    });
-  };
+    return () => {
+      clearTimeout(timer);
+      controller.abort();
+    };
+  }, [searchQuery]);
 
   // Debounced search
   useEffect(() => {
     if (!searchQuery.trim()) {
       setProducts([]);
+      setNextPageUrl(null);
       setIsLoading(false);
       return;
     }
@@ -239,16 +303,69 @@ export function ProductTable() {
     }, 1000);
 
     return () => clearTimeout(timer);
-  }, [searchQuery, fetchProducts]);
+  }, [searchQuery, fetchProducts, resyncCount]);
+
+  // Apply selection changes pushed by the server instead of refetching
+  useEffect(() => {
+    const token = getToken();
+    if (!token || typeof EventSource === 'undefined') return;
+
+    const currentUsername = getUser()?.username;
+    const source = new EventSource(
+      `${getApiUrl('products/events')}?token=${encodeURIComponent(token)}`
+    );
+
+    source.onopen = () => {
+      isStreamOpen.current = true;
+    };
+    // EventSource reconnects by itself; refetch after selects in the meantime
+    source.onerror = () => {
+      isStreamOpen.current = false;
+    };
+
+    source.addEventListener('selection', (message) => {
+      const delta: SelectionDelta = JSON.parse((message as MessageEvent).data);
+      const added = new Set(delta.added);
+      const removed = new Set(delta.removed);
+      const isCurrentUser = delta.username === currentUsername;
+
+      setProducts(prevProducts => prevProducts.map(product => {
+        if (added.has(product.id) && !product.selected_by_usernames.includes(delta.username)) {
+          return {
+            ...product,
+            is_selected: product.is_selected || isCurrentUser,
+            selection_count: product.selection_count + 1,
+            selected_by_usernames: [...product.selected_by_usernames, delta.username],
+          };
+        }
+        if (removed.has(product.id) && product.selected_by_usernames.includes(delta.username)) {
+          return {
+            ...product,
+            is_selected: product.is_selected && !isCurrentUser,
+            selection_count: Math.max(product.selection_count - 1, 0),
+            selected_by_usernames: product.selected_by_usernames.filter(name => name !== delta.username),
+          };
+        }
+        return product;
+      }));
+    });
+
+    // The server dropped events for this stream; reload the current results
+    source.addEventListener('resync', () => setResyncCount(count => count + 1));
+
+    return () => {
+      source.close();
+      isStreamOpen.current = false;
+    };
+  }, []);
 
   const handleSort = (field: keyof Product) => {
+    if (!SORTABLE_FIELDS.includes(field)) return;
     const isAsc = sortBy === field && sortOrder === 'asc';
     const newSortOrder = isAsc ? 'desc' : 'asc';
     setSortOrder(newSortOrder);
     setSortBy(field);
-    
-    // Sort the existing products without fetching
-    setProducts(prevProducts => sortProducts(prevProducts, field, newSortOrder));
+    // Changing the ordering refetches the first page through fetchProducts
   };
 
   const handleLogout = async () => {
@@ -289,6 +406,7 @@ export function ProductTable() {
       
       // Clear application state
       setProducts([]);
+      setNextPageUrl(null);
       setUser(null);
       
       // Redirect to login
@@ -342,6 +460,10 @@ export function ProductTable() {
           product.id === productId ? updatedProduct : product
         )
       );
+      // Nothing pushes other users' changes; reload the current results
+      if (!isStreamOpen.current) {
+        setResyncCount(count => count + 1);
+      }
     } catch (error) {
       console.error('Error selecting product:', error);
       
@@ -384,10 +506,13 @@ export function ProductTable() {
       <Stack h="100%" gap="md">
         <Paper p="md" withBorder>
           <Group justify="space-between" align="center">
-            <TextInput
+            <Autocomplete
               placeholder="Search products..."
               value={searchQuery}
-              onChange={(e) => setSearchQuery(e.target.value)}
+              onChange={setSearchQuery}
+              data={suggestions}
+              // Already filtered and ranked by the server
+              filter={({ options }) => options}
               style={{ flex: 1 }}
             />
             <Group gap="md">
@@ -410,7 +535,7 @@ export function ProductTable() {
             <Table.Thead>
               <Table.Tr>
                 <Th sortBy={sortBy} onSort={handleSort} reversed={sortOrder === 'desc'} width="20%">Name</Th>
-                <Th sortBy={sortBy} onSort={handleSort} reversed={sortOrder === 'desc'} width="40%">Description</Th>
+                <Table.Th style={{ width: '40%' }}>Description</Table.Th>
                 <Th sortBy={sortBy} onSort={handleSort} reversed={sortOrder === 'desc'} width="15%">Price</Th>
                 <Th sortBy={sortBy} onSort={handleSort} reversed={sortOrder === 'desc'} width="15%">Stock</Th>
                 <Table.Th style={{ width: '10%' }}>Status</Table.Th>
@@ -447,6 +572,13 @@ export function ProductTable() {
               )}
             </Table.Tbody>
           </Table>
+          {nextPageUrl && !isLoading && (
+            <Center p="md">
+              <Button variant="light" size="sm" onClick={handleLoadMore} loading={isLoadingMore}>
+                Load more
+              </Button>
+            </Center>
+          )}
         </Paper>
       </Stack>
     </Container>
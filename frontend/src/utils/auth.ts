@@ -42,7 +42,8 @@ export const isValidToken = async (): Promise<boolean> => {
 
   try {
     // Validate token by making a request to products endpoint
-    const apiUrl = getApiUrl('products');
+    // Only a single row's id is needed to prove the token is accepted
+    const apiUrl = `${getApiUrl('products')}?page_size=1&fields=id`;
     console.log('Validating token with request to:', apiUrl);
     
     // Add timeout to prevent hanging requests